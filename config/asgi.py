@@ -3,6 +3,9 @@ ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Necessário para o stream de eventos do Kanban (crm/views_eventos.py), ex.:
+    gunicorn -k uvicorn.workers.UvicornWorker config.asgi:application
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
@@ -53,6 +53,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Sai da cadeia (MiddlewareNotUsed) quando CRM_INSTRUMENTACAO=False
+    'crm.instrumentacao.InstrumentacaoMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -107,15 +109,93 @@ else:
     }
 
 # Cache Configuration for Performance
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'mini-crm-cache',
-        'TIMEOUT': 300,  # 5 minutes default timeout
-        'OPTIONS': {
-            'MAX_ENTRIES': 1000
+# Cache compartilhado (Redis) quando REDIS_URL estiver definido; sem ele,
+# LocMemCache por processo (desenvolvimento / servidor com um único worker).
+#   REDIS_URL=redis://localhost:6379/1
+#   REDIS_CONNECTION_CLASS=fakeredis.FakeConnection  (testes sem redis-server)
+REDIS_URL = os.environ.get('REDIS_URL', '').strip()
+
+if REDIS_URL:
+    _redis_options = {
+        'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        # Redis fora do ar vira cache miss em vez de erro 500
+        'IGNORE_EXCEPTIONS': os.environ.get('REDIS_IGNORE_EXCEPTIONS', 'True') == 'True',
+    }
+    if os.environ.get('REDIS_CONNECTION_CLASS'):
+        from django.utils.module_loading import import_string
+        _redis_options['CONNECTION_POOL_KWARGS'] = {
+            'connection_class': import_string(os.environ['REDIS_CONNECTION_CLASS']),
+        }
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'TIMEOUT': 300,  # 5 minutes default timeout
+            'KEY_PREFIX': os.environ.get('CACHE_KEY_PREFIX', 'mini-crm'),
+            'OPTIONS': _redis_options,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'mini-crm-cache',
+            'TIMEOUT': 300,  # 5 minutes default timeout
+            'OPTIONS': {
+                'MAX_ENTRIES': 1000
+            }
         }
     }
+
+# Importação de planilhas: linhas gravadas por bulk_create
+IMPORTACAO_TAMANHO_LOTE = int(os.environ.get('IMPORTACAO_TAMANHO_LOTE', '500'))
+# Executor das importações em segundo plano:
+#   'thread'  -> ThreadPoolExecutor no processo web (padrão, sem serviços extras)
+#   'comando' -> jobs ficam pendentes para `python manage.py processar_importacoes`
+IMPORTACAO_EXECUTOR = os.environ.get('IMPORTACAO_EXECUTOR', 'thread')
+IMPORTACAO_MAX_WORKERS = int(os.environ.get('IMPORTACAO_MAX_WORKERS', '1'))
+# Job 'processando' sem progresso há mais que isso é considerado travado (worker
+# interrompido): processar_importacoes o devolve à fila até IMPORTACAO_MAX_TENTATIVAS
+IMPORTACAO_TEMPO_LIMITE_MINUTOS = int(os.environ.get('IMPORTACAO_TEMPO_LIMITE_MINUTOS', '15'))
+IMPORTACAO_MAX_TENTATIVAS = int(os.environ.get('IMPORTACAO_MAX_TENTATIVAS', '3'))
+
+# Eventos do Kanban em tempo real (SSE, requer servidor ASGI):
+#   'memoria' -> pub/sub no próprio processo (um único worker)
+#   'redis'   -> canal no REDIS_URL (vários workers); só quando configurado
+#                explicitamente (com WSGI não há assinantes)
+KANBAN_EVENTOS_BACKEND = os.environ.get('KANBAN_EVENTOS_BACKEND', 'memoria')
+# Timeout (segundos) de conexão/leitura do cliente Redis que publica os eventos
+KANBAN_EVENTOS_REDIS_TIMEOUT = float(os.environ.get('KANBAN_EVENTOS_REDIS_TIMEOUT', '0.5'))
+
+# Instrumentação de requisições (crm/instrumentacao.py): consultas SQL, tempo de
+# SQL/templates, cabeçalho Server-Timing, log 'crm.instrumentacao' e p50/p95 por
+# view em /crm/admin/desempenho-requisicoes/ (últimas N requisições, por processo)
+CRM_INSTRUMENTACAO = os.environ.get('CRM_INSTRUMENTACAO', 'False') == 'True'
+CRM_INSTRUMENTACAO_AMOSTRAS = int(os.environ.get('CRM_INSTRUMENTACAO_AMOSTRAS', '2000'))
+
+# Logs da aplicação (logger 'crm.*') no console; CRM_LOG_LEVEL=DEBUG mostra
+# os detalhes de criação de registro e registro de contato
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simples': {
+            'format': '{asctime} {levelname} {name} {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'simples',
+        },
+    },
+    'loggers': {
+        'crm': {
+            'handlers': ['console'],
+            'level': os.environ.get('CRM_LOG_LEVEL', 'INFO'),
+        },
+    },
 }
 
 # Password validation
@@ -156,6 +236,10 @@ STATIC_URL = 'static/'
 # Static files collection target (required for collectstatic in production)
 STATIC_ROOT = os.environ.get('STATIC_ROOT', str(BASE_DIR / 'staticfiles'))
 
+# Uploads (planilhas aguardando importação)
+MEDIA_URL = 'media/'
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', str(BASE_DIR / 'media'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/6.0/ref/settings/#default-auto-field
 
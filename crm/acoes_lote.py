@@ -0,0 +1,200 @@
+"""
+Ações em lote sobre registros do Kanban (mover, arquivar, restaurar, reatribuir).
+
+Cada ação roda em uma transação:
+- um SELECT com o estado anterior dos registros elegíveis (escopo do usuário);
+- um único UPDATE ... WHERE id IN (...);
+- contadores (ContadorPipeline) e métricas consolidadas ajustados por delta,
+  estatísticas em cache invalidadas e eventos do Kanban publicados;
+- ContatoHistorico gravado com bulk_create (registrar_lote).
+
+update() não dispara os signals de RegistroComercial, por isso os ajustes
+de contadores e métricas são feitos aqui (ver crm/contadores.py).
+"""
+
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import contadores, metricas
+from .decorators import is_admin, is_comercial
+from .estatisticas import invalidar_estatisticas
+from .eventos_kanban import publicar_lote
+from .models import ContatoHistorico, RegistroComercial, StatusPipelineChoices
+
+
+ACAO_MOVER_PARA_KANBAN = 'mover_para_kanban'
+ACAO_MOVER_PARA_BACKLOG = 'mover_para_backlog'
+ACAO_ARQUIVAR = 'arquivar'
+ACAO_RESTAURAR = 'restaurar'
+ACAO_REATRIBUIR = 'reatribuir'
+
+ACOES_LOTE = {
+    ACAO_MOVER_PARA_KANBAN: 'Movido para o Kanban',
+    ACAO_MOVER_PARA_BACKLOG: 'Movido para o backlog',
+    ACAO_ARQUIVAR: 'Arquivado',
+    ACAO_RESTAURAR: 'Restaurado para Conta para Contato',
+    ACAO_REATRIBUIR: 'Reatribuído',
+}
+
+# Mesmas permissões das views individuais: arquivar/restaurar/reatribuir são do gestor
+ACOES_SOMENTE_ADMIN = {ACAO_ARQUIVAR, ACAO_RESTAURAR, ACAO_REATRIBUIR}
+
+# Máximo de registros por requisição
+LIMITE_REGISTROS_LOTE = 500
+
+CAMPOS_ESTADO = (
+    'id', 'vendedor_id', 'status_pipeline', 'no_kanban', 'origem',
+    'uf', 'cidade', 'atualizado_em', 'canal_contato',
+)
+
+
+class AcaoLoteInvalida(Exception):
+    """Ação, registros ou parâmetros inválidos para a ação em lote."""
+
+    def __init__(self, mensagem, status=400):
+        super().__init__(mensagem)
+        self.status = status
+
+
+def _alteracoes(acao, novo_vendedor=None):
+    """
+    Filtro de elegibilidade e campos alterados pela ação.
+
+    Registros que já estão no estado final são ignorados (não geram UPDATE
+    nem histórico).
+
+    Returns:
+        tuple: (filtro dict, exclusão dict, campos dict)
+    """
+    arquivada = StatusPipelineChoices.ARQUIVADA.value
+    if acao == ACAO_MOVER_PARA_KANBAN:
+        return {'no_kanban': False}, {'status_pipeline': arquivada}, {'no_kanban': True}
+    if acao == ACAO_MOVER_PARA_BACKLOG:
+        return {'no_kanban': True}, {}, {'no_kanban': False}
+    if acao == ACAO_ARQUIVAR:
+        return {}, {'status_pipeline': arquivada}, {'status_pipeline': arquivada, 'no_kanban': False}
+    if acao == ACAO_RESTAURAR:
+        return {'status_pipeline': arquivada}, {}, {
+            'status_pipeline': StatusPipelineChoices.CONTA_PARA_CONTATO.value,
+            'no_kanban': True,
+        }
+    return {}, {'vendedor_id': novo_vendedor.id}, {'vendedor_id': novo_vendedor.id}
+
+
+def _texto_historico(acao, estado, novo_vendedor, nomes_vendedores):
+    texto = f"{ACOES_LOTE[acao]} (ação em lote)"
+    if acao == ACAO_REATRIBUIR:
+        anterior = nomes_vendedores.get(estado['vendedor_id'], estado['vendedor_id'])
+        novo = novo_vendedor.get_full_name() or novo_vendedor.username
+        texto = f"{texto}: {anterior} → {novo}"
+    return texto
+
+
+def executar_acao_lote(usuario, acao, ids, novo_vendedor_id=None):
+    """
+    Aplica a ação a vários registros de uma vez.
+
+    Args:
+        usuario: Usuário que executa (define o escopo: gestor vê todos,
+            vendedor apenas os próprios registros)
+        acao: Uma das chaves de ACOES_LOTE
+        ids: Lista de ids (UUID) dos registros
+        novo_vendedor_id: Obrigatório para ACAO_REATRIBUIR
+
+    Returns:
+        dict: {'acao', 'atualizados', 'ignorados', 'ids'} onde ids são os
+            registros efetivamente alterados
+
+    Raises:
+        AcaoLoteInvalida: ação desconhecida, sem permissão ou parâmetros inválidos
+    """
+    if acao not in ACOES_LOTE:
+        raise AcaoLoteInvalida('Ação inválida')
+    if acao in ACOES_SOMENTE_ADMIN and not is_admin(usuario):
+        raise AcaoLoteInvalida('Sem permissão', status=403)
+
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise AcaoLoteInvalida('Nenhum registro informado')
+    if len(ids) > LIMITE_REGISTROS_LOTE:
+        raise AcaoLoteInvalida(f'Máximo de {LIMITE_REGISTROS_LOTE} registros por ação')
+
+    novo_vendedor = None
+    if acao == ACAO_REATRIBUIR:
+        novo_vendedor = User.objects.filter(id=novo_vendedor_id, is_active=True).first() if novo_vendedor_id else None
+        # Destino precisa poder trabalhar os leads (mesma regra do acesso ao Kanban)
+        if novo_vendedor is None or not is_comercial(novo_vendedor):
+            raise AcaoLoteInvalida('Vendedor de destino inválido')
+
+    filtro, exclusao, campos = _alteracoes(acao, novo_vendedor)
+
+    registros = RegistroComercial.objects.filter(id__in=ids)
+    if not usuario.is_superuser:
+        registros = registros.filter(vendedor=usuario)
+    elegiveis = registros.filter(**filtro)
+    if exclusao:
+        elegiveis = elegiveis.exclude(**exclusao)
+
+    agora = timezone.now()
+    with transaction.atomic():
+        estados = list(
+            elegiveis.select_for_update().order_by().values(*CAMPOS_ESTADO)
+        )
+        if not estados:
+            return {'acao': acao, 'atualizados': 0, 'ignorados': len(ids), 'ids': []}
+
+        ids_alterados = [estado['id'] for estado in estados]
+        # update() não aplica auto_now: atualizado_em explícito (métricas dependem dele);
+        # versao incrementada invalida edições abertas sobre estes registros
+        RegistroComercial.objects.filter(id__in=ids_alterados).update(
+            **campos, atualizado_em=agora, versao=F('versao') + 1
+        )
+
+        deltas = Counter()
+        for estado in estados:
+            novo = {**estado, **campos}
+            deltas[tuple(estado[campo] for campo in contadores.CAMPOS_CHAVE)] -= 1
+            deltas[tuple(novo[campo] for campo in contadores.CAMPOS_CHAVE)] += 1
+        contadores.aplicar_deltas(deltas)
+
+        metricas.descontar_consolidados(
+            (estado['atualizado_em'],) + tuple(estado[campo] for campo in metricas.CAMPOS_METRICA)
+            for estado in estados
+        )
+        invalidar_estatisticas(
+            *{estado['vendedor_id'] for estado in estados},
+            campos.get('vendedor_id'),
+        )
+        publicar_lote(estados)
+
+        nomes_vendedores = {}
+        if acao == ACAO_REATRIBUIR:
+            nomes_vendedores = {
+                vendedor.id: vendedor.get_full_name() or vendedor.username
+                for vendedor in User.objects.filter(id__in={estado['vendedor_id'] for estado in estados})
+            }
+        ContatoHistorico.objects.registrar_lote([
+            ContatoHistorico(
+                registro_id=estado['id'],
+                data_contato=agora,
+                resultado=_texto_historico(acao, estado, novo_vendedor, nomes_vendedores),
+                resultado_code=f'lote_{acao}',
+                status_anterior=estado['status_pipeline'],
+                status_novo=campos.get('status_pipeline', estado['status_pipeline']),
+                usuario=usuario,
+                canal_contato=estado['canal_contato'],
+                checklist_itens=[],
+            )
+            for estado in estados
+        ])
+
+    return {
+        'acao': acao,
+        'atualizados': len(ids_alterados),
+        'ignorados': len(ids) - len(ids_alterados),
+        'ids': [str(registro_id) for registro_id in ids_alterados],
+    }
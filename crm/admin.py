@@ -145,7 +145,8 @@ class ContatoHistoricoAdmin(admin.ModelAdmin):
         'data_contato',
         'usuario',
         'status_anterior',
-        'status_novo'
+        'status_novo',
+        'resultado_code'
     ]
     
     search_fields = [
@@ -160,7 +161,10 @@ class ContatoHistoricoAdmin(admin.ModelAdmin):
         'usuario',
         'status_anterior',
         'status_novo',
-        'resultado'
+        'resultado',
+        'resultado_code',
+        'observacoes',
+        'duracao_desde_anterior'
     ]
     
     def resultado_preview(self, obj):
@@ -4,6 +4,7 @@ Admin para configuração do funil.
 
 from django.contrib import admin
 from .models_config import FunilResultadoConfig, FunilProximoPassoConfig
+from .funil_config_utils import invalidar_cache_funil
 
 
 @admin.register(FunilResultadoConfig)
@@ -35,10 +36,12 @@ class FunilResultadoConfigAdmin(admin.ModelAdmin):
     @admin.action(description='Ativar selecionados')
     def ativar(self, request, queryset):
         queryset.update(ativo=True)
+        invalidar_cache_funil()  # update() não dispara signals
     
     @admin.action(description='Desativar selecionados')
     def desativar(self, request, queryset):
         queryset.update(ativo=False)
+        invalidar_cache_funil()  # update() não dispara signals
 
 
 @admin.register(FunilProximoPassoConfig)
@@ -64,7 +67,9 @@ class FunilProximoPassoConfigAdmin(admin.ModelAdmin):
     @admin.action(description='Ativar selecionados')
     def ativar(self, request, queryset):
         queryset.update(ativo=True)
+        invalidar_cache_funil()  # update() não dispara signals
     
     @admin.action(description='Desativar selecionados')
     def desativar(self, request, queryset):
         queryset.update(ativo=False)
+        invalidar_cache_funil()  # update() não dispara signals
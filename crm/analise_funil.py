@@ -0,0 +1,217 @@
+"""
+Análise do funil: tempo em cada estágio e conversão por coorte.
+
+Tudo sai de uma única passada pelas transições do ContatoHistorico
+(status_anterior → status_novo), ordenadas por registro e data:
+
+- Tempo no estágio: para cada transição que sai de um estágio, a entrada é
+  a transição anterior do mesmo registro (LAG(data_contato) particionado por
+  registro) ou, na primeira transição, a criação do registro.
+- Coorte: registros que entraram em um estágio no período; convertidos são
+  os que chegaram a um estágio mais adiante do funil em até N dias. Só
+  entram na taxa as entradas com a janela completa (data <= agora - N dias);
+  as mais recentes ainda podem converter e são informadas como pendentes.
+
+Em bancos com funções de janela (PostgreSQL, SQLite >= 3.25) a transição
+anterior vem do SQL; nos demais é calculada no próprio laço em Python.
+O resultado é cacheado por (período, vendedor, janela).
+"""
+
+from datetime import timedelta
+from statistics import mean, median
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import Lag
+from django.utils import timezone
+
+from .cache_utils import chave_namespace
+from .models import ContatoHistorico, RegistroComercial, StatusPipelineChoices
+
+
+NAMESPACE_ANALISE = 'analise_funil'
+ANALISE_CACHE_TIMEOUT = 600  # 10 minutos
+
+PERIODOS_ANALISE = {
+    'semana': 7,
+    'mes': 30,
+    'trimestre': 90,
+}
+PERIODO_PADRAO = 'mes'
+
+JANELAS_CONVERSAO = (7, 15, 30, 60, 90)
+JANELA_PADRAO = 30
+
+# Ordem do funil (Arquivada não é avanço)
+ORDEM_FUNIL = (
+    StatusPipelineChoices.CONTA_PARA_CONTATO.value,
+    StatusPipelineChoices.CONTATO_FEITO.value,
+    StatusPipelineChoices.NEGOCIACAO_COTACAO.value,
+    StatusPipelineChoices.PEDIDO_REALIZADO.value,
+    StatusPipelineChoices.CONTA_ATIVA.value,
+)
+POSICAO_FUNIL = {status: posicao for posicao, status in enumerate(ORDEM_FUNIL)}
+
+SEGUNDOS_POR_DIA = 86400
+
+
+def _suporta_janela():
+    return connection.features.supports_over_clause
+
+
+def _transicoes(inicio, vendedor_id=None):
+    """
+    Transições de estágio dos registros com alguma transição no período.
+
+    O histórico completo desses registros é lido para que a transição
+    anterior (entrada no estágio) exista mesmo quando caiu antes do período.
+    """
+    ativos = ContatoHistorico.objects.filter(data_contato__gte=inicio).exclude(status_anterior=F('status_novo'))
+    if vendedor_id:
+        ativos = ativos.filter(registro__vendedor_id=vendedor_id)
+
+    transicoes = (
+        ContatoHistorico.objects
+        .filter(registro_id__in=ativos.values('registro_id'))
+        .exclude(status_anterior=F('status_novo'))
+        .order_by('registro_id', 'data_contato')
+    )
+    campos = ['registro_id', 'data_contato', 'status_anterior', 'status_novo', 'registro__criado_em']
+    if _suporta_janela():
+        por_registro = {'partition_by': [F('registro_id')], 'order_by': F('data_contato').asc()}
+        transicoes = transicoes.annotate(
+            entrada_anterior=Window(Lag('data_contato'), **por_registro),
+            estagio_anterior=Window(Lag('status_novo'), **por_registro),
+        )
+        campos += ['entrada_anterior', 'estagio_anterior']
+    return transicoes.values_list(*campos).iterator(chunk_size=2000)
+
+
+def _resumo_duracoes(duracoes):
+    dias = sorted(duracao.total_seconds() / SEGUNDOS_POR_DIA for duracao in duracoes)
+    return {
+        'transicoes': len(dias),
+        'media_dias': round(mean(dias), 1),
+        'mediana_dias': round(median(dias), 1),
+        'p90_dias': round(dias[min(len(dias) - 1, int(len(dias) * 0.9))], 1),
+    }
+
+
+def calcular_analise(periodo=PERIODO_PADRAO, vendedor_id=None, janela_dias=JANELA_PADRAO):
+    """
+    Calcula tempo no estágio e conversão por coorte (sem cache).
+
+    Args:
+        periodo: Chave de PERIODOS_ANALISE
+        vendedor_id: Filtra pelos registros do vendedor (None = todos)
+        janela_dias: Prazo para considerar a coorte convertida
+
+    Returns:
+        dict: {'periodo', 'inicio', 'janela_dias', 'tempo_no_estagio': [...], 'coortes': [...]}
+    """
+    agora = timezone.now()
+    inicio = agora - timedelta(days=PERIODOS_ANALISE.get(periodo, PERIODOS_ANALISE[PERIODO_PADRAO]))
+    janela = timedelta(days=janela_dias)
+    # Entradas depois disso ainda não tiveram a janela inteira para converter
+    limite_completo = agora - janela
+    com_janela = _suporta_janela()
+
+    duracoes = {}
+    # {estágio: [entraram, convertidos, pendentes]}
+    coortes = {status: [0, 0, 0] for status in ORDEM_FUNIL[:-1]}
+
+    # Coorte de "Conta para Contato" = registros criados no período (nem todos têm transição)
+    criados = RegistroComercial.objects.filter(criado_em__gte=inicio)
+    if vendedor_id:
+        criados = criados.filter(vendedor_id=vendedor_id)
+    totais = criados.aggregate(
+        completos=Count('id', filter=Q(criado_em__lte=limite_completo)),
+        pendentes=Count('id', filter=Q(criado_em__gt=limite_completo)),
+    )
+    coortes[ORDEM_FUNIL[0]][0] = totais['completos']
+    coortes[ORDEM_FUNIL[0]][2] = totais['pendentes']
+
+    registro_atual = None
+    entradas = {}  # coortes abertas do registro atual: {estágio: [data de entrada, convertido]}
+
+    def fechar_registro():
+        for estagio, (data_entrada, convertido) in entradas.items():
+            if data_entrada > limite_completo:
+                # Janela ainda aberta (os de "Conta para Contato" já vêm da contagem)
+                if estagio != ORDEM_FUNIL[0]:
+                    coortes[estagio][2] += 1
+                continue
+            if estagio != ORDEM_FUNIL[0]:
+                coortes[estagio][0] += 1
+            coortes[estagio][1] += convertido
+
+    for linha in _transicoes(inicio, vendedor_id):
+        registro_id, data, de, para, criado_em = linha[:5]
+
+        if registro_id != registro_atual:
+            if registro_atual is not None:
+                fechar_registro()
+            registro_atual = registro_id
+            entradas = {}
+            if criado_em >= inicio:
+                entradas[ORDEM_FUNIL[0]] = [criado_em, False]
+            anterior = (None, None)
+
+        entrada_anterior, estagio_anterior = linha[5:] if com_janela else anterior
+        anterior = (data, para)
+
+        # Tempo no estágio de origem
+        if entrada_anterior is None:
+            entrada = criado_em
+        else:
+            entrada = entrada_anterior if estagio_anterior == de else None
+        if entrada is not None and data >= inicio:
+            duracoes.setdefault(de, []).append(data - entrada)
+
+        # Conversão das coortes abertas do registro
+        posicao = POSICAO_FUNIL.get(para)
+        if posicao is not None:
+            for estagio, coorte in entradas.items():
+                if not coorte[1] and posicao > POSICAO_FUNIL[estagio] and data - coorte[0] <= janela:
+                    coorte[1] = True
+
+        # Entrada em coorte (primeira entrada no estágio dentro do período)
+        if para in coortes and para not in entradas and data >= inicio:
+            entradas[para] = [data, False]
+
+    if registro_atual is not None:
+        fechar_registro()
+
+    labels = dict(StatusPipelineChoices.choices)
+    return {
+        'periodo': periodo,
+        'inicio': inicio.isoformat(),
+        'janela_dias': janela_dias,
+        'tempo_no_estagio': [
+            {'status': status, 'label': labels[status], **_resumo_duracoes(duracoes[status])}
+            for status in list(ORDEM_FUNIL) + [StatusPipelineChoices.ARQUIVADA.value]
+            if duracoes.get(status)
+        ],
+        'coortes': [
+            {
+                'status': status,
+                'label': labels[status],
+                'entraram': entraram,
+                'convertidos': convertidos,
+                'taxa_conversao': round(convertidos / entraram * 100, 1) if entraram else 0,
+                'pendentes': pendentes,
+            }
+            for status, (entraram, convertidos, pendentes) in coortes.items()
+        ],
+    }
+
+
+def analise_funil(periodo=PERIODO_PADRAO, vendedor_id=None, janela_dias=JANELA_PADRAO):
+    """calcular_analise() com cache por (período, vendedor, janela)."""
+    chave = chave_namespace(NAMESPACE_ANALISE, periodo, vendedor_id or 'todos', janela_dias)
+    resultado = cache.get(chave)
+    if resultado is None:
+        resultado = calcular_analise(periodo, vendedor_id, janela_dias)
+        cache.set(chave, resultado, ANALISE_CACHE_TIMEOUT)
+    return resultado
@@ -0,0 +1,243 @@
+"""
+Busca de leads por nome, cidade, código Winthor ou telefone.
+
+RegistroComercial.busca_normalizada guarda esses campos em minúsculas, sem
+acentos e sem pontuação (normalizar_busca, recalculado no save(), na
+importação e na deduplicação). A consulta passa pela mesma normalização, então
+"sao joao" encontra "São João" e "9876-5432" encontra o telefone.
+
+Índice por banco (criado pela migração 0017, ver criar_indice):
+- SQLite: tabela FTS5 com tokenizer trigram (conteúdo externo), mantida por
+  triggers em INSERT/UPDATE/DELETE; cobre save(), bulk_create, bulk_update
+  e update(). Termos com menos de 3 caracteres usam LIKE. Sem o tokenizer
+  trigram (SQLite < 3.34 ou compilado sem FTS5) o índice não é criado e
+  a busca inteira usa LIKE.
+- PostgreSQL: extensão pg_trgm + índice GIN (gin_trgm_ops) em
+  busca_normalizada, que acelera LIKE '%termo%' e permite similaridade
+  (similarity() / operador %) para erros de digitação.
+- Outros bancos: LIKE sobre busca_normalizada.
+
+Resultados: registros que contêm todos os termos (prefixos do nome primeiro);
+no PostgreSQL, também os similares ao texto digitado.
+"""
+
+from django.db import connection
+from django.db.models import BooleanField, Case, F, FloatField, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from .models import RegistroComercial, normalizar_busca
+
+
+TABELA_FTS = 'crm_registro_busca'
+INDICE_TRGM = 'crm_registro_busca_trgm'
+
+# Tamanho mínimo de termo no tokenizer trigram
+TAMANHO_TRIGRAMA = 3
+TAMANHO_MINIMO_CONSULTA = 2
+LIMITE_RESULTADOS = 20
+
+
+# ========== ÍNDICE (MIGRAÇÕES / MANUTENÇÃO) ==========
+
+def _sql_indice_sqlite():
+    tabela = RegistroComercial._meta.db_table
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA_FTS} USING fts5(
+            busca_normalizada, content='{tabela}', content_rowid='rowid', tokenize='trigram'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {TABELA_FTS}_ai AFTER INSERT ON {tabela} BEGIN
+            INSERT INTO {TABELA_FTS}(rowid, busca_normalizada) VALUES (new.rowid, new.busca_normalizada);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {TABELA_FTS}_ad AFTER DELETE ON {tabela} BEGIN
+            INSERT INTO {TABELA_FTS}({TABELA_FTS}, rowid, busca_normalizada) VALUES ('delete', old.rowid, old.busca_normalizada);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {TABELA_FTS}_au AFTER UPDATE OF busca_normalizada ON {tabela} BEGIN
+            INSERT INTO {TABELA_FTS}({TABELA_FTS}, rowid, busca_normalizada) VALUES ('delete', old.rowid, old.busca_normalizada);
+            INSERT INTO {TABELA_FTS}(rowid, busca_normalizada) VALUES (new.rowid, new.busca_normalizada);
+        END""",
+    ]
+
+
+def trigrama_disponivel(conexao):
+    """SQLite com FTS5 e tokenizer trigram (a partir da 3.34)."""
+    if conexao.Database.sqlite_version_info < (3, 34, 0):
+        return False
+    with conexao.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def criar_indice(schema_editor):
+    """
+    Cria o índice de busca do banco atual (idempotente) e o preenche.
+
+    Returns:
+        bool: False se o banco não tem índice de busca (a consulta usa LIKE)
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        if not trigrama_disponivel(schema_editor.connection):
+            return False
+        for sql in _sql_indice_sqlite():
+            schema_editor.execute(sql)
+        schema_editor.execute(f"INSERT INTO {TABELA_FTS}({TABELA_FTS}) VALUES ('rebuild')")
+        return True
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {INDICE_TRGM} ON {RegistroComercial._meta.db_table} '
+            'USING gin (busca_normalizada gin_trgm_ops)'
+        )
+        return True
+    return False
+
+
+def remover_indice(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for sufixo in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {TABELA_FTS}_{sufixo}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {TABELA_FTS}')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INDICE_TRGM}')
+
+
+def garantir_indice(using='default'):
+    """
+    Recria o índice FTS5 se a tabela ou algum trigger sumiu.
+
+    No SQLite, migrações que alteram RegistroComercial recriam a tabela
+    (e descartam os triggers dela); chamado no post_migrate.
+
+    Returns:
+        bool: True se o índice precisou ser recriado
+    """
+    from django.db import connections
+
+    conexao = connections[using]
+    if conexao.vendor != 'sqlite' or not trigrama_disponivel(conexao):
+        return False
+    esperados = {TABELA_FTS, f'{TABELA_FTS}_ai', f'{TABELA_FTS}_ad', f'{TABELA_FTS}_au'}
+    with conexao.cursor() as cursor:
+        colunas = {
+            coluna.name
+            for coluna in conexao.introspection.get_table_description(cursor, RegistroComercial._meta.db_table)
+        }
+        if 'busca_normalizada' not in colunas:
+            # Banco migrado para antes da 0017
+            return False
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name IN (%s, %s, %s, %s)", sorted(esperados)
+        )
+        existentes = {linha[0] for linha in cursor.fetchall()}
+    if existentes == esperados:
+        return False
+    with conexao.schema_editor() as schema_editor:
+        return criar_indice(schema_editor)
+
+
+def recalcular_textos(registros=None, tamanho_lote=1000):
+    """
+    Recalcula busca_normalizada (ex.: após mudar normalizar_busca).
+
+    Returns:
+        int: Registros alterados
+    """
+    registros = RegistroComercial.objects.all() if registros is None else registros
+    alterados = []
+    total = 0
+    for registro in registros.only('id', 'busca_normalizada', 'nome_empresa', 'cidade',
+                                   'codigo_winthor', 'telefone_normalizado').iterator(chunk_size=tamanho_lote):
+        anterior = registro.busca_normalizada
+        registro.atualizar_busca()
+        if registro.busca_normalizada != anterior:
+            alterados.append(registro)
+        if len(alterados) >= tamanho_lote:
+            RegistroComercial.objects.bulk_update(alterados, ['busca_normalizada'])
+            total += len(alterados)
+            alterados = []
+    if alterados:
+        RegistroComercial.objects.bulk_update(alterados, ['busca_normalizada'])
+        total += len(alterados)
+    return total
+
+
+# ========== CONSULTA ==========
+
+def _indice_fts_disponivel():
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [TABELA_FTS])
+        return cursor.fetchone() is not None
+
+
+def _filtro_termos(registros, termos):
+    """Exige todos os termos (FTS5 para termos >= 3 caracteres no SQLite, LIKE no resto)."""
+    longos = [termo for termo in termos if len(termo) >= TAMANHO_TRIGRAMA]
+    curtos = [termo for termo in termos if len(termo) < TAMANHO_TRIGRAMA]
+
+    if longos and _indice_fts_disponivel():
+        tabela = RegistroComercial._meta.db_table
+        consulta = ' AND '.join(f'"{termo}"' for termo in longos)
+        registros = registros.alias(
+            _fts=RawSQL(
+                f'{tabela}.rowid IN (SELECT rowid FROM {TABELA_FTS} WHERE {TABELA_FTS} MATCH %s)',
+                [consulta],
+                output_field=BooleanField(),
+            )
+        ).filter(_fts=True)
+    else:
+        curtos = termos
+
+    for termo in curtos:
+        registros = registros.filter(busca_normalizada__contains=termo)
+    return registros
+
+
+def buscar_registros(usuario, consulta, vendedor_id=None, limite=LIMITE_RESULTADOS):
+    """
+    Busca registros visíveis ao usuário.
+
+    Args:
+        usuario: Escopo igual ao do Kanban (superusuário vê todos, demais só os próprios)
+        consulta: Texto digitado (qualquer caixa/acentuação)
+        vendedor_id: Filtro opcional do gestor
+        limite: Máximo de resultados
+
+    Returns:
+        QuerySet de RegistroComercial (vazio se a consulta for curta demais)
+    """
+    texto = normalizar_busca(consulta)
+    registros = RegistroComercial.objects.select_related('vendedor')
+    if not usuario.is_superuser:
+        registros = registros.filter(vendedor=usuario)
+    elif vendedor_id:
+        registros = registros.filter(vendedor_id=vendedor_id)
+
+    if len(texto) < TAMANHO_MINIMO_CONSULTA:
+        return registros.none()
+
+    termos = texto.split()
+    ordem_prefixo = Case(
+        When(busca_normalizada__startswith=texto, then=Value(0)),
+        default=Value(1),
+        output_field=IntegerField(),
+    )
+
+    if connection.vendor == 'postgresql':
+        # Todos os termos (LIKE acelerado pelo índice trigram) ou texto parecido
+        contem = Q()
+        for termo in termos:
+            contem &= Q(busca_normalizada__contains=termo)
+        registros = (
+            registros
+            .alias(_similar=RawSQL('busca_normalizada %% %s', [texto], output_field=BooleanField()))
+            .filter(contem | Q(_similar=True))
+            .annotate(_similaridade=RawSQL('similarity(busca_normalizada, %s)', [texto], output_field=FloatField()))
+            .order_by(ordem_prefixo, F('_similaridade').desc(), 'nome_empresa')
+        )
+    else:
+        registros = _filtro_termos(registros, termos).order_by(ordem_prefixo, 'nome_empresa')
+
+    return registros[:limite]
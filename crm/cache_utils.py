@@ -0,0 +1,52 @@
+"""
+Utilitários de cache com invalidação por namespace (versão).
+
+Cada namespace tem uma chave de versão; as chaves de dados incluem a versão
+atual. Invalidar um namespace apenas troca a versão: as entradas antigas
+deixam de ser lidas e expiram sozinhas. Funciona igual no LocMemCache e no
+Redis (não depende de cache.keys()/delete_pattern, que só existem no
+django-redis).
+
+Com LocMemCache cada processo do Gunicorn tem seu próprio cache e a
+invalidação só atinge o processo que a executou; configure REDIS_URL
+para um cache compartilhado (ver config/settings.py).
+"""
+
+import time
+
+from django.core.cache import cache
+
+
+def _chave_versao(namespace):
+    return f'crm:ns:{namespace}:versao'
+
+
+def _nova_versao():
+    # Nunca reinicia em 1: uma chave de versão expirada/removida não
+    # reaproveita entradas gravadas antes dela
+    return time.time_ns()
+
+
+def versao_namespace(namespace):
+    """Versão atual do namespace (criada na primeira leitura)."""
+    chave = _chave_versao(namespace)
+    versao = cache.get(chave)
+    if versao is None:
+        cache.add(chave, _nova_versao(), timeout=None)
+        versao = cache.get(chave)
+    return versao
+
+
+def chave_namespace(namespace, *partes):
+    """Monta a chave de dados na versão atual do namespace."""
+    sufixo = ':'.join(str(parte) for parte in partes)
+    return f'crm:{namespace}:{versao_namespace(namespace)}:{sufixo}'
+
+
+def invalidar_namespace(*namespaces):
+    """Invalida todas as entradas dos namespaces informados."""
+    versao = _nova_versao()
+    cache.set_many(
+        {_chave_versao(namespace): versao for namespace in namespaces},
+        timeout=None,
+    )
@@ -0,0 +1,182 @@
+"""
+Autocomplete de cidade/UF com índice de prefixos em memória.
+
+O índice guarda os pares (cidade, uf) distintos dos registros, agrupados pela
+cidade normalizada (normalizar_busca: sem acentos, minúsculas), em uma lista
+ordenada; a busca por prefixo é um bisect seguido de uma varredura do trecho
+que começa com o prefixo, sem consulta ao banco por tecla digitada.
+
+Para cada cidade normalizada a grafia exibida (canônica) é a mais usada nos
+registros, o que permite unificar "Sao Paulo"/"SÃO PAULO" em "São Paulo" no
+cadastro e na importação (ver cidade_canonica).
+
+Como a tabela do funil (tabela_funil.py), o índice é imutável, montado no
+primeiro uso e reconstruído quando a versão do namespace 'cidades' muda, o
+que só acontece quando um registro novo ou com cidade/UF alterada traz um par
+ainda ausente do índice (ver registrar_cidades, chamado pelo signal de save e
+pela importação).
+"""
+
+import heapq
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .cache_utils import invalidar_namespace, versao_namespace
+from .models import RegistroComercial, normalizar_busca
+
+
+NAMESPACE_CIDADES = 'cidades'
+LIMITE_SUGESTOES = 10
+
+# Maior caractere possível: prefixo + FIM_PREFIXO fica depois de toda chave com o prefixo
+FIM_PREFIXO = '\U0010ffff'
+
+_indice = None
+_versao = None
+_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class Cidade:
+    """Cidade sugerida: grafia canônica, UF e quantidade de registros."""
+    chave: str
+    cidade: str
+    uf: str
+    registros: int
+
+
+def _grafia_canonica(grafias):
+    # Mais usada; no empate, a que tem maiúsculas/acentos ("São Paulo" > "sao paulo")
+    return max(grafias, key=lambda grafia: (grafias[grafia], grafia != grafia.lower(), not grafia.isascii()))
+
+
+class IndiceCidades:
+    """Pares (cidade normalizada, uf) em ordem, com busca por prefixo via bisect."""
+
+    def __init__(self, linhas):
+        """
+        Args:
+            linhas: Iterável de (cidade, uf, quantidade de registros)
+        """
+        grafias = defaultdict(Counter)
+        for cidade, uf, quantidade in linhas:
+            chave = normalizar_busca(cidade)
+            if chave:
+                grafias[(chave, (uf or '').upper())][cidade.strip()] += quantidade
+
+        cidades = sorted(
+            (
+                Cidade(chave, _grafia_canonica(contagem), uf, sum(contagem.values()))
+                for (chave, uf), contagem in grafias.items()
+            ),
+            key=lambda cidade: (cidade.chave, cidade.uf),
+        )
+        self._chaves = tuple(cidade.chave for cidade in cidades)
+        self._cidades = tuple(cidades)
+        self._pares = frozenset((cidade.chave, cidade.uf) for cidade in cidades)
+        self._canonicas = {(cidade.chave, cidade.uf): cidade.cidade for cidade in cidades}
+
+    def __len__(self):
+        return len(self._cidades)
+
+    def __contains__(self, par):
+        cidade, uf = par
+        return (normalizar_busca(cidade), (uf or '').upper()) in self._pares
+
+    def sugerir(self, prefixo, uf=None, limite=LIMITE_SUGESTOES):
+        """Cidades cujo nome normalizado começa com prefixo (mais registros primeiro)."""
+        prefixo = normalizar_busca(prefixo)
+        if not prefixo:
+            return []
+        uf = (uf or '').upper()
+        # Chaves que começam com o prefixo formam um trecho contíguo da lista
+        inicio = bisect_left(self._chaves, prefixo)
+        fim = bisect_left(self._chaves, prefixo + FIM_PREFIXO, inicio)
+        candidatas = (
+            cidade for cidade in self._cidades[inicio:fim]
+            if not uf or cidade.uf == uf
+        )
+        return heapq.nlargest(limite, candidatas, key=lambda cidade: (cidade.registros, -len(cidade.chave)))
+
+    def canonica(self, cidade, uf):
+        """Grafia canônica da cidade na UF (ou a própria cidade, se ainda não existe)."""
+        return self._canonicas.get((normalizar_busca(cidade), (uf or '').upper()), cidade)
+
+
+def construir_indice():
+    """Monta o índice a partir dos registros (uma consulta GROUP BY cidade, uf)."""
+    linhas = (
+        RegistroComercial.objects.order_by()
+        .values_list('cidade', 'uf')
+        .annotate(quantidade=Count('id'))
+    )
+    return IndiceCidades(linhas)
+
+
+def obter_indice():
+    """Índice atual, reconstruído se a versão do namespace 'cidades' mudou."""
+    global _indice, _versao
+
+    versao = versao_namespace(NAMESPACE_CIDADES)
+    if _indice is not None and versao == _versao:
+        return _indice
+
+    with _lock:
+        if _indice is None or versao != _versao:
+            _indice = construir_indice()
+            _versao = versao
+        return _indice
+
+
+def sugerir_cidades(prefixo, uf=None, limite=LIMITE_SUGESTOES):
+    """Sugestões de autocomplete para o prefixo digitado."""
+    return obter_indice().sugerir(prefixo, uf, limite)
+
+
+def cidade_canonica(cidade, uf):
+    """Grafia canônica de uma cidade digitada/importada (ex.: "sao paulo" -> "São Paulo")."""
+    return obter_indice().canonica(cidade, uf)
+
+
+def _pares_ja_cadastrados(pares, excluir_ids):
+    """
+    Pares que já existem em outros registros (índice (cidade, uf); EXISTS
+    para um par, uma consulta para vários).
+    """
+    registros = RegistroComercial.objects.exclude(pk__in=excluir_ids)
+    if len(pares) == 1:
+        cidade, uf = next(iter(pares))
+        return set(pares) if registros.filter(cidade=cidade, uf=uf).exists() else set()
+    filtro = Q()
+    for cidade, uf in pares:
+        filtro |= Q(cidade=cidade, uf=uf)
+    return set(registros.filter(filtro).order_by().values_list('cidade', 'uf').distinct())
+
+
+def registrar_cidades(pares, excluir_ids=()):
+    """
+    Invalida o índice (após o commit) se algum par (cidade, uf) ainda não está nele.
+
+    Sem índice carregado neste processo, procura cada par em outro registro
+    (os recém-gravados, excluir_ids, não contam): se já existia, o índice
+    montado por quem leu a versão atual já o contém.
+
+    Args:
+        pares: Iterável de (cidade, uf) gravados
+        excluir_ids: Registros que acabaram de gravar esses pares
+    """
+    pares = {(cidade, uf) for cidade, uf in pares if normalizar_busca(cidade)}
+    if not pares:
+        return
+    indice = _indice if _versao == versao_namespace(NAMESPACE_CIDADES) else None
+    if indice is not None:
+        novos = any(par not in indice for par in pares)
+    else:
+        novos = bool(pares - _pares_ja_cadastrados(pares, excluir_ids))
+    if novos:
+        transaction.on_commit(lambda: invalidar_namespace(NAMESPACE_CIDADES))
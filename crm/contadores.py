@@ -0,0 +1,183 @@
+"""
+Manutenção dos contadores desnormalizados do pipeline (ContadorPipeline).
+
+Cada RegistroComercial contribui com +1 na linha
+(vendedor, status_pipeline, no_kanban, origem). Os signals de
+RegistroComercial ajustam os contadores na mesma transação do save();
+operações em lote (bulk_create/update) devem chamar aplicar_deltas().
+"""
+
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import ContadorPipeline, RegistroComercial, StatusPipelineChoices
+
+
+CAMPOS_CHAVE = ('vendedor_id', 'status_pipeline', 'no_kanban', 'origem')
+
+
+def chave_contador(registro, base=None):
+    """
+    Retorna a chave do contador para um registro.
+
+    Args:
+        registro: RegistroComercial
+        base: Chave completa usada para os campos não carregados (ex: a chave
+            gravada no banco, ver chave_contador_no_banco)
+
+    Returns:
+        tuple | None: (vendedor_id, status_pipeline, no_kanban, origem), ou None
+        se algum dos campos não foi carregado (ex: queryset com only()/defer())
+        e não há base.
+    """
+    valores = registro.__dict__
+    if base is not None:
+        return tuple(valores.get(campo, valor_base) for campo, valor_base in zip(CAMPOS_CHAVE, base))
+    if any(campo not in valores for campo in CAMPOS_CHAVE):
+        return None
+    return tuple(valores[campo] for campo in CAMPOS_CHAVE)
+
+
+def chave_contador_no_banco(registro):
+    """Chave gravada no banco para o registro (uma consulta), ou None se ele não existe."""
+    linha = RegistroComercial.objects.filter(pk=registro.pk).values_list(*CAMPOS_CHAVE).first()
+    return tuple(linha) if linha else None
+
+
+def aplicar_deltas(deltas):
+    """
+    Aplica variações nos contadores de forma atômica.
+
+    Args:
+        deltas: dict/Counter {chave: variação}, com chave no formato de chave_contador()
+    """
+    deltas = {chave: delta for chave, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    with transaction.atomic():
+        for (vendedor_id, status_pipeline, no_kanban, origem), delta in deltas.items():
+            filtro = {
+                'vendedor_id': vendedor_id,
+                'status_pipeline': status_pipeline,
+                'no_kanban': no_kanban,
+                'origem': origem,
+            }
+            atualizados = ContadorPipeline.objects.filter(**filtro).update(total=F('total') + delta)
+            if not atualizados:
+                ContadorPipeline.objects.get_or_create(**filtro, defaults={'total': 0})
+                ContadorPipeline.objects.filter(**filtro).update(total=F('total') + delta)
+
+
+def registrar_criados(registros):
+    """Incrementa contadores para registros criados em lote (bulk_create)."""
+    aplicar_deltas(Counter(chave_contador(registro) for registro in registros))
+
+
+def calcular_contagens_reais():
+    """Contagens calculadas direto da tabela de registros (fonte da verdade)."""
+    linhas = (
+        RegistroComercial.objects.order_by()
+        .values_list(*CAMPOS_CHAVE)
+        .annotate(total=Count('id'))
+    )
+    return {tuple(linha[:4]): linha[4] for linha in linhas}
+
+
+def calcular_contagens_contadores():
+    """Contagens atualmente gravadas em ContadorPipeline (ignora zeros)."""
+    linhas = ContadorPipeline.objects.exclude(total=0).values_list(*CAMPOS_CHAVE, 'total')
+    return {tuple(linha[:4]): linha[4] for linha in linhas}
+
+
+def reconstruir_contadores():
+    """Recria todos os contadores a partir de RegistroComercial."""
+    with transaction.atomic():
+        ContadorPipeline.objects.all().delete()
+        ContadorPipeline.objects.bulk_create([
+            ContadorPipeline(
+                vendedor_id=vendedor_id,
+                status_pipeline=status_pipeline,
+                no_kanban=no_kanban,
+                origem=origem,
+                total=total,
+            )
+            for (vendedor_id, status_pipeline, no_kanban, origem), total
+            in calcular_contagens_reais().items()
+        ])
+
+
+def divergencias_contadores():
+    """
+    Compara contadores com a tabela de registros.
+
+    Returns:
+        list[tuple]: [(chave, total_contador, total_real)] apenas onde diferem
+    """
+    reais = calcular_contagens_reais()
+    contadores = calcular_contagens_contadores()
+    return [
+        (chave, contadores.get(chave, 0), reais.get(chave, 0))
+        for chave in sorted(set(reais) | set(contadores), key=str)
+        if contadores.get(chave, 0) != reais.get(chave, 0)
+    ]
+
+
+# ========== LEITURA PARA DASHBOARDS ==========
+
+def _linhas_contadores(vendedor_id=None):
+    contadores = ContadorPipeline.objects.exclude(total=0)
+    if vendedor_id:
+        contadores = contadores.filter(vendedor_id=vendedor_id)
+    return contadores.values_list('status_pipeline', 'no_kanban', 'origem', 'total')
+
+
+def contagens_kanban(status_keys, vendedor_id=None):
+    """
+    Contagens do Kanban lidas dos contadores.
+
+    Args:
+        status_keys: Status exibidos no Kanban
+        vendedor_id: Filtra por vendedor (None = todos)
+
+    Returns:
+        tuple: (kanban_counts {status: total}, backlog_count)
+    """
+    kanban_counts = {status_key: 0 for status_key in status_keys}
+    backlog_count = 0
+    for status_pipeline, no_kanban, _origem, total in _linhas_contadores(vendedor_id):
+        if not no_kanban:
+            backlog_count += total
+        elif status_pipeline in kanban_counts:
+            kanban_counts[status_pipeline] += total
+    return kanban_counts, backlog_count
+
+
+def resumo_vendedor(vendedor_id):
+    """
+    Resumo completo de um vendedor lido dos contadores (uma consulta).
+
+    Returns:
+        dict: {'total', 'por_status': {status: n}, 'por_origem': {origem: n}, 'backlog'}
+            onde backlog exclui Conta Ativa e Arquivada (mesma regra dos dashboards).
+    """
+    fora_do_backlog = (
+        StatusPipelineChoices.CONTA_ATIVA.value,
+        StatusPipelineChoices.ARQUIVADA.value,
+    )
+    por_status = Counter()
+    por_origem = Counter()
+    backlog = 0
+    for status_pipeline, no_kanban, origem, total in _linhas_contadores(vendedor_id):
+        por_status[status_pipeline] += total
+        por_origem[origem] += total
+        if not no_kanban and status_pipeline not in fora_do_backlog:
+            backlog += total
+    return {
+        'total': sum(por_status.values()),
+        'por_status': dict(por_status),
+        'por_origem': dict(por_origem),
+        'backlog': backlog,
+    }
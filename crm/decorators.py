@@ -3,9 +3,71 @@ Decoradores e utilitários de permissão para o Mini-CRM
 """
 
 from functools import wraps
+from django.core.cache import cache
 from django.shortcuts import redirect
 from django.contrib.auth.decorators import login_required
 
+from .cache_utils import chave_namespace, invalidar_namespace
+
+
+# ========== RESOLUÇÃO DE GRUPOS (CACHE) ==========
+# Os grupos do usuário são lidos uma vez por requisição (memoizados no
+# objeto request.user) e guardados no cache em um namespace versionado por
+# usuário. Alterações de grupo trocam a versão (ver crm/signals.py).
+
+GRUPOS_CACHE_TIMEOUT = 300
+
+
+def _namespace_grupos(user_id):
+    return f'grupos:{user_id}'
+
+
+def invalidar_grupos_usuario(*user_ids):
+    """Invalida os grupos em cache dos usuários informados."""
+    namespaces = [_namespace_grupos(user_id) for user_id in user_ids if user_id]
+    if namespaces:
+        invalidar_namespace(*namespaces)
+
+
+def grupos_usuario(user):
+    """
+    Nomes dos grupos do usuário.
+
+    Returns:
+        frozenset: Grupos (vazio para usuário anônimo)
+    """
+    if not user.is_authenticated:
+        return frozenset()
+
+    grupos = getattr(user, '_crm_grupos', None)
+    if grupos is not None:
+        return grupos
+
+    chave = chave_namespace(_namespace_grupos(user.pk), 'nomes')
+    grupos = cache.get(chave)
+    if grupos is None:
+        grupos = frozenset(user.groups.values_list('name', flat=True))
+        cache.set(chave, grupos, GRUPOS_CACHE_TIMEOUT)
+
+    user._crm_grupos = grupos
+    return grupos
+
+
+def is_admin(user):
+    """Superuser ou grupo Admin."""
+    return user.is_authenticated and (user.is_superuser or 'Admin' in grupos_usuario(user))
+
+
+def is_comercial(user):
+    """Superuser ou grupos Comercial/Admin."""
+    if not user.is_authenticated:
+        return False
+    if user.is_superuser:
+        return True
+    grupos = grupos_usuario(user)
+    return 'Comercial' in grupos or 'Admin' in grupos
+
+
 def grupo_required(*grupos):
     """
     Decorador que valida se o usuário pertence a um dos grupos especificados.
@@ -20,7 +82,7 @@ def grupo_required(*grupos):
                 return view_func(request, *args, **kwargs)
             
             # Verificar se o usuário está em um dos grupos requeridos
-            user_grupos = request.user.groups.values_list('name', flat=True)
+            user_grupos = grupos_usuario(request.user)
             
             if any(grupo in user_grupos for grupo in grupos):
                 return view_func(request, *args, **kwargs)
@@ -37,11 +99,7 @@ def comercial_required(view_func):
     @wraps(view_func)
     @login_required(login_url='login')
     def wrapper(request, *args, **kwargs):
-        if request.user.is_superuser:
-            return view_func(request, *args, **kwargs)
-        
-        user_grupos = request.user.groups.values_list('name', flat=True)
-        if 'Comercial' in user_grupos or 'Admin' in user_grupos:
+        if is_comercial(request.user):
             return view_func(request, *args, **kwargs)
         
         return redirect('login')
@@ -54,11 +112,7 @@ def admin_required(view_func):
     @wraps(view_func)
     @login_required(login_url='login')
     def wrapper(request, *args, **kwargs):
-        if request.user.is_superuser:
-            return view_func(request, *args, **kwargs)
-        
-        user_grupos = request.user.groups.values_list('name', flat=True)
-        if 'Admin' in user_grupos:
+        if is_admin(request.user):
             return view_func(request, *args, **kwargs)
         
         return redirect('login')
@@ -100,11 +154,7 @@ def api_comercial_required(view_func):
                 status=401
             )
         
-        if request.user.is_superuser:
-            return view_func(request, *args, **kwargs)
-        
-        user_grupos = request.user.groups.values_list('name', flat=True)
-        if 'Comercial' in user_grupos or 'Admin' in user_grupos:
+        if is_comercial(request.user):
             return view_func(request, *args, **kwargs)
         
         return JsonResponse(
@@ -0,0 +1,172 @@
+"""
+Deduplicação de registros comerciais por telefone normalizado e código Winthor.
+
+A importação resolve cada lote inteiro com uma única consulta
+(telefone_normalizado IN (...) OR codigo_winthor IN (...)) em vez de uma
+consulta por linha. Políticas para linhas duplicadas:
+
+- 'pular'     : mantém o registro existente e ignora a linha
+- 'atualizar' : sobrescreve os dados cadastrais do registro existente
+- 'mesclar'   : preenche apenas os campos vazios do registro existente
+
+A origem nunca é alterada (regra do modelo: não muda após a criação),
+assim como vendedor e posição no pipeline.
+"""
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import RegistroComercial, normalizar_telefone
+
+
+POLITICA_PULAR = 'pular'
+POLITICA_ATUALIZAR = 'atualizar'
+POLITICA_MESCLAR = 'mesclar'
+
+POLITICAS_DUPLICADOS = [
+    (POLITICA_PULAR, 'Ignorar duplicados (manter registro existente)'),
+    (POLITICA_ATUALIZAR, 'Atualizar registro existente com os dados da planilha'),
+    (POLITICA_MESCLAR, 'Mesclar (preencher apenas campos vazios)'),
+]
+POLITICAS_VALIDAS = frozenset(chave for chave, _ in POLITICAS_DUPLICADOS)
+
+# Campos que a planilha pode alterar em um registro existente
+CAMPOS_ATUALIZAVEIS = (
+    'nome_empresa',
+    'telefone',
+    'cidade',
+    'uf',
+    'canal_contato',
+    'status_cliente',
+    'codigo_winthor',
+)
+
+
+def buscar_existentes(telefones, codigos):
+    """
+    Busca registros existentes por telefone normalizado ou código Winthor.
+
+    Args:
+        telefones: Iterável de telefones já normalizados
+        codigos: Iterável de códigos Winthor
+
+    Returns:
+        tuple: (dict {telefone_normalizado: registro}, dict {codigo_winthor: registro})
+    """
+    telefones = {telefone for telefone in telefones if telefone}
+    codigos = {codigo for codigo in codigos if codigo}
+    if not telefones and not codigos:
+        return {}, {}
+
+    filtro = Q()
+    if telefones:
+        filtro |= Q(telefone_normalizado__in=telefones)
+    if codigos:
+        filtro |= Q(codigo_winthor__in=codigos)
+
+    por_telefone = {}
+    por_codigo = {}
+    # Mais antigo primeiro: em caso de vários candidatos, vence o original
+    for registro in RegistroComercial.objects.filter(filtro).order_by('criado_em'):
+        if registro.telefone_normalizado:
+            por_telefone.setdefault(registro.telefone_normalizado, registro)
+        if registro.codigo_winthor:
+            por_codigo.setdefault(registro.codigo_winthor, registro)
+    return por_telefone, por_codigo
+
+
+def localizar_duplicado(telefone, codigo_winthor=None):
+    """Retorna o registro existente com o mesmo telefone/código Winthor, ou None."""
+    telefone_normalizado = normalizar_telefone(telefone)
+    por_telefone, por_codigo = buscar_existentes([telefone_normalizado], [codigo_winthor])
+    return por_codigo.get(codigo_winthor) or por_telefone.get(telefone_normalizado)
+
+
+def aplicar_politica(registro, dados, politica):
+    """
+    Aplica os dados de uma linha duplicada ao registro conforme a política.
+
+    Returns:
+        list[str]: Campos alterados (vazio se nada mudou)
+    """
+    alterados = []
+    for campo in CAMPOS_ATUALIZAVEIS:
+        novo = dados.get(campo)
+        if not novo:
+            continue
+        atual = getattr(registro, campo)
+        if politica == POLITICA_MESCLAR and atual:
+            continue
+        if atual != novo:
+            setattr(registro, campo, novo)
+            alterados.append(campo)
+
+    if 'telefone' in alterados:
+        registro.telefone_normalizado = normalizar_telefone(registro.telefone)
+        alterados.append('telefone_normalizado')
+    if alterados:
+        registro.atualizar_busca()
+        alterados.append('busca_normalizada')
+    return alterados
+
+
+def resolver_lote(linhas, politica):
+    """
+    Separa um lote em registros novos e atualizações de registros existentes.
+
+    Duplicados dentro do próprio lote também são detectados: a primeira
+    ocorrência cria o registro e as seguintes seguem a política.
+
+    Args:
+        linhas: Lista de (row_idx, registro não salvo) já validados
+        politica: 'pular', 'atualizar' ou 'mesclar'
+
+    Returns:
+        tuple: (novos: list[RegistroComercial], atualizar: list[RegistroComercial],
+                campos: set[str], duplicados: int)
+    """
+    por_telefone, por_codigo = buscar_existentes(
+        (registro.telefone_normalizado for _, registro in linhas),
+        (registro.codigo_winthor for _, registro in linhas),
+    )
+
+    novos = []
+    novos_ids = set()
+    atualizar = {}
+    campos = set()
+    duplicados = 0
+
+    for _, registro in linhas:
+        existente = (
+            (registro.codigo_winthor and por_codigo.get(registro.codigo_winthor))
+            or (registro.telefone_normalizado and por_telefone.get(registro.telefone_normalizado))
+        )
+
+        if not existente:
+            novos.append(registro)
+            novos_ids.add(registro.id)
+            if registro.telefone_normalizado:
+                por_telefone[registro.telefone_normalizado] = registro
+            if registro.codigo_winthor:
+                por_codigo[registro.codigo_winthor] = registro
+            continue
+
+        duplicados += 1
+        if politica == POLITICA_PULAR:
+            continue
+
+        dados = {campo: getattr(registro, campo) for campo in CAMPOS_ATUALIZAVEIS}
+        alterados = aplicar_politica(existente, dados, politica)
+        if alterados and existente.id not in novos_ids:
+            atualizar[existente.id] = existente
+            campos.update(alterados)
+
+    if atualizar:
+        agora = timezone.now()
+        for registro in atualizar.values():
+            registro.atualizado_em = agora
+            # Invalida edições abertas sobre a versão anterior (ver ConflitoVersao)
+            registro.versao = F('versao') + 1
+        campos.update(('atualizado_em', 'versao'))
+
+    return novos, list(atualizar.values()), campos, duplicados
@@ -0,0 +1,130 @@
+"""
+Estatísticas de pipeline para os painéis (Meu Desempenho, Métricas e a API
+de desempenho do vendedor), com cache por (vendedor, período).
+
+- Contagens de um período: um único aggregate() com Count(filter=Q(...)) por
+  status e por origem, em vez de um COUNT por valor.
+- Contagens totais: lidas de ContadorPipeline (crm/contadores.py).
+
+O cache tem TTL curto e é invalidado por evento: qualquer alteração em
+registros de um vendedor troca a versão do namespace dele e do namespace
+"todos" (ver invalidar_estatisticas, chamado pelos signals e pelas operações
+em lote).
+"""
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+from . import contadores, metricas
+from .cache_utils import chave_namespace, invalidar_namespace, versao_namespace
+from .models import OrigemChoices, RegistroComercial, StatusPipelineChoices
+
+
+ESTATISTICAS_CACHE_TIMEOUT = 60  # 1 minuto
+
+# Fora do backlog mesmo com no_kanban=False (mesma regra dos dashboards)
+STATUS_FORA_DO_BACKLOG = (
+    StatusPipelineChoices.CONTA_ATIVA.value,
+    StatusPipelineChoices.ARQUIVADA.value,
+)
+
+
+def _namespace(vendedor_id=None):
+    return f'estatisticas:{vendedor_id or "todos"}'
+
+
+def invalidar_estatisticas(*vendedor_ids):
+    """
+    Invalida as estatísticas dos vendedores informados (e do total geral)
+    após o commit da transação atual.
+    """
+    namespaces = {_namespace()} | {_namespace(vendedor_id) for vendedor_id in vendedor_ids if vendedor_id}
+    transaction.on_commit(lambda: invalidar_namespace(*namespaces))
+
+
+def etag_estatisticas(vendedor_id, *partes):
+    """
+    ETag forte das estatísticas do vendedor: muda a cada invalidar_estatisticas().
+
+    Lê apenas a versão do namespace no cache (não consulta registros).
+    """
+    sufixo = '-'.join(str(parte) for parte in partes)
+    return f'"{vendedor_id or "todos"}-{sufixo}-{versao_namespace(_namespace(vendedor_id))}"'
+
+
+def _em_cache(vendedor_id, partes, calcular):
+    chave = chave_namespace(_namespace(vendedor_id), *partes)
+    resultado = cache.get(chave)
+    if resultado is None:
+        resultado = calcular()
+        cache.set(chave, resultado, ESTATISTICAS_CACHE_TIMEOUT)
+    return resultado
+
+
+def calcular_resumo_periodo(vendedor_id=None, criado_desde=None):
+    """
+    Contagens por status e origem dos registros criados a partir de
+    criado_desde (datetime aware), em uma consulta.
+
+    Returns:
+        dict: mesmo formato de contadores.resumo_vendedor()
+            {'total', 'por_status', 'por_origem', 'backlog'}
+    """
+    registros = RegistroComercial.objects.all()
+    if vendedor_id:
+        registros = registros.filter(vendedor_id=vendedor_id)
+    if criado_desde:
+        registros = registros.filter(criado_em__gte=criado_desde)
+
+    agregados = {'total': Count('id')}
+    for status in StatusPipelineChoices.values:
+        agregados[f'status_{status}'] = Count('id', filter=Q(status_pipeline=status))
+    for origem in OrigemChoices.values:
+        agregados[f'origem_{origem}'] = Count('id', filter=Q(origem=origem))
+    agregados['backlog'] = Count(
+        'id', filter=Q(no_kanban=False) & ~Q(status_pipeline__in=STATUS_FORA_DO_BACKLOG)
+    )
+    linha = registros.aggregate(**agregados)
+
+    return {
+        'total': linha['total'],
+        'por_status': {status: linha[f'status_{status}'] for status in StatusPipelineChoices.values},
+        'por_origem': {origem: linha[f'origem_{origem}'] for origem in OrigemChoices.values},
+        'backlog': linha['backlog'],
+    }
+
+
+def resumo_pipeline(vendedor_id=None, criado_desde=None):
+    """
+    Resumo do pipeline (cacheado).
+
+    Sem criado_desde os totais vêm de ContadorPipeline; com criado_desde,
+    de calcular_resumo_periodo().
+    """
+    if criado_desde is None:
+        calcular = lambda: contadores.resumo_vendedor(vendedor_id)
+    else:
+        calcular = lambda: calcular_resumo_periodo(vendedor_id, criado_desde)
+    return _em_cache(vendedor_id, ('resumo', criado_desde.isoformat() if criado_desde else 'total'), calcular)
+
+
+def top_cidades(vendedor_id=None, limite=10):
+    """Cidades com mais registros do vendedor (cacheado)."""
+    def calcular():
+        registros = RegistroComercial.objects.all()
+        if vendedor_id:
+            registros = registros.filter(vendedor_id=vendedor_id)
+        return list(
+            registros.order_by().values('cidade', 'uf').annotate(count=Count('id')).order_by('-count')[:limite]
+        )
+    return _em_cache(vendedor_id, ('cidades', limite), calcular)
+
+
+def contagens_metricas(data_inicio, vendedor_id=None):
+    """metricas.contagens_periodo() cacheado por (vendedor, data de início)."""
+    return _em_cache(
+        vendedor_id,
+        ('metricas', data_inicio.isoformat()),
+        lambda: metricas.contagens_periodo(data_inicio, vendedor_id=vendedor_id),
+    )
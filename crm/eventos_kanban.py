@@ -0,0 +1,278 @@
+"""
+Eventos do Kanban em tempo real (Server-Sent Events).
+
+Cada alteração de um card publica, após o commit, um evento compacto:
+
+    {"tipo": "card", "id", "status_anterior", "status_novo", "no_kanban",
+     "no_kanban_anterior", "vendedores": [ids], "versao", "html"}
+
+onde html é o fragmento de crm/_card.html (vazio quando o card saiu do
+Kanban), lido do mesmo cache por (registro, versao) do quadro
+(fragmentos_cards.py): o card publicado já fica pronto para a próxima
+renderização do quadro, e vice-versa. Os quadros abertos assinam o stream em
+/crm/api/kanban/eventos/ (views_eventos.py) e atualizam só o card alterado.
+
+Canais:
+- memória (padrão): pub/sub no próprio processo; serve para um único worker.
+- redis: canal PUBLISH/SUBSCRIBE no REDIS_URL; necessário com vários
+  workers (cada processo só entrega eventos aos seus próprios assinantes).
+
+Nos dois canais o card só é renderizado e publicado quando há algum quadro
+assinando (no Redis, via PUBSUB NUMSUB): sob WSGI, sem streams abertos, o
+save não paga nada além dessa checagem.
+
+Configuração: KANBAN_EVENTOS_BACKEND = 'memoria' | 'redis' (ver config/settings.py).
+"""
+
+import asyncio
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from . import contadores
+from .fragmentos_cards import TEMPLATE_CARD_KANBAN, anexar_html_cards
+from .models import RegistroComercial
+
+
+logger = logging.getLogger(__name__)
+
+CANAL_REDIS = 'crm:kanban:eventos'
+
+# Eventos pendentes por assinante; acima disso o cliente recebe "recarregar"
+TAMANHO_FILA = 200
+
+EVENTO_RECARREGAR = {'tipo': 'recarregar'}
+
+# Por quanto tempo o número de assinantes do canal Redis é reaproveitado
+# (evita um PUBSUB NUMSUB por save em sequências de alterações)
+INTERVALO_CHECAGEM_ASSINANTES = 1.0  # segundos
+
+
+# ========== CANAL EM MEMÓRIA ==========
+
+class _AssinaturaMemoria:
+    """Fila de um assinante, alimentada a partir de qualquer thread."""
+
+    def __init__(self, canal):
+        self._canal = canal
+        self._loop = None
+        self._fila = None
+        self._atrasada = False
+
+    async def __aenter__(self):
+        self._loop = asyncio.get_running_loop()
+        self._fila = asyncio.Queue(maxsize=TAMANHO_FILA)
+        self._canal._assinaturas.add(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._canal._assinaturas.discard(self)
+
+    def entregar(self, evento):
+        try:
+            self._loop.call_soon_threadsafe(self._enfileirar, evento)
+        except RuntimeError:
+            # Loop já encerrado (conexão fechando)
+            pass
+
+    def _enfileirar(self, evento):
+        try:
+            self._fila.put_nowait(evento)
+        except asyncio.QueueFull:
+            self._atrasada = True
+
+    async def proximo(self, timeout):
+        """Próximo evento, ou None se nada chegou em timeout segundos."""
+        if self._atrasada:
+            # Cliente lento perdeu eventos: descarta a fila e pede recarga
+            self._atrasada = False
+            while not self._fila.empty():
+                self._fila.get_nowait()
+            return EVENTO_RECARREGAR
+        try:
+            return await asyncio.wait_for(self._fila.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class CanalMemoria:
+    """Pub/sub no próprio processo."""
+
+    def __init__(self):
+        self._assinaturas = set()
+
+    def ativo(self):
+        return bool(self._assinaturas)
+
+    def publicar(self, evento):
+        for assinatura in list(self._assinaturas):
+            assinatura.entregar(evento)
+
+    def assinar(self):
+        """Assinatura a usar com async with (registrada ao entrar, removida ao sair)."""
+        return _AssinaturaMemoria(self)
+
+
+# ========== CANAL REDIS ==========
+
+class _AssinaturaRedis:
+
+    def __init__(self, url):
+        self._url = url
+        self._cliente = None
+        self._pubsub = None
+
+    async def __aenter__(self):
+        from redis import asyncio as aioredis
+
+        self._cliente = aioredis.from_url(self._url)
+        self._pubsub = self._cliente.pubsub()
+        await self._pubsub.subscribe(CANAL_REDIS)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._pubsub.unsubscribe(CANAL_REDIS)
+        await self._pubsub.aclose()
+        await self._cliente.aclose()
+
+    async def proximo(self, timeout):
+        mensagem = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        if mensagem is None:
+            return None
+        return json.loads(mensagem['data'])
+
+
+class CanalRedis:
+    """Pub/sub via Redis (PUBLISH/SUBSCRIBE), compartilhado entre workers."""
+
+    def __init__(self, url):
+        self.url = url
+        self._cliente = None
+        self._assinantes = 0
+        self._checado_em = None
+
+    def _obter_cliente(self):
+        import redis
+
+        if self._cliente is None:
+            # Timeouts curtos: publicar roda no request que salvou o registro
+            timeout = getattr(settings, 'KANBAN_EVENTOS_REDIS_TIMEOUT', 0.5)
+            self._cliente = redis.Redis.from_url(
+                self.url, socket_timeout=timeout, socket_connect_timeout=timeout,
+            )
+        return self._cliente
+
+    def ativo(self):
+        """Há quadros assinando o canal (em qualquer worker)?"""
+        import redis
+
+        agora = time.monotonic()
+        if self._checado_em is None or agora - self._checado_em >= INTERVALO_CHECAGEM_ASSINANTES:
+            try:
+                resposta = self._obter_cliente().pubsub_numsub(CANAL_REDIS)
+                self._assinantes = resposta[0][1] if resposta else 0
+            except redis.RedisError:
+                logger.warning('Falha ao consultar assinantes do Kanban no Redis', exc_info=True)
+                self._assinantes = 0
+            self._checado_em = agora
+        return self._assinantes > 0
+
+    def publicar(self, evento):
+        import redis
+
+        try:
+            self._obter_cliente().publish(CANAL_REDIS, json.dumps(evento))
+        except redis.RedisError:
+            # Tempo real é best-effort: a alteração já foi gravada
+            logger.warning('Falha ao publicar evento do Kanban no Redis', exc_info=True)
+
+    def assinar(self):
+        """Assinatura a usar com async with (conexão própria de pub/sub)."""
+        return _AssinaturaRedis(self.url)
+
+
+_canal = None
+
+
+def obter_canal():
+    """Canal configurado em KANBAN_EVENTOS_BACKEND (instância única por processo)."""
+    global _canal
+    if _canal is None:
+        if getattr(settings, 'KANBAN_EVENTOS_BACKEND', 'memoria') == 'redis':
+            _canal = CanalRedis(settings.REDIS_URL)
+        else:
+            _canal = CanalMemoria()
+    return _canal
+
+
+# ========== PUBLICAÇÃO ==========
+
+def evento_card(registro, status_anterior=None, vendedor_anterior_id=None, no_kanban_anterior=False):
+    """Monta o evento de um card a partir do registro já alterado."""
+    html = ''
+    if registro.no_kanban:
+        anexar_html_cards((TEMPLATE_CARD_KANBAN, [registro]))
+        html = str(registro.html_card)
+    return {
+        'tipo': 'card',
+        'id': str(registro.pk),
+        'status_anterior': status_anterior,
+        'status_novo': registro.status_pipeline,
+        'no_kanban': registro.no_kanban,
+        'no_kanban_anterior': no_kanban_anterior,
+        'vendedores': sorted({registro.vendedor_id, vendedor_anterior_id} - {None}),
+        'versao': registro.versao,
+        'html': html,
+    }
+
+
+def publicar_card(registro, chave_anterior=None):
+    """
+    Publica a alteração de um registro após o commit (chamado pelo signal de save).
+
+    Args:
+        registro: Registro salvo
+        chave_anterior: contadores.chave_contador() de antes do save
+            (None para registro novo)
+    """
+    canal = obter_canal()
+    if not canal.ativo() or contadores.chave_contador(registro) is None:
+        return
+    vendedor_anterior_id, status_anterior, no_kanban_anterior, _origem = chave_anterior or (None, None, False, None)
+    if not (registro.no_kanban or no_kanban_anterior):
+        # Mudança só no backlog: nenhum quadro exibe o card
+        return
+
+    transaction.on_commit(lambda: canal.publicar(
+        evento_card(registro, status_anterior, vendedor_anterior_id, no_kanban_anterior)
+    ))
+
+
+def publicar_lote(estados):
+    """
+    Publica as alterações de uma operação em lote (update() não dispara signals).
+
+    Args:
+        estados: dicts com 'id', 'vendedor_id', 'status_pipeline' e
+            'no_kanban' de antes da alteração
+    """
+    canal = obter_canal()
+    if not canal.ativo() or not estados:
+        return
+
+    def publicar():
+        registros = RegistroComercial.objects.para_cards().in_bulk(
+            [estado['id'] for estado in estados]
+        )
+        for estado in estados:
+            registro = registros.get(estado['id'])
+            if registro is None or not (registro.no_kanban or estado['no_kanban']):
+                continue
+            canal.publicar(evento_card(
+                registro, estado['status_pipeline'], estado['vendedor_id'], estado['no_kanban']
+            ))
+
+    transaction.on_commit(publicar)
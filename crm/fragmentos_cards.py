@@ -0,0 +1,69 @@
+"""
+Cache do HTML renderizado dos cards (quadro Kanban, backlog e "Carregar Mais").
+
+Cada card é guardado por (template, registro.id, registro.versao): versao é
+incrementada em todo save() (RastreamentoAlteracoesMixin), nas ações em lote
+e na atualização de duplicados da importação, então um card alterado nunca
+reaproveita o HTML antigo. A chave também leva um hash do código-fonte do
+template, que muda a cada deploy que altera o template.
+
+Uma página inteira é resolvida com um get_many() e um set_many(): só os
+cards ausentes do cache são renderizados.
+
+O nome do vendedor exibido no card não faz parte da chave (renomear um
+usuário não altera os registros): fica desatualizado no máximo por
+CARDS_CACHE_TIMEOUT.
+"""
+
+import hashlib
+
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+
+CARDS_CACHE_TIMEOUT = 60 * 60  # 1 hora
+
+TEMPLATE_CARD_KANBAN = 'crm/_card.html'
+TEMPLATE_CARD_BACKLOG = 'crm/partials/_backlog_card.html'
+TEMPLATE_CARD_LISTA = 'crm/partials/_registro_card.html'
+
+
+def _versao_template(template):
+    return hashlib.md5(template.template.source.encode()).hexdigest()[:12]
+
+
+def _chave_card(versao_template, registro):
+    return f'crm:card:{versao_template}:{registro.pk}:{registro.versao}'
+
+
+def anexar_html_cards(*grupos):
+    """
+    Preenche registro.html_card dos registros informados.
+
+    Args:
+        grupos: Pares (nome do template, registros); todos os grupos são
+            lidos do cache juntos
+
+    Returns:
+        int: Cards renderizados (ausentes do cache)
+    """
+    pendentes = {}
+    for nome_template, registros in grupos:
+        template = get_template(nome_template)
+        versao = _versao_template(template)
+        for registro in registros:
+            pendentes[_chave_card(versao, registro)] = (template, registro)
+    if not pendentes:
+        return 0
+
+    em_cache = cache.get_many(pendentes.keys())
+    novos = {}
+    for chave, (template, registro) in pendentes.items():
+        html = em_cache.get(chave)
+        if html is None:
+            html = novos[chave] = template.render({'registro': registro})
+        registro.html_card = mark_safe(html)
+    if novos:
+        cache.set_many(novos, CARDS_CACHE_TIMEOUT)
+    return len(novos)
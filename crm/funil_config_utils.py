@@ -3,10 +3,24 @@ Utilitários para carregar configurações do funil.
 Usa database-first, fallback para hardcoded.
 """
 
+import logging
+
 from django.core.cache import cache
+from .cache_utils import chave_namespace, invalidar_namespace
 from .models_config import FunilResultadoConfig, FunilProximoPassoConfig
 
 
+# Namespace das configurações do funil (ver crm/cache_utils.py). A versão é
+# trocada pelos signals de save/delete de FunilResultadoConfig e
+# FunilProximoPassoConfig (crm/signals.py).
+NAMESPACE_FUNIL = 'funil'
+
+# Default de cache.get(): diferencia "não está no cache" de uma lista vazia cacheada
+_AUSENTE = object()
+
+logger = logging.getLogger(__name__)
+
+
 def obter_resultados_config(coluna_pipeline, status_cliente):
     """
     Obtém resultados configurados para uma coluna e status.
@@ -19,23 +33,24 @@ def obter_resultados_config(coluna_pipeline, status_cliente):
     Returns:
         List[dict]: [{'key': '...', 'label': '...', 'next_status_label': '...'}]
     """
-    from .views import PIPELINE_RULES, PIPELINE_TO_DB_MAP, STATUS_PIPELINE_MAP
+    from .pipeline.rules import PIPELINE_RULES
+    from .views import PIPELINE_TO_DB_MAP, STATUS_PIPELINE_MAP
     from .models import StatusPipelineChoices
     
-    cache_key = f'funil_resultados_{coluna_pipeline}_{status_cliente}'
-    cached = cache.get(cache_key)
-    if cached:
+    cache_key = chave_namespace(NAMESPACE_FUNIL, 'resultados', coluna_pipeline, status_cliente)
+    cached = cache.get(cache_key, _AUSENTE)
+    if cached is not _AUSENTE:
         return cached
     
     # Tentar carregar da config
     try:
-        configs = FunilResultadoConfig.objects.filter(
+        configs = list(FunilResultadoConfig.objects.filter(
             coluna_pipeline=coluna_pipeline,
             status_cliente=status_cliente,
             ativo=True
-        ).order_by('ordem', 'label')
+        ).order_by('ordem', 'label'))
         
-        if configs.exists():
+        if configs:
             resultados = []
             current_stage_key = STATUS_PIPELINE_MAP.get(coluna_pipeline, coluna_pipeline)
             pipeline_rules = PIPELINE_RULES.get(current_stage_key, {})
@@ -55,7 +70,7 @@ def obter_resultados_config(coluna_pipeline, status_cliente):
             cache.set(cache_key, resultados, 3600)  # 1 hora
             return resultados
     except Exception as e:
-        print(f"Erro ao carregar config: {e}")
+        logger.warning("Erro ao carregar config do funil: %s", e)
     
     # Fallback: usar RESULTADO_POR_STATUS_CLIENTE
     from .pipeline.rules import RESULTADO_POR_STATUS_CLIENTE, RESULT_LABELS
@@ -92,9 +107,9 @@ def obter_proximos_passos_config(coluna_pipeline, status_cliente):
         List[str]: Labels dos próximos passos
     """
     
-    cache_key = f'funil_proximos_passos_{coluna_pipeline}_{status_cliente}'
-    cached = cache.get(cache_key)
-    if cached:
+    cache_key = chave_namespace(NAMESPACE_FUNIL, 'proximos_passos', coluna_pipeline, status_cliente)
+    cached = cache.get(cache_key, _AUSENTE)
+    if cached is not _AUSENTE:
         return cached
     
     # Tentar carregar da config
@@ -110,7 +125,7 @@ def obter_proximos_passos_config(coluna_pipeline, status_cliente):
             cache.set(cache_key, steps_list, 3600)
             return steps_list
     except Exception as e:
-        print(f"Erro ao carregar próximos passos: {e}")
+        logger.warning("Erro ao carregar próximos passos do funil: %s", e)
     
     # Fallback: usar STAGE_CONFIG
     from .views import STAGE_CONFIG
@@ -123,11 +138,9 @@ def obter_proximos_passos_config(coluna_pipeline, status_cliente):
 
 
 def invalidar_cache_funil():
-    """Limpa cache de configurações do funil."""
-    from django.core.cache import cache
-    import re
-    
-    # Em desenvolvimento, limpar todos funil_*
-    pattern = re.compile(r'funil_.*')
-    for key in cache.keys('funil_*'):
-        cache.delete(key)
+    """
+    Invalida o cache de configurações do funil.
+    Troca a versão do namespace; com cache compartilhado (Redis) vale
+    para todos os processos.
+    """
+    invalidar_namespace(NAMESPACE_FUNIL)
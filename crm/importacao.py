@@ -0,0 +1,231 @@
+"""
+Motor de importação de planilhas Excel (XLSX) para RegistroComercial.
+
+Lê a planilha em modo streaming (openpyxl read_only), valida as linhas em
+lotes, deduplica cada lote contra a base (crm/deduplicacao.py) e grava com
+bulk_create/bulk_update em uma única transação, mantendo memória limitada
+ao tamanho do lote.
+"""
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, transaction
+
+from .models import (
+    RegistroComercial,
+    StatusPipelineChoices,
+    OrigemChoices,
+    CanalContatoChoices,
+    normalizar_telefone,
+)
+from . import contadores, metricas
+from .cidades import cidade_canonica, registrar_cidades
+from .deduplicacao import POLITICA_PULAR, POLITICAS_VALIDAS, resolver_lote
+from .estatisticas import invalidar_estatisticas
+
+
+CAMPOS_OBRIGATORIOS = ('nome_empresa', 'telefone', 'cidade', 'uf', 'origem', 'canal_contato')
+
+ORIGENS_VALIDAS = frozenset(OrigemChoices.values)
+CANAIS_VALIDOS = frozenset(CanalContatoChoices.values)
+
+# Tamanho padrão do lote (linhas por bulk_create); configurável em settings
+TAMANHO_LOTE_PADRAO = 500
+
+
+def _texto(valor):
+    """Converte o valor da célula para texto (None → '')."""
+    if valor is None:
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor).strip()
+
+
+def _validar_linha(row_idx, row_data):
+    """
+    Valida uma linha e retorna (dados normalizados, erro).
+
+    Returns:
+        tuple: (dict | None, str | None)
+    """
+    dados = {campo: _texto(row_data.get(campo)) for campo in CAMPOS_OBRIGATORIOS}
+
+    if not all(dados.values()):
+        return None, f"Linha {row_idx}: dados faltando"
+
+    if dados['canal_contato'] not in CANAIS_VALIDOS:
+        return None, f"Linha {row_idx}: canal inválido '{dados['canal_contato']}'"
+
+    if dados['origem'] not in ORIGENS_VALIDAS:
+        return None, f"Linha {row_idx}: origem inválida '{dados['origem']}'"
+
+    if len(dados['uf']) > 2:
+        return None, f"Linha {row_idx}: UF inválida '{dados['uf']}'"
+
+    dados['codigo_winthor'] = _texto(row_data.get('codigo_winthor')) or None
+    return dados, None
+
+
+def _gravar_lote(lote, vendedor, status_cliente, politica):
+    """
+    Grava um lote validado: deduplica (uma consulta), cria os novos com
+    bulk_create e aplica a política aos duplicados com bulk_update.
+
+    Returns:
+        dict: {'importados': int, 'atualizados': int, 'duplicados': int}
+    """
+    linhas = [
+        (row_idx, RegistroComercial(
+            nome_empresa=dados['nome_empresa'][:200],
+            telefone=dados['telefone'][:50],
+            telefone_normalizado=normalizar_telefone(dados['telefone'])[:50],
+            cidade=cidade_canonica(dados['cidade'], dados['uf'])[:100],
+            uf=dados['uf'].upper(),
+            origem=dados['origem'],
+            canal_contato=dados['canal_contato'],
+            status_cliente=status_cliente,
+            codigo_winthor=dados['codigo_winthor'],
+            vendedor=vendedor,
+            status_pipeline=StatusPipelineChoices.CONTA_PARA_CONTATO.value,
+        ))
+        for row_idx, dados in lote
+    ]
+    for _, registro in linhas:
+        registro.atualizar_busca()
+    novos, atualizar, campos, duplicados = resolver_lote(linhas, politica)
+
+    with transaction.atomic():
+        RegistroComercial.objects.bulk_create(novos)
+        contadores.registrar_criados(novos)
+        if atualizar:
+            # Campos alterados não fazem parte da chave dos contadores
+            RegistroComercial.objects.bulk_update(atualizar, sorted(campos))
+            metricas.descontar_consolidados(
+                registro._chave_metrica_original for registro in atualizar
+            )
+        invalidar_estatisticas(*{registro.vendedor_id for registro in novos + atualizar})
+        registrar_cidades(
+            {(registro.cidade, registro.uf) for registro in novos + atualizar},
+            excluir_ids=[registro.pk for registro in novos + atualizar],
+        )
+
+    return {
+        'importados': len(novos),
+        'atualizados': len(atualizar),
+        'duplicados': duplicados,
+    }
+
+
+def iterar_linhas(arquivo):
+    """
+    Itera as linhas da planilha em modo streaming.
+
+    Yields:
+        tuple: (número da linha, dict {cabeçalho: valor})
+    """
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        linhas = sheet.iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if not cabecalho:
+            return
+        headers = [_texto(valor) for valor in cabecalho]
+        for row_idx, row in enumerate(linhas, start=2):
+            if row is None or all(valor is None for valor in row):
+                continue
+            yield row_idx, dict(zip(headers, row))
+    finally:
+        workbook.close()
+
+
+def estimar_total_linhas(arquivo):
+    """
+    Estima o número de linhas de dados (sem cabeçalho) pela dimensão da planilha.
+
+    Não percorre o arquivo: usa a dimensão gravada no XLSX, que pode não
+    existir (retorna None) ou incluir linhas vazias no final.
+    """
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        max_row = workbook.active.max_row
+    finally:
+        workbook.close()
+    if not max_row:
+        return None
+    return max(max_row - 1, 0)
+
+
+def importar_planilha(arquivo, vendedor, status_cliente='novo', tamanho_lote=None,
+                      politica=POLITICA_PULAR, progresso=None):
+    """
+    Importa registros de uma planilha Excel.
+
+    Args:
+        arquivo: Arquivo XLSX (caminho ou file-like)
+        vendedor: Usuário dono dos registros importados
+        status_cliente: Status do cliente aplicado a todas as linhas
+        tamanho_lote: Linhas por bulk_create (padrão: settings.IMPORTACAO_TAMANHO_LOTE)
+        politica: Tratamento de duplicados ('pular', 'atualizar' ou 'mesclar')
+        progresso: Callback opcional chamado a cada lote e ao final com o
+            resumo parcial (mesmo formato do retorno)
+
+    Returns:
+        dict: {'linhas', 'importados', 'atualizados', 'duplicados', 'erros': list[str]}
+    """
+    if tamanho_lote is None:
+        tamanho_lote = getattr(settings, 'IMPORTACAO_TAMANHO_LOTE', TAMANHO_LOTE_PADRAO)
+    if politica not in POLITICAS_VALIDAS:
+        politica = POLITICA_PULAR
+
+    resumo = {'linhas': 0, 'importados': 0, 'atualizados': 0, 'duplicados': 0, 'erros': []}
+    lote = []
+
+    for row_idx, row_data in iterar_linhas(arquivo):
+        resumo['linhas'] += 1
+        dados, erro = _validar_linha(row_idx, row_data)
+        if erro:
+            resumo['erros'].append(erro)
+        else:
+            lote.append((row_idx, dados))
+            if len(lote) >= tamanho_lote:
+                _processar_lote(lote, vendedor, status_cliente, politica, resumo)
+                lote = []
+
+        # Reporta a cada `tamanho_lote` linhas lidas (válidas ou não)
+        if progresso and resumo['linhas'] % tamanho_lote == 0:
+            progresso(resumo)
+
+    if lote:
+        _processar_lote(lote, vendedor, status_cliente, politica, resumo)
+
+    if progresso:
+        progresso(resumo)
+
+    return resumo
+
+
+def _processar_lote(lote, vendedor, status_cliente, politica, resumo):
+    """
+    Grava o lote e acumula no resumo.
+
+    Se o banco recusar o lote (IntegrityError/DataError), a transação do lote
+    é desfeita e ele é dividido ao meio até isolar as linhas recusadas: só
+    elas entram nos erros e as demais são gravadas normalmente.
+    """
+    try:
+        totais = _gravar_lote(lote, vendedor, status_cliente, politica)
+    except (IntegrityError, DataError) as e:
+        if len(lote) == 1:
+            resumo['erros'].append(f"Linha {lote[0][0]}: {e}")
+            return
+        meio = len(lote) // 2
+        _processar_lote(lote[:meio], vendedor, status_cliente, politica, resumo)
+        _processar_lote(lote[meio:], vendedor, status_cliente, politica, resumo)
+        return
+    for chave, valor in totais.items():
+        resumo[chave] += valor
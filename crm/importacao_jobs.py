@@ -0,0 +1,290 @@
+"""
+Execução de importações de planilha em segundo plano (ImportacaoJob).
+
+O upload apenas grava o arquivo e cria o job (status 'pendente'). Um worker
+reserva o job de forma atômica (UPDATE ... WHERE status='pendente'), executa
+importar_planilha() e grava o progresso a cada lote.
+
+Um worker interrompido no meio (reinício do servidor, processo morto) deixa o
+job em 'processando' sem avanço em atualizado_em; recuperar_jobs_travados()
+(chamado por processar_importacoes ao iniciar) devolve esses jobs à fila ou,
+esgotadas as tentativas, marca erro.
+
+Executores (settings.IMPORTACAO_EXECUTOR):
+- 'thread'  : ThreadPoolExecutor no próprio processo web (padrão; funciona
+              localmente com SQLite, sem serviços extras)
+- 'comando' : o job fica pendente até `python manage.py processar_importacoes`
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .importacao import importar_planilha, estimar_total_linhas
+from .models import ImportacaoJob
+
+logger = logging.getLogger(__name__)
+
+# Erros guardados no job (o restante é apenas contado)
+MAX_ERROS_GRAVADOS = 500
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _obter_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMPORTACAO_MAX_WORKERS', 1),
+                thread_name_prefix='importacao',
+            )
+        return _executor
+
+
+def criar_job(arquivo, vendedor, status_cliente='novo', politica_duplicados='pular'):
+    """
+    Cria o job para um arquivo enviado e agenda o processamento.
+
+    Args:
+        arquivo: UploadedFile recebido no formulário
+        vendedor: Usuário dono dos registros importados
+        status_cliente: Status do cliente aplicado a todas as linhas
+        politica_duplicados: 'pular', 'atualizar' ou 'mesclar' (crm/deduplicacao.py)
+
+    Returns:
+        ImportacaoJob
+    """
+    job = ImportacaoJob(
+        nome_arquivo=arquivo.name[:255],
+        vendedor=vendedor,
+        status_cliente=status_cliente,
+        politica_duplicados=politica_duplicados,
+    )
+    job.arquivo.save(arquivo.name, arquivo, save=False)
+    job.save()
+
+    # Só agenda depois do commit, para o worker enxergar o job
+    transaction.on_commit(lambda: agendar_job(job.id))
+    return job
+
+
+def agendar_job(job_id):
+    """Agenda o job no executor configurado (no-op em modo 'comando')."""
+    if getattr(settings, 'IMPORTACAO_EXECUTOR', 'thread') != 'thread':
+        return
+    _obter_executor().submit(_executar_em_thread, job_id)
+
+
+def _executar_em_thread(job_id):
+    close_old_connections()
+    try:
+        processar_job(job_id)
+    except Exception:
+        logger.exception("Falha inesperada ao processar importação %s", job_id)
+    finally:
+        close_old_connections()
+
+
+def reservar_job(job_id):
+    """
+    Marca o job como 'processando' se ainda estiver pendente.
+
+    Returns:
+        bool: True se este worker ficou com o job
+    """
+    agora = timezone.now()
+    reservados = ImportacaoJob.objects.filter(id=job_id, status='pendente').update(
+        status='processando',
+        iniciado_em=agora,
+        atualizado_em=agora,
+        tentativas=F('tentativas') + 1,
+    )
+    return reservados == 1
+
+
+def proximo_job_pendente():
+    """Reserva o job pendente mais antigo e retorna seu id (ou None)."""
+    pendentes = (
+        ImportacaoJob.objects.filter(status='pendente')
+        .order_by('criado_em')
+        .values_list('id', flat=True)
+    )
+    for job_id in pendentes[:10]:
+        if reservar_job(job_id):
+            return job_id
+    return None
+
+
+def recuperar_jobs_travados(tempo_limite=None):
+    """
+    Trata jobs 'processando' sem progresso há mais de tempo_limite.
+
+    Com o arquivo ainda disponível e menos de IMPORTACAO_MAX_TENTATIVAS
+    reservas, o job volta a 'pendente' (reprocessar é seguro: as linhas já
+    gravadas voltam como duplicados e seguem a política do job); caso
+    contrário é marcado como 'erro'. Cada job é alterado com UPDATE
+    condicionado ao atualizado_em lido, para não atropelar um worker que
+    voltou a gravar progresso.
+
+    Args:
+        tempo_limite: timedelta (padrão: settings.IMPORTACAO_TEMPO_LIMITE_MINUTOS)
+
+    Returns:
+        tuple: (reenfileirados: int, com_erro: int)
+    """
+    if tempo_limite is None:
+        tempo_limite = timedelta(minutes=getattr(settings, 'IMPORTACAO_TEMPO_LIMITE_MINUTOS', 15))
+    max_tentativas = getattr(settings, 'IMPORTACAO_MAX_TENTATIVAS', 3)
+    agora = timezone.now()
+
+    travados = (
+        ImportacaoJob.objects.filter(status='processando')
+        .annotate(ultimo_sinal=Coalesce('atualizado_em', 'iniciado_em', 'criado_em'))
+        .filter(ultimo_sinal__lt=agora - tempo_limite)
+    )
+
+    reenfileirados = com_erro = 0
+    for job in travados:
+        jobs = ImportacaoJob.objects.filter(id=job.id, status='processando', atualizado_em=job.atualizado_em)
+        arquivo_disponivel = bool(job.arquivo) and job.arquivo.storage.exists(job.arquivo.name)
+
+        if arquivo_disponivel and job.tentativas < max_tentativas:
+            if jobs.update(
+                status='pendente',
+                iniciado_em=None,
+                atualizado_em=None,
+                total_linhas=None,
+                linhas_processadas=0,
+                importados=0,
+                atualizados=0,
+                duplicados=0,
+                total_erros=0,
+                erros=[],
+            ):
+                logger.warning("Importação %s travada; devolvida à fila (tentativa %s)", job.id, job.tentativas)
+                reenfileirados += 1
+            continue
+
+        if jobs.update(
+            status='erro',
+            mensagem_erro=(
+                f'Importação interrompida (sem progresso desde '
+                f'{timezone.localtime(job.ultimo_sinal):%d/%m/%Y %H:%M}). Envie a planilha novamente.'
+            ),
+            finalizado_em=agora,
+            arquivo='',
+        ):
+            logger.warning("Importação %s travada; marcada como erro após %s tentativa(s)", job.id, job.tentativas)
+            if arquivo_disponivel:
+                job.arquivo.delete(save=False)
+            com_erro += 1
+
+    return reenfileirados, com_erro
+
+
+def _campos_resumo(resumo):
+    """Converte o resumo de importar_planilha nos campos do job."""
+    return {
+        'linhas_processadas': resumo['linhas'],
+        'importados': resumo['importados'],
+        'atualizados': resumo['atualizados'],
+        'duplicados': resumo['duplicados'],
+        'total_erros': len(resumo['erros']),
+        'erros': resumo['erros'][:MAX_ERROS_GRAVADOS],
+    }
+
+
+def processar_job(job_id, reservado=False):
+    """
+    Processa um job de importação.
+
+    Args:
+        job_id: UUID do job
+        reservado: True se o chamador já reservou o job (proximo_job_pendente)
+
+    Returns:
+        bool: True se o job foi processado por esta chamada
+    """
+    if not reservado and not reservar_job(job_id):
+        return False
+
+    job = ImportacaoJob.objects.get(id=job_id)
+    jobs = ImportacaoJob.objects.filter(id=job_id)
+
+    def progresso(resumo):
+        jobs.update(**_campos_resumo(resumo), atualizado_em=timezone.now())
+
+    try:
+        with job.arquivo.open('rb') as arquivo:
+            jobs.update(total_linhas=estimar_total_linhas(arquivo), atualizado_em=timezone.now())
+            arquivo.seek(0)
+            resultado = importar_planilha(
+                arquivo,
+                vendedor=job.vendedor,
+                status_cliente=job.status_cliente,
+                politica=job.politica_duplicados,
+                progresso=progresso,
+            )
+    except Exception as e:
+        logger.exception("Erro na importação %s", job_id)
+        agora = timezone.now()
+        jobs.update(
+            status='erro',
+            mensagem_erro=f'Erro ao processar arquivo: {str(e)}',
+            atualizado_em=agora,
+            finalizado_em=agora,
+        )
+    else:
+        agora = timezone.now()
+        jobs.update(
+            **_campos_resumo(resultado),
+            status='concluido',
+            total_linhas=resultado['linhas'],
+            atualizado_em=agora,
+            finalizado_em=agora,
+        )
+    finally:
+        # O arquivo só é necessário durante o processamento
+        job.arquivo.delete(save=False)
+        jobs.update(arquivo='')
+
+    return True
+
+
+def progresso_job(job):
+    """Dados de progresso do job para a API de polling."""
+    total = job.total_linhas
+    percentual = None
+    if job.status == 'concluido':
+        percentual = 100
+    elif total:
+        percentual = min(round(job.linhas_processadas * 100 / total), 99)
+
+    return {
+        'id': str(job.id),
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'nome_arquivo': job.nome_arquivo,
+        'status_cliente': job.status_cliente,
+        'total_linhas': total,
+        'linhas_processadas': job.linhas_processadas,
+        'importados': job.importados,
+        'atualizados': job.atualizados,
+        'duplicados': job.duplicados,
+        'politica_duplicados': job.politica_duplicados,
+        'percentual': percentual,
+        'eta_segundos': job.eta_segundos(),
+        'erros': job.erros,
+        'total_erros': job.total_erros,
+        'mensagem_erro': job.mensagem_erro,
+        'finalizado': job.status in ('concluido', 'erro'),
+    }
@@ -0,0 +1,181 @@
+"""
+Instrumentação de requisições: consultas SQL, tempo de SQL, tempo de
+renderização de templates e tempo total por view.
+
+Ativada por CRM_INSTRUMENTACAO (ver config/settings.py). Desativada, o
+middleware levanta MiddlewareNotUsed na inicialização e sai da cadeia: não há
+custo por requisição.
+
+Ativada, cada requisição:
+- conta consultas e soma o tempo de SQL com connection.execute_wrapper()
+  em todas as conexões;
+- soma o tempo de Template.render() (backend do Django; includes ficam
+  dentro do template que os chama);
+- registra uma linha no logger 'crm.instrumentacao':
+      view=crm:kanban metodo=GET status=200 total_ms=41.2 sql=6 sql_ms=3.1 template_ms=18.4
+  (os mesmos campos vão em extra['instrumentacao'] para formatadores JSON);
+- devolve o cabeçalho Server-Timing (painel Network do navegador);
+- guarda a medição em um buffer circular em memória (por processo), agregado
+  em p50/p95 por view na página /crm/admin/desempenho-requisicoes/.
+"""
+
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from statistics import mean, quantiles
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+logger = logging.getLogger('crm.instrumentacao')
+
+TAMANHO_BUFFER_PADRAO = 2000
+
+_medicao_atual = ContextVar('crm_medicao_atual', default=None)
+_amostras = deque(maxlen=TAMANHO_BUFFER_PADRAO)
+_lock_template = threading.Lock()
+_template_instrumentado = False
+
+
+@dataclass
+class Medicao:
+    """Medição de uma requisição."""
+    view: str = ''
+    metodo: str = ''
+    status: int = 0
+    total_ms: float = 0.0
+    sql: int = 0
+    sql_ms: float = 0.0
+    template_ms: float = 0.0
+
+    def executar_sql(self, execute, sql, params, many, context):
+        """Wrapper de connection.execute_wrapper()."""
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += 1
+            self.sql_ms += (time.perf_counter() - inicio) * 1000
+
+    def server_timing(self):
+        return (
+            f'sql;dur={self.sql_ms:.1f};desc="{self.sql} consultas", '
+            f'tpl;dur={self.template_ms:.1f};desc="templates", '
+            f'total;dur={self.total_ms:.1f}'
+        )
+
+    def linha_log(self):
+        return (
+            f'view={self.view} metodo={self.metodo} status={self.status} '
+            f'total_ms={self.total_ms:.1f} sql={self.sql} sql_ms={self.sql_ms:.1f} '
+            f'template_ms={self.template_ms:.1f}'
+        )
+
+
+def _instrumentar_templates():
+    """Mede Template.render() do backend do Django (uma vez por processo)."""
+    global _template_instrumentado
+    with _lock_template:
+        if _template_instrumentado:
+            return
+        from django.template.backends.django import Template
+
+        render_original = Template.render
+
+        def render(self, context=None, request=None):
+            medicao = _medicao_atual.get()
+            if medicao is None:
+                return render_original(self, context, request)
+            inicio = time.perf_counter()
+            try:
+                return render_original(self, context, request)
+            finally:
+                medicao.template_ms += (time.perf_counter() - inicio) * 1000
+
+        Template.render = render
+        _template_instrumentado = True
+
+
+class InstrumentacaoMiddleware:
+    """Mede cada requisição (ver docstring do módulo)."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'CRM_INSTRUMENTACAO', False):
+            raise MiddlewareNotUsed
+        global _amostras
+        tamanho = getattr(settings, 'CRM_INSTRUMENTACAO_AMOSTRAS', TAMANHO_BUFFER_PADRAO)
+        if _amostras.maxlen != tamanho:
+            _amostras = deque(_amostras, maxlen=tamanho)
+        _instrumentar_templates()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        medicao = Medicao(metodo=request.method)
+        token = _medicao_atual.set(medicao)
+        inicio = time.perf_counter()
+        try:
+            with ExitStack() as pilha:
+                for alias in connections:
+                    pilha.enter_context(connections[alias].execute_wrapper(medicao.executar_sql))
+                response = self.get_response(request)
+        finally:
+            _medicao_atual.reset(token)
+        medicao.total_ms = (time.perf_counter() - inicio) * 1000
+
+        if response.streaming:
+            # SSE/downloads: o tempo até os cabeçalhos não representa a requisição
+            return response
+
+        correspondencia = request.resolver_match
+        medicao.view = (correspondencia.view_name if correspondencia else '') or 'sem_rota'
+        medicao.status = response.status_code
+        response['Server-Timing'] = medicao.server_timing()
+        logger.info(medicao.linha_log(), extra={'instrumentacao': asdict(medicao)})
+        _amostras.append(medicao)
+        return response
+
+
+def _percentis(valores):
+    """(p50, p95) dos valores; com uma só amostra, o próprio valor."""
+    if len(valores) == 1:
+        return valores[0], valores[0]
+    cortes = quantiles(valores, n=20, method='inclusive')
+    return cortes[9], cortes[18]
+
+
+def resumo_por_view():
+    """
+    Agrega o buffer em memória por view (mais lenta no p95 primeiro).
+
+    Returns:
+        list[dict]: {'view', 'requisicoes', 'p50_ms', 'p95_ms', 'sql_medio',
+        'sql_p95', 'sql_ms_p95', 'template_ms_p95'}
+    """
+    por_view = defaultdict(list)
+    for medicao in list(_amostras):
+        por_view[medicao.view].append(medicao)
+
+    resumo = []
+    for view, medicoes in por_view.items():
+        p50, p95 = _percentis([medicao.total_ms for medicao in medicoes])
+        resumo.append({
+            'view': view,
+            'requisicoes': len(medicoes),
+            'p50_ms': round(p50, 1),
+            'p95_ms': round(p95, 1),
+            'sql_medio': round(mean(medicao.sql for medicao in medicoes), 1),
+            'sql_p95': round(_percentis([medicao.sql for medicao in medicoes])[1], 1),
+            'sql_ms_p95': round(_percentis([medicao.sql_ms for medicao in medicoes])[1], 1),
+            'template_ms_p95': round(_percentis([medicao.template_ms for medicao in medicoes])[1], 1),
+        })
+    return sorted(resumo, key=lambda linha: linha['p95_ms'], reverse=True)
+
+
+def total_amostras():
+    return len(_amostras)
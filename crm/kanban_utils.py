@@ -0,0 +1,220 @@
+"""
+Utilitários para montar o quadro Kanban.
+Carrega contagens e cards de todas as colunas com poucas consultas
+e pagina o "Carregar Mais" por cursor (keyset).
+"""
+
+import base64
+import json
+import uuid
+from datetime import datetime
+
+from django.db.models import Case, Count, F, Q, When, Window
+from django.db.models.functions import RowNumber
+
+from .models import StatusPipelineChoices
+
+
+def carregar_quadro_kanban(registros, status_keys, cards_por_coluna=8, contagens=None):
+    """
+    Carrega o quadro Kanban em duas consultas.
+
+    - Uma agregação (COUNT com FILTER) traz o total de cada coluna e do backlog,
+      a menos que as contagens já sejam informadas (ex: via ContadorPipeline).
+    - Uma consulta com ROW_NUMBER() particionado por status_pipeline traz
+      os primeiros N cards de cada coluna, já na ordem de exibição.
+
+    Ordenação (mantém as regras do Kanban):
+    - "Conta para Contato": data_retorno ASC (nulos por último), depois -atualizado_em
+    - Demais colunas: -atualizado_em
+
+    Args:
+        registros: QuerySet base (já filtrado por vendedor, se for o caso)
+        status_keys: Lista de status exibidos no Kanban (ex: [k for k, _ in KANBAN_STATUSES])
+        cards_por_coluna: Quantidade de cards carregados por coluna
+        contagens: Tupla opcional (kanban_counts, backlog_count) já calculada
+
+    Returns:
+        tuple: (kanban_by_status, kanban_counts, backlog_count)
+    """
+    status_keys = list(status_keys)
+
+    # 1) Contagens: uma única agregação para todas as colunas + backlog
+    if contagens is not None:
+        kanban_counts, backlog_count = contagens
+    else:
+        agregados = {
+            f'coluna_{status_key}': Count('id', filter=Q(no_kanban=True, status_pipeline=status_key))
+            for status_key in status_keys
+        }
+        agregados['backlog'] = Count('id', filter=Q(no_kanban=False))
+        totais = registros.order_by().aggregate(**agregados)
+
+        kanban_counts = {status_key: totais[f'coluna_{status_key}'] for status_key in status_keys}
+        backlog_count = totais['backlog']
+
+    # 2) Cards: top-N por coluna em uma única consulta com ROW_NUMBER()
+    # data_retorno só participa da ordenação em "Conta para Contato";
+    # nas demais colunas a expressão é NULL e a ordem cai em -atualizado_em.
+    retorno_ordem = Case(
+        When(
+            status_pipeline=StatusPipelineChoices.CONTA_PARA_CONTATO.value,
+            then=F('data_retorno'),
+        ),
+        default=None,
+    )
+    ordem_coluna = [
+        retorno_ordem.asc(nulls_last=True),
+        F('atualizado_em').desc(),
+        F('id').desc(),
+    ]
+
+    kanban_by_status = {status_key: [] for status_key in status_keys}
+    if any(kanban_counts.values()):
+        cards = (
+            registros.filter(no_kanban=True, status_pipeline__in=status_keys)
+            .annotate(
+                posicao_coluna=Window(
+                    expression=RowNumber(),
+                    partition_by=[F('status_pipeline')],
+                    order_by=ordem_coluna,
+                )
+            )
+            .filter(posicao_coluna__lte=cards_por_coluna)
+            .order_by('status_pipeline', 'posicao_coluna')
+        )
+        for registro in cards:
+            kanban_by_status[registro.status_pipeline].append(registro)
+
+    return kanban_by_status, kanban_counts, backlog_count
+
+
+# ========== PAGINAÇÃO POR CURSOR (KEYSET) ==========
+
+class CursorInvalido(ValueError):
+    """Cursor malformado ou emitido para outra coluna."""
+
+
+def _ordena_por_retorno(local):
+    """"Conta para Contato" ordena primeiro por data_retorno (como no quadro)."""
+    return local == StatusPipelineChoices.CONTA_PARA_CONTATO.value
+
+
+def codificar_cursor(local, chave, registro_id, data_retorno=None):
+    """
+    Gera um cursor opaco (base64 URL-safe) a partir da chave do último card.
+
+    Args:
+        local: 'backlog' ou status_key da coluna
+        chave: Valor de ordenação do último card (datetime)
+        registro_id: UUID do último card (desempate)
+        data_retorno: data_retorno do último card ("Conta para Contato")
+    """
+    payload = {'l': local, 'k': chave.isoformat(), 'id': str(registro_id)}
+    if data_retorno is not None:
+        payload['r'] = data_retorno.isoformat()
+    payload = json.dumps(payload, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor, local):
+    """
+    Decodifica um cursor gerado por codificar_cursor.
+
+    Returns:
+        tuple: (chave: datetime, registro_id: uuid.UUID, data_retorno: datetime ou None)
+
+    Raises:
+        CursorInvalido: Se o cursor estiver malformado ou pertencer a outra coluna
+    """
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        chave = datetime.fromisoformat(payload['k'])
+        registro_id = uuid.UUID(payload['id'])
+        data_retorno = datetime.fromisoformat(payload['r']) if payload.get('r') else None
+    except (ValueError, KeyError, TypeError) as e:
+        raise CursorInvalido(f'Cursor inválido: {e}')
+
+    if payload.get('l') != local:
+        raise CursorInvalido('Cursor pertence a outra coluna')
+
+    return chave, registro_id, data_retorno
+
+
+def anotar_chave_cursor(registros, local):
+    """
+    Anota `chave_cursor` e aplica a ordenação estável usada pelo cursor.
+
+    A mesma ordem do quadro (kanban_view / carregar_quadro_kanban), para que
+    o cursor do último card desenhado continue exatamente de onde a página
+    inicial parou:
+    - Backlog: (criado_em, id) DESC
+    - "Conta para Contato": data_retorno ASC (nulos por último), depois (atualizado_em, id) DESC
+    - Demais colunas: (atualizado_em, id) DESC
+    """
+    if local == 'backlog':
+        registros = registros.annotate(chave_cursor=F('criado_em'))
+    else:
+        registros = registros.annotate(chave_cursor=F('atualizado_em'))
+
+    ordem = [F('chave_cursor').desc(), F('id').desc()]
+    if _ordena_por_retorno(local):
+        ordem.insert(0, F('data_retorno').asc(nulls_last=True))
+    return registros.order_by(*ordem)
+
+
+def _filtro_apos_cursor(local, chave, registro_id, data_retorno):
+    """WHERE dos cards que vêm depois do cursor na ordem de anotar_chave_cursor."""
+    depois = Q(chave_cursor__lt=chave) | Q(chave_cursor=chave, id__lt=registro_id)
+    if not _ordena_por_retorno(local):
+        return depois
+    if data_retorno is None:
+        # Cursor já está no trecho sem retorno (último da ordenação)
+        return Q(data_retorno__isnull=True) & depois
+    return (
+        Q(data_retorno__gt=data_retorno)
+        | Q(data_retorno__isnull=True)
+        | (Q(data_retorno=data_retorno) & depois)
+    )
+
+
+def pagina_por_cursor(registros, local, cursor=None, limite=8):
+    """
+    Retorna a próxima página de cards após o cursor (paginação keyset).
+
+    Não usa OFFSET nem COUNT: a consulta busca `limite + 1` linhas com
+    WHERE (chave, id) < (chave_cursor, id_cursor). Como a posição é dada pela
+    chave do último card e não pelo índice, cards que saem ou entram na
+    coluna durante a rolagem não causam duplicados nem saltos.
+
+    Args:
+        registros: QuerySet já filtrado (vendedor + coluna)
+        local: 'backlog' ou status_key da coluna
+        cursor: Cursor recebido do cliente (None/'' = primeira página)
+        limite: Cards por página
+
+    Returns:
+        tuple: (lista de registros, next_cursor ou None)
+
+    Raises:
+        CursorInvalido: Se o cursor for inválido
+    """
+    registros = anotar_chave_cursor(registros, local)
+
+    if cursor:
+        registros = registros.filter(_filtro_apos_cursor(local, *decodificar_cursor(cursor, local)))
+
+    pagina = list(registros[:limite + 1])
+    tem_mais = len(pagina) > limite
+    pagina = pagina[:limite]
+
+    next_cursor = cursor_apos(local, pagina[-1]) if tem_mais else None
+    return pagina, next_cursor
+
+
+def cursor_apos(local, registro):
+    """Cursor que aponta para depois de `registro` (usado na renderização inicial)."""
+    chave = registro.criado_em if local == 'backlog' else registro.atualizado_em
+    data_retorno = registro.data_retorno if _ordena_por_retorno(local) else None
+    return codificar_cursor(local, chave, registro.id, data_retorno)
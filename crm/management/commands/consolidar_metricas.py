@@ -0,0 +1,57 @@
+"""
+Comando Django para consolidar as métricas diárias (MetricaDiaria).
+Uso:
+    python manage.py consolidar_metricas                     # dias fechados pendentes
+    python manage.py consolidar_metricas --desde 2025-01-01  # reprocessa a partir da data
+    python manage.py consolidar_metricas --reconstruir       # reprocessa todo o histórico
+
+Incremental: continua a partir do último dia consolidado. Agende uma vez
+por dia (ex: cron logo após a meia-noite); o dia corrente é sempre lido ao vivo.
+"""
+
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from crm.metricas import NOME_CHECKPOINT, consolidar_pendentes, obter_consolidado_ate
+from crm.models import ControleConsolidacao, MetricaDiaria
+
+
+class Command(BaseCommand):
+    help = 'Consolida as métricas diárias dos dias fechados (incremental)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--desde',
+            help='Reprocessa a partir desta data (AAAA-MM-DD)',
+        )
+        parser.add_argument(
+            '--reconstruir',
+            action='store_true',
+            help='Apaga as métricas consolidadas e reprocessa todo o histórico',
+        )
+
+    def handle(self, *args, **options):
+        desde = None
+        if options.get('desde'):
+            try:
+                desde = date.fromisoformat(options['desde'])
+            except ValueError:
+                raise CommandError("Data inválida em --desde. Use o formato AAAA-MM-DD.")
+
+        if options.get('reconstruir'):
+            self.stdout.write("🗑️  Removendo métricas consolidadas...")
+            MetricaDiaria.objects.all().delete()
+            ControleConsolidacao.objects.filter(nome=NOME_CHECKPOINT).delete()
+
+        self.stdout.write(f"📊 Consolidado até: {obter_consolidado_ate() or 'nunca'}")
+
+        dias, linhas = consolidar_pendentes(desde=desde)
+
+        if not dias:
+            self.stdout.write(self.style.SUCCESS("✅ Nenhum dia pendente de consolidação."))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {dias} dia(s) consolidado(s), {linhas} linha(s) gravada(s). "
+            f"Consolidado até: {obter_consolidado_ate()}"
+        ))
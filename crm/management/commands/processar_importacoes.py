@@ -0,0 +1,85 @@
+"""
+Comando Django para processar importações de planilha pendentes (ImportacaoJob).
+Uso:
+    python manage.py processar_importacoes              # processa os pendentes e sai
+    python manage.py processar_importacoes --continuo   # fica aguardando novos jobs
+
+Necessário quando IMPORTACAO_EXECUTOR='comando'; com o executor 'thread'
+pode ser usado para reprocessar jobs que ficaram pendentes (ex: reinício do servidor).
+
+Ao iniciar, jobs 'processando' sem progresso há mais de
+IMPORTACAO_TEMPO_LIMITE_MINUTOS (worker interrompido) voltam à fila ou, esgotadas
+as tentativas, são marcados como erro (ver recuperar_jobs_travados).
+"""
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from crm.importacao_jobs import proximo_job_pendente, processar_job, recuperar_jobs_travados
+from crm.models import ImportacaoJob
+
+
+class Command(BaseCommand):
+    help = 'Processa as importações de planilha pendentes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--continuo',
+            action='store_true',
+            help='Continua em execução aguardando novos jobs',
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=2.0,
+            help='Segundos entre verificações no modo contínuo (padrão: 2)',
+        )
+        parser.add_argument(
+            '--tempo-limite',
+            type=int,
+            default=None,
+            help='Minutos sem progresso para considerar um job travado '
+                 '(padrão: IMPORTACAO_TEMPO_LIMITE_MINUTOS)',
+        )
+
+    def handle(self, *args, **options):
+        continuo = options.get('continuo', False)
+        intervalo = options['intervalo']
+
+        tempo_limite = options.get('tempo_limite')
+        reenfileirados, com_erro = recuperar_jobs_travados(
+            timedelta(minutes=tempo_limite) if tempo_limite is not None else None
+        )
+        if reenfileirados or com_erro:
+            self.stdout.write(self.style.WARNING(
+                f"⚠️  Importações travadas: {reenfileirados} devolvida(s) à fila, "
+                f"{com_erro} marcada(s) como erro"
+            ))
+
+        self.stdout.write("📥 Procurando importações pendentes...")
+        processados = 0
+
+        while True:
+            job_id = proximo_job_pendente()
+            if job_id is None:
+                if not continuo:
+                    break
+                time.sleep(intervalo)
+                continue
+
+            processar_job(job_id, reservado=True)
+            processados += 1
+
+            job = ImportacaoJob.objects.get(id=job_id)
+            if job.status == 'concluido':
+                self.stdout.write(self.style.SUCCESS(
+                    f"   ✓ {job.nome_arquivo}: {job.importados} importado(s), "
+                    f"{job.total_erros} erro(s)"
+                ))
+            else:
+                self.stdout.write(self.style.ERROR(
+                    f"   ✗ {job.nome_arquivo}: {job.mensagem_erro}"
+                ))
+
+        self.stdout.write(self.style.SUCCESS(f"✅ {processados} importação(ões) processada(s)."))
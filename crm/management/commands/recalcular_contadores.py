@@ -0,0 +1,44 @@
+"""
+Comando Django para reconstruir e verificar os contadores do pipeline.
+Uso:
+    python manage.py recalcular_contadores              # reconstrói e verifica
+    python manage.py recalcular_contadores --verificar  # apenas verifica
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from crm.contadores import reconstruir_contadores, divergencias_contadores
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói os contadores do pipeline (ContadorPipeline) e verifica contra os registros'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Apenas verifica divergências, sem reconstruir',
+        )
+
+    def handle(self, *args, **options):
+        if not options.get('verificar'):
+            self.stdout.write("🔄 Reconstruindo contadores a partir dos registros...")
+            reconstruir_contadores()
+            self.stdout.write(self.style.SUCCESS("   ✓ Contadores reconstruídos"))
+
+        self.stdout.write("🔍 Verificando contadores...")
+        divergencias = divergencias_contadores()
+
+        if not divergencias:
+            self.stdout.write(self.style.SUCCESS("✅ Contadores consistentes com os registros."))
+            return
+
+        for (vendedor_id, status_pipeline, no_kanban, origem), contador, real in divergencias:
+            self.stdout.write(self.style.ERROR(
+                f"   ✗ vendedor={vendedor_id} status={status_pipeline} "
+                f"no_kanban={no_kanban} origem={origem}: contador={contador}, real={real}"
+            ))
+
+        raise CommandError(
+            f"{len(divergencias)} divergência(s) encontrada(s). "
+            "Execute sem --verificar para reconstruir."
+        )
@@ -0,0 +1,28 @@
+"""
+Comando Django para reconstruir o índice de busca de leads.
+Uso:
+    python manage.py reconstruir_busca
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from crm.busca import criar_indice, recalcular_textos, remover_indice
+
+
+class Command(BaseCommand):
+    help = 'Recalcula o texto de busca dos registros e recria o índice de busca (FTS5/pg_trgm)'
+
+    def handle(self, *args, **options):
+        self.stdout.write("🔄 Recalculando texto de busca dos registros...")
+        alterados = recalcular_textos()
+        self.stdout.write(self.style.SUCCESS(f"   ✓ {alterados} registro(s) atualizado(s)"))
+
+        self.stdout.write(f"🔍 Recriando índice de busca ({connection.vendor})...")
+        with connection.schema_editor() as schema_editor:
+            remover_indice(schema_editor)
+            criado = criar_indice(schema_editor)
+        if criado:
+            self.stdout.write(self.style.SUCCESS("✅ Índice de busca reconstruído."))
+        else:
+            self.stdout.write(self.style.WARNING("⚠️  Banco sem suporte a índice de busca (FTS5 trigram/pg_trgm): a busca usará LIKE."))
@@ -0,0 +1,218 @@
+"""
+Consolidação diária das métricas (MetricaDiaria) e leitura do painel.
+
+O painel de métricas conta os registros cujo atualizado_em cai no período,
+agrupados pelos atributos atuais. Dias fechados ficam consolidados em
+MetricaDiaria (comando consolidar_metricas, incremental a partir do
+checkpoint em ControleConsolidacao); dias ainda não consolidados, incluindo
+hoje, são consultados ao vivo com filtro por intervalo (atualizado_em >= início
+do dia), que aproveita os índices ao contrário de atualizado_em__date.
+
+Quando um registro de um dia já consolidado é alterado, seu atualizado_em
+passa para hoje: os signals descontam a linha antiga (descontar_consolidados)
+e o registro volta a ser contado ao vivo.
+"""
+
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Greatest, TruncDate
+from django.utils import timezone
+
+from .models import ControleConsolidacao, MetricaDiaria, RegistroComercial
+
+
+NOME_CHECKPOINT = 'metrica_diaria'
+
+CAMPOS_METRICA = ('vendedor_id', 'status_pipeline', 'origem', 'uf', 'cidade', 'no_kanban')
+CAMPOS_AGRUPAMENTO = ('status_pipeline', 'origem', 'uf', 'cidade', 'no_kanban')
+
+# Dias consolidados por transação
+DIAS_POR_TRANSACAO = 31
+
+
+def inicio_do_dia(data):
+    """Início do dia no fuso horário atual (aware)."""
+    return timezone.make_aware(datetime.combine(data, time.min))
+
+
+# ========== MANUTENÇÃO (SIGNALS / OPERAÇÕES EM LOTE) ==========
+
+def chave_metrica(registro):
+    """
+    Chave de MetricaDiaria do registro como carregado do banco.
+
+    Returns:
+        tuple | None: (atualizado_em, vendedor_id, status_pipeline, origem, uf,
+        cidade, no_kanban), ou None se algum campo não foi carregado.
+        A data é calculada só em descontar_consolidados().
+    """
+    valores = registro.__dict__
+    if valores.get('atualizado_em') is None:
+        return None
+    if any(campo not in valores for campo in CAMPOS_METRICA):
+        return None
+    return (valores['atualizado_em'],) + tuple(valores[campo] for campo in CAMPOS_METRICA)
+
+
+def descontar_consolidados(chaves):
+    """
+    Remove registros alterados/excluídos das linhas de dias já consolidados.
+
+    Args:
+        chaves: Iterável de chave_metrica() com os valores de antes da alteração
+    """
+    hoje = timezone.localdate()
+    deltas = Counter()
+    for chave in chaves:
+        if chave is None:
+            continue
+        data = timezone.localdate(chave[0])
+        # Hoje nunca está consolidado
+        if data < hoje:
+            deltas[(data,) + chave[1:]] += 1
+
+    for (data, vendedor_id, status_pipeline, origem, uf, cidade, no_kanban), delta in deltas.items():
+        MetricaDiaria.objects.filter(
+            data=data,
+            vendedor_id=vendedor_id,
+            status_pipeline=status_pipeline,
+            origem=origem,
+            uf=uf,
+            cidade=cidade,
+            no_kanban=no_kanban,
+            total__gt=0,
+        ).update(total=Greatest(F('total') - delta, 0))  # linha já divergente não fica negativa
+
+
+# ========== CONSOLIDAÇÃO ==========
+
+def obter_consolidado_ate():
+    """Último dia consolidado (None se nunca consolidado)."""
+    return (
+        ControleConsolidacao.objects.filter(nome=NOME_CHECKPOINT)
+        .values_list('consolidado_ate', flat=True)
+        .first()
+    )
+
+
+def consolidar_intervalo(data_inicio, data_fim):
+    """
+    Recalcula MetricaDiaria para os dias [data_inicio, data_fim] em uma consulta agrupada.
+
+    Returns:
+        int: Linhas de MetricaDiaria gravadas
+    """
+    linhas = (
+        RegistroComercial.objects
+        .filter(
+            atualizado_em__gte=inicio_do_dia(data_inicio),
+            atualizado_em__lt=inicio_do_dia(data_fim + timedelta(days=1)),
+        )
+        .annotate(dia=TruncDate('atualizado_em'))
+        .order_by()
+        .values_list('dia', *CAMPOS_METRICA)
+        .annotate(total=Count('id'))
+    )
+
+    with transaction.atomic():
+        MetricaDiaria.objects.filter(data__gte=data_inicio, data__lte=data_fim).delete()
+        criadas = MetricaDiaria.objects.bulk_create(
+            [
+                MetricaDiaria(
+                    data=dia,
+                    vendedor_id=vendedor_id,
+                    status_pipeline=status_pipeline,
+                    origem=origem,
+                    uf=uf,
+                    cidade=cidade,
+                    no_kanban=no_kanban,
+                    total=total,
+                )
+                for dia, vendedor_id, status_pipeline, origem, uf, cidade, no_kanban, total in linhas
+            ],
+            batch_size=1000,
+        )
+    return len(criadas)
+
+
+def consolidar_pendentes(ate=None, desde=None):
+    """
+    Consolida os dias fechados ainda não processados e avança o checkpoint.
+
+    Args:
+        ate: Último dia a consolidar (padrão: ontem; nunca inclui hoje)
+        desde: Reprocessa a partir desta data, ignorando o checkpoint
+
+    Returns:
+        tuple: (dias consolidados, linhas gravadas)
+    """
+    ontem = timezone.localdate() - timedelta(days=1)
+    ate = min(ate or ontem, ontem)
+
+    controle, _ = ControleConsolidacao.objects.get_or_create(nome=NOME_CHECKPOINT)
+
+    if desde is None:
+        if controle.consolidado_ate:
+            desde = controle.consolidado_ate + timedelta(days=1)
+        else:
+            primeiro = RegistroComercial.objects.order_by('atualizado_em').values_list('atualizado_em', flat=True).first()
+            if primeiro is None:
+                return 0, 0
+            desde = timezone.localdate(primeiro)
+
+    dias = 0
+    linhas = 0
+    inicio = desde
+    while inicio <= ate:
+        fim = min(inicio + timedelta(days=DIAS_POR_TRANSACAO - 1), ate)
+        with transaction.atomic():
+            linhas += consolidar_intervalo(inicio, fim)
+            if controle.consolidado_ate is None or fim > controle.consolidado_ate:
+                controle.consolidado_ate = fim
+                controle.save(update_fields=['consolidado_ate', 'atualizado_em'])
+        dias += (fim - inicio).days + 1
+        inicio = fim + timedelta(days=1)
+
+    return dias, linhas
+
+
+# ========== LEITURA PARA O PAINEL ==========
+
+def contagens_periodo(data_inicio, vendedor_id=None):
+    """
+    Contagens agrupadas dos registros atualizados a partir de data_inicio.
+
+    Dias consolidados vêm de MetricaDiaria; o restante (sempre inclui hoje)
+    é consultado ao vivo.
+
+    Returns:
+        Counter: {(status_pipeline, origem, uf, cidade, no_kanban): total}
+    """
+    contagens = Counter()
+    inicio_ao_vivo = data_inicio
+
+    consolidado_ate = obter_consolidado_ate()
+    if consolidado_ate and consolidado_ate >= data_inicio:
+        consolidadas = MetricaDiaria.objects.filter(
+            data__gte=data_inicio,
+            data__lte=consolidado_ate,
+            total__gt=0,
+        )
+        if vendedor_id:
+            consolidadas = consolidadas.filter(vendedor_id=vendedor_id)
+        for *chave, total in (
+            consolidadas.order_by().values_list(*CAMPOS_AGRUPAMENTO).annotate(soma=Sum('total'))
+        ):
+            contagens[tuple(chave)] += total
+        inicio_ao_vivo = consolidado_ate + timedelta(days=1)
+
+    ao_vivo = RegistroComercial.objects.filter(atualizado_em__gte=inicio_do_dia(inicio_ao_vivo))
+    if vendedor_id:
+        ao_vivo = ao_vivo.filter(vendedor_id=vendedor_id)
+    for *chave, total in ao_vivo.order_by().values_list(*CAMPOS_AGRUPAMENTO).annotate(n=Count('id')):
+        contagens[tuple(chave)] += total
+
+    return contagens
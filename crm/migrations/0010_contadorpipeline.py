@@ -0,0 +1,46 @@
+# Generated by Django 6.0 on 2026-10-18 02:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def popular_contadores(apps, schema_editor):
+    Registro = apps.get_model('crm', 'RegistroComercial')
+    Contador = apps.get_model('crm', 'ContadorPipeline')
+
+    linhas = (
+        Registro.objects.order_by()
+        .values('vendedor_id', 'status_pipeline', 'no_kanban', 'origem')
+        .annotate(total=Count('id'))
+    )
+    Contador.objects.bulk_create([Contador(**linha) for linha in linhas])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0009_adicionar_proxima_coluna_funil'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorPipeline',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status_pipeline', models.CharField(choices=[('conta_para_contato', 'Conta para Contato'), ('contato_feito', 'Contato Feito'), ('negociacao_cotacao', 'Negociação / Cotação'), ('pedido_realizado', 'Pedido Realizado'), ('conta_ativa', 'Conta Ativa (Recorrência)'), ('arquivada', 'Arquivada')], max_length=30, verbose_name='Status no Pipeline')),
+                ('no_kanban', models.BooleanField(verbose_name='No Kanban')),
+                ('origem', models.CharField(choices=[('base_winthor', 'Base Winthor'), ('google', 'Google'), ('site', 'Site'), ('instagram', 'Instagram'), ('indicacao', 'Indicação'), ('prospeccao_fria', 'Prospecção Fria'), ('whatsapp_ativo', 'WhatsApp Ativo'), ('outros', 'Outros')], max_length=20, verbose_name='Origem')),
+                ('total', models.IntegerField(default=0, verbose_name='Total de registros')),
+                ('vendedor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='contadores_pipeline', to=settings.AUTH_USER_MODEL, verbose_name='Vendedor')),
+            ],
+            options={
+                'verbose_name': 'Contador do Pipeline',
+                'verbose_name_plural': 'Contadores do Pipeline',
+                'unique_together': {('vendedor', 'status_pipeline', 'no_kanban', 'origem')},
+            },
+        ),
+        migrations.RunPython(popular_contadores, migrations.RunPython.noop),
+    ]
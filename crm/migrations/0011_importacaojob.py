@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-18 12:00
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0010_contadorpipeline'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportacaoJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('arquivo', models.FileField(blank=True, upload_to='importacoes/', verbose_name='Arquivo')),
+                ('nome_arquivo', models.CharField(max_length=255, verbose_name='Nome do Arquivo')),
+                ('status_cliente', models.CharField(default='novo', max_length=20, verbose_name='Status do Cliente aplicado')),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('processando', 'Processando'), ('concluido', 'Concluído'), ('erro', 'Erro')], default='pendente', max_length=20, verbose_name='Status')),
+                ('total_linhas', models.PositiveIntegerField(blank=True, null=True, verbose_name='Total de linhas (estimado)')),
+                ('linhas_processadas', models.PositiveIntegerField(default=0, verbose_name='Linhas processadas')),
+                ('importados', models.PositiveIntegerField(default=0, verbose_name='Registros importados')),
+                ('total_erros', models.PositiveIntegerField(default=0, verbose_name='Linhas com erro')),
+                ('erros', models.JSONField(blank=True, default=list, verbose_name='Erros (primeiros)')),
+                ('mensagem_erro', models.TextField(blank=True, verbose_name='Mensagem de erro')),
+                ('criado_em', models.DateTimeField(auto_now_add=True, verbose_name='Criado em')),
+                ('iniciado_em', models.DateTimeField(blank=True, null=True, verbose_name='Iniciado em')),
+                ('finalizado_em', models.DateTimeField(blank=True, null=True, verbose_name='Finalizado em')),
+                ('vendedor', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='importacoes', to=settings.AUTH_USER_MODEL, verbose_name='Vendedor')),
+            ],
+            options={
+                'verbose_name': 'Importação',
+                'verbose_name_plural': 'Importações',
+                'ordering': ['-criado_em'],
+                'indexes': [models.Index(fields=['status', 'criado_em'], name='crm_importa_status_e4069b_idx')],
+            },
+        ),
+    ]
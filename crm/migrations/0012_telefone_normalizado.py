@@ -0,0 +1,48 @@
+# Generated by Django 6.0 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+def preencher_telefone_normalizado(apps, schema_editor):
+    Registro = apps.get_model('crm', 'RegistroComercial')
+
+    pendentes = []
+    for registro in Registro.objects.only('id', 'telefone').iterator(chunk_size=2000):
+        registro.telefone_normalizado = ''.join(c for c in (registro.telefone or '') if c.isdigit())
+        pendentes.append(registro)
+        if len(pendentes) >= 2000:
+            Registro.objects.bulk_update(pendentes, ['telefone_normalizado'])
+            pendentes = []
+    if pendentes:
+        Registro.objects.bulk_update(pendentes, ['telefone_normalizado'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0011_importacaojob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importacaojob',
+            name='atualizados',
+            field=models.PositiveIntegerField(default=0, verbose_name='Registros existentes atualizados'),
+        ),
+        migrations.AddField(
+            model_name='importacaojob',
+            name='duplicados',
+            field=models.PositiveIntegerField(default=0, verbose_name='Linhas duplicadas'),
+        ),
+        migrations.AddField(
+            model_name='importacaojob',
+            name='politica_duplicados',
+            field=models.CharField(default='pular', max_length=20, verbose_name='Política para duplicados'),
+        ),
+        migrations.AddField(
+            model_name='registrocomercial',
+            name='telefone_normalizado',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='Preenchido automaticamente a partir do telefone; usado na deduplicação', max_length=50, verbose_name='Telefone (somente dígitos)'),
+        ),
+        migrations.RunPython(preencher_telefone_normalizado, migrations.RunPython.noop),
+    ]
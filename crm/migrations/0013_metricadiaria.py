@@ -0,0 +1,49 @@
+# Generated by Django 6.0 on 2026-10-18 13:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0012_telefone_normalizado'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ControleConsolidacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=50, unique=True, verbose_name='Nome')),
+                ('consolidado_ate', models.DateField(blank=True, null=True, verbose_name='Consolidado até')),
+                ('atualizado_em', models.DateTimeField(auto_now=True, verbose_name='Atualizado em')),
+            ],
+            options={
+                'verbose_name': 'Controle de Consolidação',
+                'verbose_name_plural': 'Controles de Consolidação',
+            },
+        ),
+        migrations.CreateModel(
+            name='MetricaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(verbose_name='Data')),
+                ('status_pipeline', models.CharField(choices=[('conta_para_contato', 'Conta para Contato'), ('contato_feito', 'Contato Feito'), ('negociacao_cotacao', 'Negociação / Cotação'), ('pedido_realizado', 'Pedido Realizado'), ('conta_ativa', 'Conta Ativa (Recorrência)'), ('arquivada', 'Arquivada')], max_length=30, verbose_name='Status no Pipeline')),
+                ('origem', models.CharField(choices=[('base_winthor', 'Base Winthor'), ('google', 'Google'), ('site', 'Site'), ('instagram', 'Instagram'), ('indicacao', 'Indicação'), ('prospeccao_fria', 'Prospecção Fria'), ('whatsapp_ativo', 'WhatsApp Ativo'), ('outros', 'Outros')], max_length=20, verbose_name='Origem')),
+                ('uf', models.CharField(max_length=2, verbose_name='UF')),
+                ('cidade', models.CharField(max_length=100, verbose_name='Cidade')),
+                ('no_kanban', models.BooleanField(verbose_name='No Kanban')),
+                ('total', models.IntegerField(default=0, verbose_name='Total de registros')),
+                ('vendedor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metricas_diarias', to=settings.AUTH_USER_MODEL, verbose_name='Vendedor')),
+            ],
+            options={
+                'verbose_name': 'Métrica Diária',
+                'verbose_name_plural': 'Métricas Diárias',
+                'indexes': [models.Index(fields=['data', 'vendedor'], name='crm_metrica_data_b7c601_idx')],
+                'unique_together': {('data', 'vendedor', 'status_pipeline', 'origem', 'uf', 'cidade', 'no_kanban')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0013_metricadiaria'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='registrocomercial',
+            name='versao',
+            field=models.PositiveIntegerField(default=1, editable=False, verbose_name='Versão'),
+        ),
+    ]
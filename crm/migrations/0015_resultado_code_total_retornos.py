@@ -0,0 +1,87 @@
+# Generated by Django 6.0 on 2026-10-18 10:40
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# Cópia de crm.pipeline.rules.RESULT_LABELS nesta migração: os textos abaixo são
+# os que registrar_contato gravou até aqui, e alterações futuras nos labels
+# não devem mudar a dedução dos códigos.
+RESULT_LABELS = {
+    "contato_responsavel": "Falou com responsável (decisor ou setor de compras)",
+    "responsavel_indisponivel": "Responsável não disponível — solicitaram retorno",
+    "nao_atendeu": "Não atendeu após tentativas",
+    "numero_invalido": "Número inválido",
+    "interessado": "Interessado",
+    "avaliando": "Avaliando",
+    "sem_interesse": "Sem interesse",
+    "sem_perfil": "Sem perfil",
+    "em_negociacao": "Em negociação",
+    "aguardando_resposta": "Aguardando resposta",
+    "recusou": "Recusou",
+    "aceitou": "Aceitou proposta",
+    "finalizado": "Finalizado",
+    "arquivado_automatico": "Arquivado automaticamente (limite de retornos atingido)",
+}
+
+
+def preencher_resultado_code(apps, schema_editor):
+    """
+    Deduz o código a partir do texto salvo em resultado.
+
+    registrar_contato grava "<label>" ou "<label>\n\nObservações: ...", com
+    o próprio código quando não há label (resultados configurados no funil).
+    """
+    Historico = apps.get_model('crm', 'ContatoHistorico')
+    Registro = apps.get_model('crm', 'RegistroComercial')
+    Config = apps.get_model('crm', 'FunilResultadoConfig')
+
+    codigo_por_texto = {label: codigo for codigo, label in RESULT_LABELS.items()}
+    codigo_por_texto.update({codigo: codigo for codigo in RESULT_LABELS})
+    codigo_por_texto.update({key: key for key in Config.objects.values_list('key', flat=True)})
+
+    pendentes = []
+    for historico in Historico.objects.only('id', 'resultado').iterator(chunk_size=2000):
+        texto = (historico.resultado or '').split('\n\nObservações:', 1)[0].strip()
+        codigo = codigo_por_texto.get(texto, '')
+        # Mesmo critério da contagem antiga do auto-arquivamento (icontains)
+        if not codigo and 'responsável não disponível' in texto.lower():
+            codigo = 'responsavel_indisponivel'
+        if codigo:
+            historico.resultado_code = codigo
+            pendentes.append(historico)
+        if len(pendentes) >= 2000:
+            Historico.objects.bulk_update(pendentes, ['resultado_code'])
+            pendentes = []
+    if pendentes:
+        Historico.objects.bulk_update(pendentes, ['resultado_code'])
+
+    retornos = (
+        Historico.objects.filter(resultado_code='responsavel_indisponivel')
+        .order_by()
+        .values_list('registro_id')
+        .annotate(total=Count('id'))
+    )
+    pendentes = [Registro(id=registro_id, total_retornos=total) for registro_id, total in retornos]
+    Registro.objects.bulk_update(pendentes, ['total_retornos'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0014_registrocomercial_versao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contatohistorico',
+            name='resultado_code',
+            field=models.CharField(blank=True, default='', help_text='Chave do resultado (ex: responsavel_indisponivel)', max_length=50, verbose_name='Código do Resultado'),
+        ),
+        migrations.AddField(
+            model_name='registrocomercial',
+            name='total_retornos',
+            field=models.PositiveIntegerField(default=0, help_text="Contatos com resultado 'responsável indisponível' (auto-arquivamento)", verbose_name='Retornos solicitados'),
+        ),
+        migrations.RunPython(preencher_resultado_code, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 6.0 on 2026-10-18 11:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+SEPARADOR_OBSERVACOES = '\n\nObservações: '
+
+
+def preencher_eventos(apps, schema_editor):
+    """
+    Separa "<label>\n\nObservações: ..." em resultado/observacoes e calcula
+    duracao_desde_anterior percorrendo cada registro em ordem de data.
+    """
+    Historico = apps.get_model('crm', 'ContatoHistorico')
+
+    pendentes = []
+    registro_atual = None
+    anterior = None
+    eventos = (
+        Historico.objects.only('id', 'registro_id', 'data_contato', 'resultado')
+        .order_by('registro_id', 'data_contato')
+        .iterator(chunk_size=2000)
+    )
+    for evento in eventos:
+        if evento.registro_id != registro_atual:
+            registro_atual = evento.registro_id
+            anterior = None
+        evento.duracao_desde_anterior = evento.data_contato - anterior if anterior else None
+        anterior = evento.data_contato
+
+        if SEPARADOR_OBSERVACOES in (evento.resultado or ''):
+            evento.resultado, evento.observacoes = evento.resultado.split(SEPARADOR_OBSERVACOES, 1)
+        else:
+            evento.observacoes = ''
+
+        pendentes.append(evento)
+        if len(pendentes) >= 2000:
+            Historico.objects.bulk_update(pendentes, ['resultado', 'observacoes', 'duracao_desde_anterior'])
+            pendentes = []
+    if pendentes:
+        Historico.objects.bulk_update(pendentes, ['resultado', 'observacoes', 'duracao_desde_anterior'])
+
+
+def juntar_observacoes(apps, schema_editor):
+    """Reverso: devolve observacoes ao texto de resultado antes de a coluna ser removida."""
+    Historico = apps.get_model('crm', 'ContatoHistorico')
+
+    pendentes = []
+    eventos = (
+        Historico.objects.exclude(observacoes='')
+        .only('id', 'resultado', 'observacoes')
+        .iterator(chunk_size=2000)
+    )
+    for evento in eventos:
+        evento.resultado = f'{evento.resultado}{SEPARADOR_OBSERVACOES}{evento.observacoes}'
+        pendentes.append(evento)
+        if len(pendentes) >= 2000:
+            Historico.objects.bulk_update(pendentes, ['resultado'])
+            pendentes = []
+    if pendentes:
+        Historico.objects.bulk_update(pendentes, ['resultado'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0015_resultado_code_total_retornos'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contatohistorico',
+            name='duracao_desde_anterior',
+            field=models.DurationField(blank=True, help_text='Vazio no primeiro evento do registro', null=True, verbose_name='Tempo desde o evento anterior'),
+        ),
+        migrations.AddField(
+            model_name='contatohistorico',
+            name='observacoes',
+            field=models.TextField(blank=True, default='', verbose_name='Observações'),
+        ),
+        migrations.AddIndex(
+            model_name='contatohistorico',
+            index=models.Index(fields=['usuario', '-data_contato'], name='crm_contato_usuario_86b5f6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contatohistorico',
+            index=models.Index(fields=['status_novo', '-data_contato'], name='crm_contato_status__eb9b54_idx'),
+        ),
+        migrations.RunPython(preencher_eventos, juntar_observacoes),
+    ]
@@ -0,0 +1,105 @@
+# Generated by Django 6.0 on 2026-10-18 13:10
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+
+# Cópias do estado de crm.models/crm.busca nesta migração: alterações futuras
+# no código não devem mudar o que ela grava nem o índice que ela cria.
+CAMPOS_BUSCA = ('nome_empresa', 'cidade', 'codigo_winthor', 'telefone_normalizado')
+TABELA_FTS = 'crm_registro_busca'
+INDICE_TRGM = 'crm_registro_busca_trgm'
+
+
+def normalizar_busca(*textos):
+    texto = unicodedata.normalize('NFKD', ' '.join(str(texto) for texto in textos if texto))
+    texto = ''.join(caractere for caractere in texto if not unicodedata.combining(caractere))
+    return ' '.join(re.split(r'[\W_]+', texto.lower())).strip()
+
+
+def preencher_busca_normalizada(apps, schema_editor):
+    Registro = apps.get_model('crm', 'RegistroComercial')
+
+    pendentes = []
+    for registro in Registro.objects.only('id', *CAMPOS_BUSCA).iterator(chunk_size=2000):
+        registro.busca_normalizada = normalizar_busca(*(getattr(registro, campo) for campo in CAMPOS_BUSCA))
+        pendentes.append(registro)
+        if len(pendentes) >= 2000:
+            Registro.objects.bulk_update(pendentes, ['busca_normalizada'])
+            pendentes = []
+    if pendentes:
+        Registro.objects.bulk_update(pendentes, ['busca_normalizada'])
+
+
+def trigrama_disponivel(conexao):
+    # tokenize='trigram' exige SQLite >= 3.34 compilado com FTS5
+    if conexao.Database.sqlite_version_info < (3, 34, 0):
+        return False
+    with conexao.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def criar_indice_busca(apps, schema_editor):
+    tabela = apps.get_model('crm', 'RegistroComercial')._meta.db_table
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        if not trigrama_disponivel(schema_editor.connection):
+            # Sem índice: crm.busca usa LIKE sobre busca_normalizada
+            return
+        schema_editor.execute(
+            f"""CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA_FTS} USING fts5(
+                busca_normalizada, content='{tabela}', content_rowid='rowid', tokenize='trigram'
+            )"""
+        )
+        schema_editor.execute(
+            f"""CREATE TRIGGER IF NOT EXISTS {TABELA_FTS}_ai AFTER INSERT ON {tabela} BEGIN
+                INSERT INTO {TABELA_FTS}(rowid, busca_normalizada) VALUES (new.rowid, new.busca_normalizada);
+            END"""
+        )
+        schema_editor.execute(
+            f"""CREATE TRIGGER IF NOT EXISTS {TABELA_FTS}_ad AFTER DELETE ON {tabela} BEGIN
+                INSERT INTO {TABELA_FTS}({TABELA_FTS}, rowid, busca_normalizada) VALUES ('delete', old.rowid, old.busca_normalizada);
+            END"""
+        )
+        schema_editor.execute(
+            f"""CREATE TRIGGER IF NOT EXISTS {TABELA_FTS}_au AFTER UPDATE OF busca_normalizada ON {tabela} BEGIN
+                INSERT INTO {TABELA_FTS}({TABELA_FTS}, rowid, busca_normalizada) VALUES ('delete', old.rowid, old.busca_normalizada);
+                INSERT INTO {TABELA_FTS}(rowid, busca_normalizada) VALUES (new.rowid, new.busca_normalizada);
+            END"""
+        )
+        schema_editor.execute(f"INSERT INTO {TABELA_FTS}({TABELA_FTS}) VALUES ('rebuild')")
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {INDICE_TRGM} ON {tabela} USING gin (busca_normalizada gin_trgm_ops)'
+        )
+
+
+def remover_indice_busca(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for sufixo in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {TABELA_FTS}_{sufixo}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {TABELA_FTS}')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INDICE_TRGM}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0016_contatohistorico_eventos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='registrocomercial',
+            name='busca_normalizada',
+            field=models.TextField(blank=True, default='', editable=False, help_text='Nome, cidade, código Winthor e telefone normalizados; usado na busca de leads', verbose_name='Texto de busca'),
+        ),
+        migrations.RunPython(preencher_busca_normalizada, migrations.RunPython.noop),
+        migrations.RunPython(criar_indice_busca, remover_indice_busca),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0017_registrocomercial_busca_normalizada'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importacaojob',
+            name='atualizado_em',
+            field=models.DateTimeField(blank=True, help_text='Gravado na reserva e a cada lote; sem avanço por muito tempo, o worker parou', null=True, verbose_name='Último progresso em'),
+        ),
+        migrations.AddField(
+            model_name='importacaojob',
+            name='tentativas',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Tentativas de processamento'),
+        ),
+    ]
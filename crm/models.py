@@ -1,3 +1,5 @@
+import re
+import unicodedata
 import uuid
 from django.db import models
 from django.contrib.auth.models import User
@@ -37,7 +39,202 @@ class CanalContatoChoices(models.TextChoices):
     OUTROS = 'outros', 'Outros'
 
 
-class RegistroComercial(models.Model):
+def normalizar_telefone(telefone):
+    """Mantém apenas os dígitos do telefone (chave de deduplicação)."""
+    if not telefone:
+        return ''
+    return ''.join(caractere for caractere in str(telefone) if caractere.isdigit())
+
+
+# Campos que compõem RegistroComercial.busca_normalizada (ver crm/busca.py)
+CAMPOS_BUSCA = ('nome_empresa', 'cidade', 'codigo_winthor', 'telefone_normalizado')
+
+
+def normalizar_busca(*textos):
+    """
+    Texto de busca: minúsculas, sem acentos, só letras/dígitos separados por um espaço.
+
+    >>> normalizar_busca('Padaria São João', '(11) 9876-5432')
+    'padaria sao joao 11 9876 5432'
+    """
+    texto = unicodedata.normalize('NFKD', ' '.join(str(texto) for texto in textos if texto))
+    texto = ''.join(caractere for caractere in texto if not unicodedata.combining(caractere))
+    return ' '.join(re.split(r'[\W_]+', texto.lower())).strip()
+
+
+class ConflitoVersao(Exception):
+    """O registro foi alterado por outro usuário depois de ser carregado."""
+
+
+class RastreamentoAlteracoesMixin(models.Model):
+    """
+    save() grava apenas os campos alterados desde o carregamento.
+
+    Em instâncias carregadas do banco, save() sem update_fields vira
+    save(update_fields=[campos alterados + campos auto_now]). Instâncias
+    novas e save(force_insert=True) seguem o comportamento padrão.
+
+    Se o model tiver o campo 'versao', todo UPDATE incrementa a versão e só é
+    aplicado se a versão no banco ainda for a carregada (ou a informada em
+    esperar_versao()); caso contrário levanta ConflitoVersao e nada é gravado.
+    """
+    CAMPO_VERSAO = 'versao'
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._marcar_como_salvo()
+        return instancia
+
+    def refresh_from_db(self, using=None, fields=None, *args, **kwargs):
+        super().refresh_from_db(using, fields, *args, **kwargs)
+        if fields is None or getattr(self, '_valores_salvos', None) is None:
+            self._marcar_como_salvo()
+            return
+        # Carga de campo adiado: o valor lido passa a ser o valor salvo
+        for nome in fields:
+            attname = self._meta.get_field(nome).attname
+            if attname in self.__dict__:
+                self._valores_salvos[attname] = self.__dict__[attname]
+
+    def _marcar_como_salvo(self):
+        # Campos adiados (only()/defer()) ficam de fora
+        valores = self.__dict__
+        self._valores_salvos = {
+            campo.attname: valores[campo.attname]
+            for campo in self._meta.concrete_fields
+            if campo.attname in valores
+        }
+
+    def campos_alterados(self):
+        """
+        Nomes dos campos alterados desde o carregamento/último save.
+
+        Returns:
+            set | None: None se a instância não veio do banco
+        """
+        salvos = getattr(self, '_valores_salvos', None)
+        if salvos is None:
+            return None
+        valores = self.__dict__
+        return {
+            campo.name
+            for campo in self._meta.concrete_fields
+            if not campo.primary_key
+            and campo.attname in valores
+            and (campo.attname not in salvos or salvos[campo.attname] != valores[campo.attname])
+        }
+
+    def esperar_versao(self, versao):
+        """
+        Exige que o próximo save() encontre esta versão no banco.
+
+        Usado com a versão enviada pelo formulário/Kanban: detecta edições
+        feitas por outro usuário desde que a tela foi aberta, no próprio UPDATE.
+        Valores vazios ou inválidos são ignorados.
+        """
+        try:
+            versao = int(versao)
+        except (TypeError, ValueError):
+            return
+        if getattr(self, '_valores_salvos', None) is not None:
+            self._valores_salvos[self.CAMPO_VERSAO] = versao
+
+    def verificar_versao(self, versao):
+        """
+        Levanta ConflitoVersao se a versão informada não é a carregada.
+
+        Para ações que validam antes de gravar (ou não gravam): o conflito é
+        informado mesmo sem UPDATE. Valores vazios ou inválidos são ignorados.
+        """
+        try:
+            versao = int(versao)
+        except (TypeError, ValueError):
+            return
+        if versao != getattr(self, self.CAMPO_VERSAO):
+            raise self._conflito_versao()
+
+    def _conflito_versao(self):
+        return ConflitoVersao(
+            f"{self._meta.verbose_name} foi alterado por outro usuário. Recarregue e tente novamente."
+        )
+
+    def save(self, *args, **kwargs):
+        salvos = getattr(self, '_valores_salvos', None)
+        atualizacao = salvos is not None and not self._state.adding and not kwargs.get('force_insert') and not args
+
+        if atualizacao and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = self.campos_alterados() | {
+                campo.name
+                for campo in self._meta.concrete_fields
+                if getattr(campo, 'auto_now', False)
+            }
+
+        versao_esperada = None
+        if atualizacao and salvos.get(self.CAMPO_VERSAO) is not None:
+            versao_esperada = salvos[self.CAMPO_VERSAO]
+            setattr(self, self.CAMPO_VERSAO, versao_esperada + 1)
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {self.CAMPO_VERSAO}
+
+        self._versao_esperada = versao_esperada
+        try:
+            super().save(*args, **kwargs)
+        except ConflitoVersao:
+            setattr(self, self.CAMPO_VERSAO, versao_esperada)
+            raise
+        finally:
+            self._versao_esperada = None
+        self._marcar_como_salvo()
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update, *args, **kwargs):
+        versao_esperada = getattr(self, '_versao_esperada', None)
+        if versao_esperada is not None:
+            base_qs = base_qs.filter(**{self.CAMPO_VERSAO: versao_esperada})
+        atualizado = super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update, *args, **kwargs)
+        if versao_esperada is not None and not atualizado:
+            raise self._conflito_versao()
+        return atualizado
+
+
+# Campos lidos pelos cards (_card.html, partials/registro_cards.html, backlog,
+# arquivados, contas ativas), pela ordenação/cursor das colunas e pelas chaves
+# de contadores/métricas guardadas no post_init
+CAMPOS_CARD = (
+    'id',
+    'nome_empresa',
+    'telefone',
+    'cidade',
+    'uf',
+    'origem',
+    'canal_contato',
+    'status_pipeline',
+    'no_kanban',
+    'ultimo_contato',
+    'resultado_ultimo_contato',
+    'data_retorno',
+    'criado_em',
+    'atualizado_em',
+    'versao',
+    'vendedor',
+)
+
+CAMPOS_VENDEDOR_CARD = ('vendedor__first_name', 'vendedor__last_name', 'vendedor__username')
+
+
+class RegistroComercialQuerySet(models.QuerySet):
+
+    def para_cards(self):
+        """
+        Projeção para listas e quadros: só os campos de CAMPOS_CARD, com o
+        vendedor no mesmo SELECT (sem uma consulta de usuário por card).
+        """
+        return self.select_related('vendedor').only(*CAMPOS_CARD, *CAMPOS_VENDEDOR_CARD)
+
+
+class RegistroComercial(RastreamentoAlteracoesMixin, models.Model):
     """
     Model principal do Mini-CRM.
     Representa leads e clientes em potencial.
@@ -60,6 +257,21 @@ class RegistroComercial(models.Model):
         max_length=50,
         verbose_name="Telefone"
     )
+    telefone_normalizado = models.CharField(
+        max_length=50,
+        blank=True,
+        db_index=True,
+        editable=False,
+        verbose_name="Telefone (somente dígitos)",
+        help_text="Preenchido automaticamente a partir do telefone; usado na deduplicação"
+    )
+    busca_normalizada = models.TextField(
+        blank=True,
+        default='',
+        editable=False,
+        verbose_name="Texto de busca",
+        help_text="Nome, cidade, código Winthor e telefone normalizados; usado na busca de leads"
+    )
     cidade = models.CharField(
         max_length=100,
         verbose_name="Cidade"
@@ -133,6 +345,11 @@ class RegistroComercial(models.Model):
         verbose_name="Data de Retorno",
         help_text="Data agendada para próximo contato (follow-up)"
     )
+    total_retornos = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Retornos solicitados",
+        help_text="Contatos com resultado 'responsável indisponível' (auto-arquivamento)"
+    )
     
     # Conversão
     data_conversao_cliente = models.DateTimeField(
@@ -159,6 +376,15 @@ class RegistroComercial(models.Model):
         help_text="Indica se o registro está ativo no Kanban"
     )
     
+    # Controle de concorrência otimista (ver RastreamentoAlteracoesMixin)
+    versao = models.PositiveIntegerField(
+        default=1,
+        editable=False,
+        verbose_name="Versão"
+    )
+
+    objects = RegistroComercialQuerySet.as_manager()
+    
     class Meta:
         verbose_name = "Registro Comercial"
         verbose_name_plural = "Registros Comerciais"
@@ -175,6 +401,19 @@ class RegistroComercial(models.Model):
     def __str__(self):
         return f"{self.nome_empresa} - {self.get_status_pipeline_display()}"
     
+    def atualizar_busca(self):
+        """Recalcula busca_normalizada (ignorado se algum campo não foi carregado)."""
+        valores = self.__dict__
+        if all(campo in valores for campo in CAMPOS_BUSCA):
+            self.busca_normalizada = normalizar_busca(*(valores[campo] for campo in CAMPOS_BUSCA))
+    
+    def save(self, *args, **kwargs):
+        # Ignora quando o telefone não foi carregado (only()/defer())
+        if 'telefone' in self.__dict__:
+            self.telefone_normalizado = normalizar_telefone(self.telefone)
+        self.atualizar_busca()
+        super().save(*args, **kwargs)
+    
     def registrar_contato(self, resultado, novo_status=None):
         """
         Registra um novo contato.
@@ -202,10 +441,52 @@ class RegistroComercial(models.Model):
         self.save()
 
 
+class ContatoHistoricoManager(models.Manager):
+    """Criação de eventos do histórico com a duração desde o evento anterior."""
+
+    def ultimos_eventos(self, registro_ids):
+        """data_contato do último evento de cada registro (uma consulta)."""
+        return dict(
+            self.filter(registro_id__in=registro_ids)
+            .order_by()
+            .values_list('registro_id')
+            .annotate(ultimo=models.Max('data_contato'))
+        )
+
+    def preencher_duracao(self, eventos):
+        """
+        Preenche duracao_desde_anterior de eventos ainda não gravados.
+
+        Os eventos de um mesmo registro são encadeados entre si, na ordem
+        de data_contato.
+        """
+        ultimos = self.ultimos_eventos({evento.registro_id for evento in eventos})
+        for evento in sorted(eventos, key=lambda evento: evento.data_contato):
+            anterior = ultimos.get(evento.registro_id)
+            evento.duracao_desde_anterior = evento.data_contato - anterior if anterior else None
+            ultimos[evento.registro_id] = evento.data_contato
+        return eventos
+
+    def registrar(self, **campos):
+        """create() preenchendo duracao_desde_anterior."""
+        evento = self.model(**campos)
+        self.preencher_duracao([evento])
+        evento.save(force_insert=True)
+        return evento
+
+    def registrar_lote(self, eventos, batch_size=500):
+        """bulk_create() preenchendo duracao_desde_anterior."""
+        return self.bulk_create(self.preencher_duracao(list(eventos)), batch_size=batch_size)
+
+
 class ContatoHistorico(models.Model):
     """
     Histórico de todos os contatos realizados.
     Mantém auditoria completa da interação comercial.
+
+    Cada linha é um evento: resultado_code/resultado (label), observacoes,
+    estágio de origem e destino (status_anterior → status_novo) e o tempo
+    desde o evento anterior do mesmo registro (tempo no estágio).
     """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     
@@ -226,6 +507,20 @@ class ContatoHistorico(models.Model):
         help_text="Descrição do resultado do contato"
     )
     
+    resultado_code = models.CharField(
+        max_length=50,
+        blank=True,
+        default='',
+        verbose_name="Código do Resultado",
+        help_text="Chave do resultado (ex: responsavel_indisponivel)"
+    )
+    
+    observacoes = models.TextField(
+        blank=True,
+        default='',
+        verbose_name="Observações"
+    )
+    
     status_anterior = models.CharField(
         max_length=30,
         choices=StatusPipelineChoices.choices,
@@ -259,18 +554,291 @@ class ContatoHistorico(models.Model):
         verbose_name="Usuário"
     )
     
+    duracao_desde_anterior = models.DurationField(
+        null=True,
+        blank=True,
+        verbose_name="Tempo desde o evento anterior",
+        help_text="Vazio no primeiro evento do registro"
+    )
+    
+    objects = ContatoHistoricoManager()
+    
     class Meta:
         verbose_name = "Histórico de Contato"
         verbose_name_plural = "Históricos de Contatos"
         ordering = ['-data_contato']
         indexes = [
+            # Linha do tempo do registro / tempo no estágio
             models.Index(fields=['registro', '-data_contato']),
+            # Atividade por vendedor
             models.Index(fields=['usuario', '-data_contato']),
-            models.Index(fields=['status_novo']),
+            # Funil de transições por período
+            models.Index(fields=['status_novo', '-data_contato']),
         ]
+    
+    def __str__(self):
+        return f"{self.registro.nome_empresa} - {self.data_contato.strftime('%d/%m/%Y %H:%M')}"
+
+
+class ContadorPipeline(models.Model):
+    """
+    Contadores desnormalizados de registros comerciais.
+    Uma linha por (vendedor, status_pipeline, no_kanban, origem), mantida
+    em sincronia pelos signals de RegistroComercial (ver crm/contadores.py).
+    Dashboards leem O(status) linhas em vez de varrer os leads.
+    """
+    vendedor = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='contadores_pipeline',
+        verbose_name="Vendedor"
+    )
+    
+    status_pipeline = models.CharField(
+        max_length=30,
+        choices=StatusPipelineChoices.choices,
+        verbose_name="Status no Pipeline"
+    )
+    
+    no_kanban = models.BooleanField(
+        verbose_name="No Kanban"
+    )
+    
+    origem = models.CharField(
+        max_length=20,
+        choices=OrigemChoices.choices,
+        verbose_name="Origem"
+    )
+    
+    total = models.IntegerField(
+        default=0,
+        verbose_name="Total de registros"
+    )
+    
+    class Meta:
+        verbose_name = "Contador do Pipeline"
+        verbose_name_plural = "Contadores do Pipeline"
+        unique_together = [('vendedor', 'status_pipeline', 'no_kanban', 'origem')]
+    
+    def __str__(self):
+        return f"{self.vendedor} / {self.status_pipeline} / {self.origem}: {self.total}"
+
+
+class ImportacaoJob(models.Model):
+    """
+    Importação de planilha processada fora do ciclo da requisição.
+    O upload cria o job; um worker (thread do processo ou o comando
+    processar_importacoes) processa o arquivo e grava o progresso aqui.
+    """
+    
+    STATUS_CHOICES = [
+        ('pendente', 'Pendente'),
+        ('processando', 'Processando'),
+        ('concluido', 'Concluído'),
+        ('erro', 'Erro'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    
+    arquivo = models.FileField(
+        upload_to='importacoes/',
+        blank=True,
+        verbose_name="Arquivo"
+    )
+    nome_arquivo = models.CharField(
+        max_length=255,
+        verbose_name="Nome do Arquivo"
+    )
+    vendedor = models.ForeignKey(
+        User,
+        on_delete=models.PROTECT,
+        related_name='importacoes',
+        verbose_name="Vendedor"
+    )
+    status_cliente = models.CharField(
+        max_length=20,
+        default='novo',
+        verbose_name="Status do Cliente aplicado"
+    )
+    politica_duplicados = models.CharField(
+        max_length=20,
+        default='pular',
+        verbose_name="Política para duplicados"
+    )
+    
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='pendente',
+        verbose_name="Status"
+    )
+    total_linhas = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        verbose_name="Total de linhas (estimado)"
+    )
+    linhas_processadas = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Linhas processadas"
+    )
+    importados = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Registros importados"
+    )
+    atualizados = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Registros existentes atualizados"
+    )
+    duplicados = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Linhas duplicadas"
+    )
+    total_erros = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Linhas com erro"
+    )
+    erros = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name="Erros (primeiros)"
+    )
+    mensagem_erro = models.TextField(
+        blank=True,
+        verbose_name="Mensagem de erro"
+    )
+    
+    criado_em = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Criado em"
+    )
+    iniciado_em = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Iniciado em"
+    )
+    atualizado_em = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Último progresso em",
+        help_text="Gravado na reserva e a cada lote; sem avanço por muito tempo, o worker parou"
+    )
+    tentativas = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name="Tentativas de processamento"
+    )
+    finalizado_em = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Finalizado em"
+    )
+    
+    class Meta:
+        verbose_name = "Importação"
+        verbose_name_plural = "Importações"
+        ordering = ['-criado_em']
         indexes = [
-            models.Index(fields=['registro', '-data_contato']),
+            models.Index(fields=['status', 'criado_em']),
         ]
     
     def __str__(self):
-        return f"{self.registro.nome_empresa} - {self.data_contato.strftime('%d/%m/%Y %H:%M')}"
+        return f"{self.nome_arquivo} ({self.get_status_display()})"
+    
+    def eta_segundos(self):
+        """Estimativa de segundos restantes com base na taxa atual."""
+        if self.status != 'processando' or not self.iniciado_em or not self.total_linhas:
+            return None
+        if not self.linhas_processadas:
+            return None
+        decorrido = (timezone.now() - self.iniciado_em).total_seconds()
+        taxa = self.linhas_processadas / decorrido if decorrido > 0 else 0
+        if taxa <= 0:
+            return None
+        restantes = max(self.total_linhas - self.linhas_processadas, 0)
+        return round(restantes / taxa)
+
+
+class MetricaDiaria(models.Model):
+    """
+    Consolidação diária dos registros comerciais para o painel de métricas.
+    Cada registro conta uma vez, no dia (local) do seu atualizado_em, com
+    os atributos atuais. Preenchida pelo comando consolidar_metricas para
+    dias fechados; o dia corrente é sempre consultado ao vivo
+    (ver crm/metricas.py).
+    """
+    data = models.DateField(
+        verbose_name="Data"
+    )
+    
+    vendedor = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='metricas_diarias',
+        verbose_name="Vendedor"
+    )
+    
+    status_pipeline = models.CharField(
+        max_length=30,
+        choices=StatusPipelineChoices.choices,
+        verbose_name="Status no Pipeline"
+    )
+    
+    origem = models.CharField(
+        max_length=20,
+        choices=OrigemChoices.choices,
+        verbose_name="Origem"
+    )
+    
+    uf = models.CharField(
+        max_length=2,
+        verbose_name="UF"
+    )
+    
+    cidade = models.CharField(
+        max_length=100,
+        verbose_name="Cidade"
+    )
+    
+    no_kanban = models.BooleanField(
+        verbose_name="No Kanban"
+    )
+    
+    total = models.IntegerField(
+        default=0,
+        verbose_name="Total de registros"
+    )
+    
+    class Meta:
+        verbose_name = "Métrica Diária"
+        verbose_name_plural = "Métricas Diárias"
+        unique_together = [('data', 'vendedor', 'status_pipeline', 'origem', 'uf', 'cidade', 'no_kanban')]
+        indexes = [
+            models.Index(fields=['data', 'vendedor']),
+        ]
+    
+    def __str__(self):
+        return f"{self.data} / {self.vendedor} / {self.status_pipeline}: {self.total}"
+
+
+class ControleConsolidacao(models.Model):
+    """Checkpoint das consolidações incrementais (último dia fechado processado)."""
+    nome = models.CharField(
+        max_length=50,
+        unique=True,
+        verbose_name="Nome"
+    )
+    consolidado_ate = models.DateField(
+        blank=True,
+        null=True,
+        verbose_name="Consolidado até"
+    )
+    atualizado_em = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Atualizado em"
+    )
+    
+    class Meta:
+        verbose_name = "Controle de Consolidação"
+        verbose_name_plural = "Controles de Consolidação"
+    
+    def __str__(self):
+        return f"{self.nome}: {self.consolidado_ate}"
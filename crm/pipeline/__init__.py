@@ -6,5 +6,6 @@ completamente isolado do Django e das views.
 """
 
 from .resolver import resolve_next_stage, checklist_completo
+from .matriz import MatrizTransicao, resolve_next_stages
 
-__all__ = ['resolve_next_stage', 'checklist_completo']
+__all__ = ['resolve_next_stage', 'checklist_completo', 'MatrizTransicao', 'resolve_next_stages']
@@ -0,0 +1,320 @@
+"""
+Matriz de transição do pipeline: resolução em lote.
+
+Compila PIPELINE_RULES em arrays indexados por inteiros (estágio × resultado
+→ próximo estágio, e máscara de bits do checklist obrigatório por estágio)
+e resolve milhares de (estágio, resultado, checklist) em uma chamada, sem
+exceções como controle de fluxo: cada linha recebe um código de erro.
+
+Usado em operações em massa (importação com resultado definido,
+reclassificação, reprocessamento do ContatoHistorico). Para um único
+contato continue usando resolve_next_stage().
+
+Funções puras em Python, sem dependências do Django.
+"""
+
+from array import array
+
+from .rules import PIPELINE_RULES
+from .constants import ARCHIVED
+
+
+# Códigos de erro por linha
+ERRO_NENHUM = 0
+ERRO_ESTAGIO_INVALIDO = 1
+ERRO_RESULTADO_INVALIDO = 2
+ERRO_CHECKLIST_INCOMPLETO = 3
+
+ERRO_LABELS = {
+    ERRO_NENHUM: "",
+    ERRO_ESTAGIO_INVALIDO: "Estágio inválido",
+    ERRO_RESULTADO_INVALIDO: "Resultado inválido para o estágio",
+    ERRO_CHECKLIST_INCOMPLETO: "Checklist incompleto para avançar",
+}
+
+# Índice usado para estágio/resultado desconhecido e linhas com erro
+SEM_INDICE = -1
+
+
+class MatrizTransicao:
+    """
+    Regras do pipeline compiladas em arrays.
+
+    - estagios: estágios com regras (origens) seguidos dos destinos sem regras
+      (ex: ARQUIVADO); o índice é a posição na tupla
+    - proximo[origem * n_resultados + resultado]: índice do próximo estágio
+      ou SEM_INDICE se o resultado não vale para a origem
+    - exige_checklist[mesma posição]: 1 se a transição é um avanço
+      (muda de estágio e não arquiva) e portanto exige checklist completo
+    - mascara_obrigatoria[origem]: bits dos itens obrigatórios do checklist
+    """
+
+    def __init__(self, rules=None):
+        rules = PIPELINE_RULES if rules is None else rules
+
+        origens = tuple(rules)
+        destinos = [
+            destino
+            for regras in rules.values()
+            for destino in regras.get("results", {}).values()
+            if destino not in rules
+        ]
+        self.n_origens = len(origens)
+        self.estagios = origens + tuple(dict.fromkeys(destinos))
+        self.indice_estagio = {estagio: i for i, estagio in enumerate(self.estagios)}
+
+        self.resultados = tuple(dict.fromkeys(
+            resultado for regras in rules.values() for resultado in regras.get("results", {})
+        ))
+        self.indice_resultado = {resultado: i for i, resultado in enumerate(self.resultados)}
+        self.n_resultados = len(self.resultados)
+
+        self.itens_checklist = tuple(dict.fromkeys(
+            item for regras in rules.values() for item in regras.get("checklist", [])
+        ))
+        if len(self.itens_checklist) > 64:
+            raise ValueError("Máximo de 64 itens de checklist na matriz de transição")
+        self.bit_item = {item: 1 << i for i, item in enumerate(self.itens_checklist)}
+
+        tamanho = self.n_origens * self.n_resultados
+        self.proximo = array("h", [SEM_INDICE]) * tamanho
+        self.exige_checklist = array("B", [0]) * tamanho
+        self.mascara_obrigatoria = array("Q", [0]) * self.n_origens
+
+        for origem, estagio in enumerate(origens):
+            regras = rules[estagio]
+            mascara = 0
+            for item in regras.get("checklist", []):
+                mascara |= self.bit_item[item]
+            self.mascara_obrigatoria[origem] = mascara
+
+            for resultado, destino in regras.get("results", {}).items():
+                posicao = origem * self.n_resultados + self.indice_resultado[resultado]
+                self.proximo[posicao] = self.indice_estagio[destino]
+                self.exige_checklist[posicao] = int(destino != estagio and destino != ARCHIVED)
+
+        # Para resolver_lote(): estágio → {resultado: posição nos arrays}
+        # e os itens obrigatórios de cada origem
+        self.posicao = {
+            estagio: {
+                resultado: origem * self.n_resultados + self.indice_resultado[resultado]
+                for resultado in rules[estagio].get("results", {})
+            }
+            for origem, estagio in enumerate(origens)
+        }
+        self.itens_obrigatorios = tuple(
+            tuple(rules[estagio].get("checklist", [])) for estagio in origens
+        )
+
+    # ---------- codificação ----------
+
+    def mascara_checklist(self, checklist):
+        """
+        Converte o checklist em máscara de bits.
+
+        Aceita dict {item: bool} (mesmo formato de resolve_next_stage),
+        iterável de itens marcados ou uma máscara int já codificada.
+        Itens desconhecidos são ignorados.
+        """
+        if isinstance(checklist, int):
+            return checklist
+        bit_item = self.bit_item
+        if isinstance(checklist, dict):
+            itens = [item for item, marcado in checklist.items() if marcado]
+        else:
+            itens = checklist or ()
+        mascara = 0
+        for item in itens:
+            mascara |= bit_item.get(item, 0)
+        return mascara
+
+    def codificar(self, linhas):
+        """
+        Codifica (estágio, resultado, checklist) em três arrays de inteiros.
+
+        Returns:
+            tuple: (array de estágios, array de resultados, array de máscaras)
+        """
+        indice_estagio = self.indice_estagio.get
+        indice_resultado = self.indice_resultado.get
+        mascara_checklist = self.mascara_checklist
+
+        estagios = array("h")
+        resultados = array("h")
+        mascaras = array("Q")
+        for estagio, resultado, checklist in linhas:
+            estagios.append(indice_estagio(estagio, SEM_INDICE))
+            resultados.append(indice_resultado(resultado, SEM_INDICE))
+            mascaras.append(mascara_checklist(checklist))
+        return estagios, resultados, mascaras
+
+    # ---------- resolução ----------
+
+    def resolver_indices(self, estagios, resultados, mascaras):
+        """
+        Resolve linhas já codificadas.
+
+        Returns:
+            tuple: (array com índice do próximo estágio ou SEM_INDICE,
+                    array com o código de erro de cada linha)
+        """
+        n_origens = self.n_origens
+        n_resultados = self.n_resultados
+        proximo = self.proximo
+        exige_checklist = self.exige_checklist
+        mascara_obrigatoria = self.mascara_obrigatoria
+
+        proximos = array("h", [SEM_INDICE]) * len(estagios)
+        erros = array("B", [ERRO_NENHUM]) * len(estagios)
+
+        for i, (estagio, resultado, mascara) in enumerate(zip(estagios, resultados, mascaras)):
+            if not 0 <= estagio < n_origens:
+                erros[i] = ERRO_ESTAGIO_INVALIDO
+                continue
+            if resultado < 0:
+                erros[i] = ERRO_RESULTADO_INVALIDO
+                continue
+            posicao = estagio * n_resultados + resultado
+            destino = proximo[posicao]
+            if destino < 0:
+                erros[i] = ERRO_RESULTADO_INVALIDO
+                continue
+            if exige_checklist[posicao]:
+                obrigatoria = mascara_obrigatoria[estagio]
+                if mascara & obrigatoria != obrigatoria:
+                    erros[i] = ERRO_CHECKLIST_INCOMPLETO
+                    continue
+            proximos[i] = destino
+
+        return proximos, erros
+
+    def resolver_lote(self, linhas):
+        """
+        Resolve uma lista de (estágio, resultado, checklist).
+
+        Mesmas regras de resolve_next_stage(), mas sem exceções: linhas
+        inválidas recebem None como próximo estágio e o código de erro.
+        O checklist só é verificado quando a transição exige (avanço).
+
+        Returns:
+            tuple: (list[str | None] próximos estágios, array de códigos de erro)
+        """
+        posicoes = self.posicao
+        n_resultados = self.n_resultados
+        proximo = self.proximo
+        exige_checklist = self.exige_checklist
+        mascara_obrigatoria = self.mascara_obrigatoria
+        itens_obrigatorios = self.itens_obrigatorios
+        estagios = self.estagios
+
+        proximos = []
+        erros = array("B")
+        for estagio, resultado, checklist in linhas:
+            resultados = posicoes.get(estagio)
+            if resultados is None:
+                erros.append(ERRO_ESTAGIO_INVALIDO)
+                proximos.append(None)
+                continue
+            posicao = resultados.get(resultado)
+            if posicao is None:
+                erros.append(ERRO_RESULTADO_INVALIDO)
+                proximos.append(None)
+                continue
+            if exige_checklist[posicao]:
+                origem = posicao // n_resultados
+                if isinstance(checklist, dict):
+                    completo = all(checklist.get(item, False) for item in itens_obrigatorios[origem])
+                else:
+                    obrigatoria = mascara_obrigatoria[origem]
+                    completo = self.mascara_checklist(checklist) & obrigatoria == obrigatoria
+                if not completo:
+                    erros.append(ERRO_CHECKLIST_INCOMPLETO)
+                    proximos.append(None)
+                    continue
+            erros.append(ERRO_NENHUM)
+            proximos.append(estagios[proximo[posicao]])
+
+        return proximos, erros
+
+
+MATRIZ = MatrizTransicao()
+
+
+def resolve_next_stages(linhas):
+    """
+    Resolve em lote com a matriz padrão (PIPELINE_RULES).
+
+    Args:
+        linhas: Iterável de (estágio, resultado, checklist)
+
+    Returns:
+        tuple: (list[str | None] próximos estágios, array de códigos de erro)
+
+    Examples:
+        >>> proximos, erros = resolve_next_stages([
+        ...     ("CONTA_PARA_CONTATO", "numero_invalido", {}),
+        ...     ("CONTA_PARA_CONTATO", "contato_responsavel", {}),
+        ... ])
+        >>> proximos, list(erros)
+        (['ARQUIVADO', None], [0, 3])
+    """
+    return MATRIZ.resolver_lote(linhas)
+
+
+# ========== BENCHMARK ==========
+if __name__ == "__main__":
+    import random
+    import time
+
+    from .resolver import resolve_next_stage
+
+    print("=" * 60)
+    print("BENCHMARK: resolve_next_stage (escalar) x resolve_next_stages (lote)")
+    print("=" * 60)
+
+    random.seed(42)
+    estagios = list(PIPELINE_RULES) + ["ESTAGIO_INEXISTENTE"]
+    resultados = list(MATRIZ.resultados) + ["resultado_inexistente"]
+    itens = list(MATRIZ.itens_checklist)
+
+    N = 200_000
+    linhas = []
+    for _ in range(N):
+        estagio = random.choice(estagios)
+        validos = list(PIPELINE_RULES.get(estagio, {}).get("results", {}))
+        # ~90% dos resultados válidos para o estágio, o resto aleatório
+        resultado = random.choice(validos) if validos and random.random() < 0.9 else random.choice(resultados)
+        checklist = {item: random.random() < 0.9 for item in PIPELINE_RULES.get(estagio, {}).get("checklist", [])}
+        linhas.append((estagio, resultado, checklist))
+
+    def escalar(linhas):
+        proximos = []
+        for estagio, resultado, checklist in linhas:
+            try:
+                proximos.append(resolve_next_stage(estagio, resultado, checklist))
+            except ValueError:
+                proximos.append(None)
+        return proximos
+
+    inicio = time.perf_counter()
+    esperado = escalar(linhas)
+    tempo_escalar = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    obtido, erros = resolve_next_stages(linhas)
+    tempo_lote = time.perf_counter() - inicio
+
+    codificadas = MATRIZ.codificar(linhas)
+    inicio = time.perf_counter()
+    indices, erros_indices = MATRIZ.resolver_indices(*codificadas)
+    tempo_indices = time.perf_counter() - inicio
+
+    assert obtido == esperado, "Resultado do lote diverge do escalar"
+    assert erros_indices == erros, "Códigos de erro divergem entre os dois caminhos"
+    assert [MATRIZ.estagios[i] if i >= 0 else None for i in indices] == esperado
+    assert all((erro == ERRO_NENHUM) == (proximo is not None) for proximo, erro in zip(obtido, erros))
+    print(f"\n  {N} linhas ({sum(1 for e in erros if e)} com erro) - resultados idênticos ✅")
+    print(f"  Escalar (com ValueError):     {tempo_escalar * 1000:8.1f} ms")
+    print(f"  Lote (resolver_lote):         {tempo_lote * 1000:8.1f} ms  ({tempo_escalar / tempo_lote:.1f}x)")
+    print(f"  Lote (já codificado):         {tempo_indices * 1000:8.1f} ms  ({tempo_escalar / tempo_indices:.1f}x)")
+    print("\n" + "=" * 60)
@@ -1,7 +1,19 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_init, post_delete, pre_delete, pre_save, m2m_changed, post_migrate
+from django.db import transaction
 from django.dispatch import receiver
 from django.contrib.auth.models import User, Group
 
+from .models import RegistroComercial
+from .models_config import FunilResultadoConfig, FunilProximoPassoConfig
+from .funil_config_utils import invalidar_cache_funil
+from . import contadores
+from . import metricas
+from . import busca
+from .cidades import registrar_cidades
+from .estatisticas import invalidar_estatisticas
+from .eventos_kanban import publicar_card
+from .decorators import invalidar_grupos_usuario
+
 
 @receiver(post_save, sender=User)
 def add_user_to_comercial_group(sender, instance, created, **kwargs):
@@ -16,3 +28,128 @@ def add_user_to_comercial_group(sender, instance, created, **kwargs):
         except Group.DoesNotExist:
             # Se o grupo não existir, será criado automaticamente na primeira migração
             pass
+    
+    invalidar_grupos_usuario(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidar_grupos_no_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    """Invalida o cache de grupos quando usuários entram/saem de grupos."""
+    if not reverse:
+        # user.groups.add/remove/clear
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidar_grupos_usuario(instance.pk)
+        return
+    
+    # group.user_set.add/remove/clear
+    if action in ('post_add', 'post_remove'):
+        invalidar_grupos_usuario(*pk_set)
+    elif action == 'pre_clear':
+        # Depois do clear não há como saber quem era membro
+        instance._membros_antes_do_clear = list(instance.user_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        invalidar_grupos_usuario(*getattr(instance, '_membros_antes_do_clear', []))
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def invalidar_grupos_no_grupo(sender, instance, **kwargs):
+    """Grupo renomeado/excluído: invalida o cache dos membros."""
+    invalidar_grupos_usuario(*instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_init, sender=RegistroComercial)
+def guardar_chave_contador(sender, instance, **kwargs):
+    """Guarda as chaves do contador e da métrica diária no carregamento para detectar mudanças no save()."""
+    instance._chave_contador_original = contadores.chave_contador(instance)
+    instance._chave_metrica_original = metricas.chave_metrica(instance)
+
+
+# Nomes aceitos em update_fields para os campos da chave do contador
+CAMPOS_CONTADOR = frozenset(('vendedor', *contadores.CAMPOS_CHAVE))
+
+
+@receiver(pre_save, sender=RegistroComercial)
+def completar_chave_contador(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Instância carregada sem algum campo da chave (only()/defer()): lê a chave
+    gravada no banco antes do UPDATE, para o post_save tirar o registro do
+    contador antigo. Sem isso o contador novo ganharia +1 sem o -1 correspondente.
+    """
+    if raw or instance._state.adding or instance._chave_contador_original is not None:
+        return
+    if update_fields is not None and not CAMPOS_CONTADOR & set(update_fields):
+        return
+    instance._chave_contador_original = contadores.chave_contador_no_banco(instance)
+
+
+@receiver(post_save, sender=RegistroComercial)
+def atualizar_contadores_no_save(sender, instance, created, raw=False, **kwargs):
+    """Mantém ContadorPipeline em sincronia quando status/no_kanban/origem/vendedor mudam."""
+    if raw:
+        return
+    
+    chave_antiga = None if created else instance._chave_contador_original
+    # Campos não carregados não mudaram: vêm da chave antiga
+    chave_nova = contadores.chave_contador(instance, base=chave_antiga)
+    
+    if chave_nova is not None and chave_nova != chave_antiga:
+        deltas = {chave_nova: 1}
+        if chave_antiga is not None:
+            deltas[chave_antiga] = -1
+        contadores.aplicar_deltas(deltas)
+    
+    instance._chave_contador_original = chave_nova
+    invalidar_estatisticas(instance.vendedor_id, chave_antiga and chave_antiga[0])
+    publicar_card(instance, chave_antiga)
+    
+    # atualizado_em passou para hoje: sai da linha consolidada do dia anterior
+    if not created:
+        metricas.descontar_consolidados([instance._chave_metrica_original])
+    instance._chave_metrica_original = metricas.chave_metrica(instance)
+
+
+@receiver(post_save, sender=RegistroComercial)
+def atualizar_indice_cidades_no_save(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """Cidade/UF nova ou alterada pode trazer um par ainda ausente do autocomplete."""
+    if raw or not {'cidade', 'uf'} <= instance.__dict__.keys():
+        return
+    if created or update_fields is None or {'cidade', 'uf'} & set(update_fields):
+        registrar_cidades([(instance.cidade, instance.uf)], excluir_ids=[instance.pk])
+
+
+@receiver(pre_delete, sender=RegistroComercial)
+def completar_chave_contador_no_delete(sender, instance, **kwargs):
+    """Instância sem algum campo da chave: lê a chave antes de o registro sair do banco."""
+    if instance._chave_contador_original is None and contadores.chave_contador(instance) is None:
+        instance._chave_contador_original = contadores.chave_contador_no_banco(instance)
+
+
+@receiver(post_delete, sender=RegistroComercial)
+def atualizar_contadores_no_delete(sender, instance, **kwargs):
+    """Decrementa o contador do registro removido."""
+    chave = instance._chave_contador_original or contadores.chave_contador(instance)
+    if chave is not None:
+        contadores.aplicar_deltas({chave: -1})
+        # vendedor_id da chave: em instância parcial o atributo não pode mais ser lido do banco
+        invalidar_estatisticas(chave[0])
+    
+    metricas.descontar_consolidados([instance._chave_metrica_original])
+
+
+@receiver(post_save, sender=FunilResultadoConfig)
+@receiver(post_delete, sender=FunilResultadoConfig)
+@receiver(post_save, sender=FunilProximoPassoConfig)
+@receiver(post_delete, sender=FunilProximoPassoConfig)
+def invalidar_cache_funil_na_alteracao(sender, raw=False, **kwargs):
+    """Nova versão da configuração do funil a cada save/delete (após o commit)."""
+    if raw:
+        return
+    transaction.on_commit(invalidar_cache_funil)
+
+
+@receiver(post_migrate)
+def garantir_indice_busca(sender, using='default', **kwargs):
+    """SQLite recria a tabela de registros em algumas migrações (e perde os triggers do FTS5)."""
+    if sender.name == 'crm':
+        busca.garantir_indice(using)
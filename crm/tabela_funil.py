@@ -0,0 +1,171 @@
+"""
+Tabela compilada das regras do funil para o formulário de contato.
+
+Para cada (status_pipeline do banco, status_cliente) guarda, já resolvidos:
+resultados (com o label do próximo estágio), chaves de resultado aceitas,
+checklist, próximos passos e o JSON pronto para o template. A tabela é
+imutável, montada no primeiro uso (uma consulta às configs do funil) e
+recompilada quando a versão do namespace 'funil' muda (save/delete das
+configs, ver crm/signals.py).
+"""
+
+import json
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from .cache_utils import versao_namespace
+from .funil_config_utils import NAMESPACE_FUNIL
+from .models import StatusPipelineChoices
+from .models_config import FunilResultadoConfig
+from .pipeline.rules import (
+    PIPELINE_RULES,
+    RESULT_LABELS,
+    CHECKLIST_LABELS,
+    RESULTADO_POR_STATUS_CLIENTE,
+)
+
+
+STATUS_CLIENTE_PADRAO = 'novo'
+
+
+@dataclass(frozen=True)
+class RegraFunil:
+    """Regras do formulário de contato para um (status_pipeline, status_cliente)."""
+    stage: str
+    results: tuple
+    resultados_validos: frozenset
+    checklist: tuple
+    next_steps: tuple
+    results_json: str
+    checklist_json: str
+
+
+REGRA_VAZIA = RegraFunil(
+    stage=None,
+    results=(),
+    resultados_validos=frozenset(),
+    checklist=(),
+    next_steps=(),
+    results_json='[]',
+    checklist_json='[]',
+)
+
+_tabela = None
+_versao = None
+_lock = threading.Lock()
+
+
+def _criar_regra(stage, results, resultados_validos, checklist, next_steps):
+    results = tuple(MappingProxyType(result) for result in results)
+    checklist = tuple(tuple(item) for item in checklist)
+    return RegraFunil(
+        stage=stage,
+        results=results,
+        resultados_validos=frozenset(resultados_validos),
+        checklist=checklist,
+        next_steps=tuple(next_steps),
+        results_json=json.dumps([dict(result) for result in results]),
+        checklist_json=json.dumps([list(item) for item in checklist]),
+    )
+
+
+def compilar_tabela():
+    """
+    Monta a tabela completa de regras.
+
+    Returns:
+        dict: {(db_status, status_cliente): RegraFunil}
+    """
+    from .views import STATUS_PIPELINE_MAP, PIPELINE_TO_DB_MAP, STAGE_CONFIG
+
+    status_labels = dict(StatusPipelineChoices.choices)
+    status_clientes = [chave for chave, _ in FunilResultadoConfig.STATUS_CLIENTE_CHOICES]
+    conta_para_contato = StatusPipelineChoices.CONTA_PARA_CONTATO.value
+
+    # Uma consulta para todas as configs ativas de "Conta para Contato"
+    configs = defaultdict(list)
+    for config in FunilResultadoConfig.objects.filter(
+        coluna_pipeline=conta_para_contato,
+        ativo=True,
+    ).order_by('ordem', 'label'):
+        configs[config.status_cliente].append(config)
+
+    tabela = {}
+    for db_status in StatusPipelineChoices.values:
+        stage = STATUS_PIPELINE_MAP.get(db_status)
+        pipeline_rules = PIPELINE_RULES.get(stage, {})
+        regras_resultado = pipeline_rules.get('results', {})
+        checklist = [
+            [item, CHECKLIST_LABELS.get(item, item)]
+            for item in pipeline_rules.get('checklist', [])
+        ]
+        next_steps = STAGE_CONFIG.get(db_status, {}).get('next_steps', [])
+
+        if db_status != conta_para_contato:
+            # Opções do pipeline normal (independem do status do cliente)
+            results = []
+            for key, next_stage in regras_resultado.items():
+                db_next_stage = PIPELINE_TO_DB_MAP.get(next_stage, next_stage)
+                results.append({
+                    'key': key,
+                    'label': RESULT_LABELS.get(key, key),
+                    'next_status_label': status_labels.get(db_next_stage, db_next_stage),
+                })
+            regra = _criar_regra(stage, results, regras_resultado.keys(), checklist, next_steps)
+            for status_cliente in status_clientes:
+                tabela[(db_status, status_cliente)] = regra
+            continue
+
+        # "Conta para Contato": configs do banco com fallback para RESULTADO_POR_STATUS_CLIENTE
+        for status_cliente in status_clientes:
+            opcoes = [
+                (config.key, config.label) for config in configs[status_cliente]
+            ] or [
+                (key, RESULT_LABELS.get(key, key))
+                for key in RESULTADO_POR_STATUS_CLIENTE.get(status_cliente, [])
+            ]
+            results = []
+            for key, label in opcoes:
+                next_stage = regras_resultado.get(key, stage)
+                db_next_stage = PIPELINE_TO_DB_MAP.get(next_stage, db_status)
+                results.append({
+                    'key': key,
+                    'label': label,
+                    'next_status_label': status_labels.get(db_next_stage, db_next_stage),
+                })
+            resultados_validos = RESULTADO_POR_STATUS_CLIENTE.get(
+                status_cliente,
+                RESULTADO_POR_STATUS_CLIENTE.get(STATUS_CLIENTE_PADRAO, []),
+            )
+            tabela[(db_status, status_cliente)] = _criar_regra(
+                stage, results, resultados_validos, checklist, next_steps
+            )
+
+    return tabela
+
+
+def obter_tabela():
+    """Tabela atual, recompilada se a versão da configuração do funil mudou."""
+    global _tabela, _versao
+
+    versao = versao_namespace(NAMESPACE_FUNIL)
+    if _tabela is not None and versao == _versao:
+        return _tabela
+
+    with _lock:
+        if _tabela is None or versao != _versao:
+            _tabela = MappingProxyType(compilar_tabela())
+            _versao = versao
+        return _tabela
+
+
+def regra_funil(db_status, status_cliente):
+    """Regras do formulário de contato para o registro (uma consulta em dict)."""
+    tabela = obter_tabela()
+    return (
+        tabela.get((db_status, status_cliente))
+        or tabela.get((db_status, STATUS_CLIENTE_PADRAO))
+        or REGRA_VAZIA
+    )
@@ -1,3 +1,1686 @@
-from django.test import TestCase
+import importlib
+import io
+import re
+import shutil
+import tempfile
+from collections import deque
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.db.models import F
+from django.template.backends.django import Template
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    analise_funil, busca, cache_utils, cidades, contadores, eventos_kanban, fragmentos_cards, importacao,
+    importacao_jobs, instrumentacao, metricas, tabela_funil,
+)
+from .acoes_lote import (
+    ACAO_ARQUIVAR, ACAO_MOVER_PARA_KANBAN, ACAO_REATRIBUIR, AcaoLoteInvalida, executar_acao_lote,
+)
+from .decorators import grupos_usuario, is_admin, is_comercial
+from .deduplicacao import POLITICA_ATUALIZAR, POLITICA_MESCLAR, POLITICA_PULAR, resolver_lote
+from .funil_config_utils import invalidar_cache_funil, obter_proximos_passos_config, obter_resultados_config
+from .models import ContadorPipeline, ContatoHistorico, ImportacaoJob, MetricaDiaria, RegistroComercial, StatusPipelineChoices, normalizar_telefone
+from .models_config import FunilProximoPassoConfig, FunilResultadoConfig
+from .pipeline import matriz, resolve_next_stage
+from .pipeline.rules import PIPELINE_RULES
+from .views import KANBAN_STATUSES, LIMITE_RETORNOS, RESULTADO_RETORNO
+from .views_eventos import _visivel
+
+
+class ProjecaoCardsTests(TestCase):
+    """
+    Listas e quadros carregam os cards com RegistroComercial.objects.para_cards():
+    o número de consultas por página não depende da quantidade de cards nem
+    de vendedores (sem N+1 em registro.vendedor).
+    """
+
+    # Sessão + usuário (o restante vem do cache aquecido na primeira requisição)
+    CONSULTAS_AUTENTICACAO = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.gestor = User.objects.create_superuser('gestor', password='senha')
+        vendedores = [
+            User.objects.create_user(f'vendedor{indice}', first_name=f'Vendedor {indice}', password='senha')
+            for indice in range(3)
+        ]
+
+        locais = [(StatusPipelineChoices.CONTA_PARA_CONTATO.value, False)]
+        locais += [(status_key, True) for status_key, _ in KANBAN_STATUSES]
+        locais += [
+            (StatusPipelineChoices.ARQUIVADA.value, False),
+            (StatusPipelineChoices.CONTA_ATIVA.value, False),
+        ]
+        for vendedor in vendedores:
+            for status_pipeline, no_kanban in locais:
+                for indice in range(4):
+                    RegistroComercial.objects.create(
+                        nome_empresa=f'{vendedor.username} {status_pipeline} {indice}',
+                        telefone=f'11 9{vendedor.id:03d}-{len(status_pipeline):02d}{indice:02d}',
+                        cidade='São Paulo',
+                        uf='SP',
+                        vendedor=vendedor,
+                        status_pipeline=status_pipeline,
+                        no_kanban=no_kanban,
+                        resultado_ultimo_contato='Conversa inicial',
+                    )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.gestor)
+
+    def assertConsultasPorPagina(self, consultas, url, params=None):
+        # Primeira requisição aquece o cache (grupos do usuário, versões de namespace)
+        self.assertEqual(self.client.get(url, params).status_code, 200)
+        with self.assertNumQueries(self.CONSULTAS_AUTENTICACAO + consultas):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_kanban(self):
+        # Backlog + ContadorPipeline + cards das colunas (ROW_NUMBER) + vendedores do filtro
+        response = self.assertConsultasPorPagina(4, reverse('kanban'))
+        self.assertContains(response, 'Vendedor 2')
+
+    def test_carregar_mais_registros(self):
+        # Uma página por cursor: apenas os cards
+        for local in ['backlog', StatusPipelineChoices.CONTATO_FEITO.value]:
+            with self.subTest(local=local):
+                response = self.assertConsultasPorPagina(
+                    1, reverse('carregar_mais_registros'), {'local': local, 'cursor': ''}
+                )
+                self.assertIn('Vendedor', response.json()['html'])
+
+    def test_arquivados(self):
+        # COUNT do paginador + página
+        self.assertConsultasPorPagina(2, reverse('arquivados'))
+
+    def test_contas_ativas(self):
+        # COUNT do paginador + página
+        self.assertConsultasPorPagina(2, reverse('contas_ativas'))
+
+    def test_projecao_nao_carrega_textos_fora_do_card(self):
+        registro = RegistroComercial.objects.para_cards().first()
+        adiados = registro.get_deferred_fields()
+        self.assertIn('proximo_passo', adiados)
+        self.assertIn('busca_normalizada', adiados)
+        with self.assertNumQueries(0):
+            registro.vendedor.get_full_name()
+
+
+class ConflitoVersaoQuadroTests(TestCase):
+    """
+    Ações do quadro enviam a versao do card desenhado: versão desatualizada
+    responde 409 (AJAX) e nada é gravado.
+    """
+
+    AJAX = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.vendedor = User.objects.create_user('vendedor', password='senha')
+
+    def setUp(self):
+        self.client.force_login(self.vendedor)
+        self.registro = RegistroComercial.objects.create(
+            nome_empresa='Padaria Central',
+            telefone='11 98888-0000',
+            cidade='Campinas',
+            uf='SP',
+            vendedor=self.vendedor,
+        )
+
+    def alterar_por_outro_usuario(self):
+        outro = RegistroComercial.objects.get(pk=self.registro.pk)
+        outro.observacoes = 'Editado em outra aba'
+        outro.save()
+        return outro.versao
+
+    def assertConflito(self, response, versao_atual):
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(response.json()['conflito'])
+        registro = RegistroComercial.objects.get(pk=self.registro.pk)
+        self.assertEqual(registro.versao, versao_atual)
+        return registro
+
+    def test_mover_para_kanban_com_versao_desatualizada(self):
+        versao_desenhada = self.registro.versao
+        versao_atual = self.alterar_por_outro_usuario()
+
+        response = self.client.post(
+            reverse('mover_para_kanban', args=[self.registro.pk]), {'versao': versao_desenhada}, **self.AJAX
+        )
+        registro = self.assertConflito(response, versao_atual)
+        self.assertFalse(registro.no_kanban)
+
+    def test_mover_para_backlog_com_versao_desatualizada(self):
+        self.registro.mover_para_kanban()
+        versao_desenhada = self.registro.versao
+        versao_atual = self.alterar_por_outro_usuario()
+
+        response = self.client.post(
+            reverse('mover_para_backlog', args=[self.registro.pk]), {'versao': versao_desenhada}, **self.AJAX
+        )
+        registro = self.assertConflito(response, versao_atual)
+        self.assertTrue(registro.no_kanban)
+
+    def test_atualizar_status_com_versao_desatualizada(self):
+        versao_desenhada = self.registro.versao
+        versao_atual = self.alterar_por_outro_usuario()
+
+        response = self.client.post(
+            reverse('atualizar_status', args=[self.registro.pk]),
+            {'versao': versao_desenhada, 'novo_status': StatusPipelineChoices.ARQUIVADA.value},
+            **self.AJAX,
+        )
+        registro = self.assertConflito(response, versao_atual)
+        self.assertEqual(registro.status_pipeline, self.registro.status_pipeline)
+
+    def test_versao_atual_grava_e_devolve_nova_versao(self):
+        versao_desenhada = self.registro.versao
+        response = self.client.post(
+            reverse('mover_para_kanban', args=[self.registro.pk]), {'versao': versao_desenhada}, **self.AJAX
+        )
+        self.assertEqual(response.status_code, 200)
+        registro = RegistroComercial.objects.get(pk=self.registro.pk)
+        self.assertTrue(registro.no_kanban)
+        self.assertEqual(response.json()['versao'], registro.versao)
+        self.assertGreater(registro.versao, versao_desenhada)
+
+    def test_cards_desenham_a_versao(self):
+        self.registro.mover_para_kanban()
+        response = self.client.get(reverse('kanban'))
+        self.assertContains(response, f'data-versao="{self.registro.versao}"')
+
+
+# Ordem de cada coluna no quadro (carregar_quadro_kanban)
+ORDEM_QUADRO = {
+    StatusPipelineChoices.CONTA_PARA_CONTATO.value: (
+        F('data_retorno').asc(nulls_last=True), '-atualizado_em', '-id',
+    ),
+    StatusPipelineChoices.CONTATO_FEITO.value: ('-atualizado_em', '-id'),
+}
+
+
+class CursorColunasTests(TestCase):
+    """
+    O cursor inicial de cada coluna sai do último card desenhado no quadro e
+    "Carregar Mais" segue a mesma ordem: sem duplicados nem cards pulados.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.vendedor = User.objects.create_user('vendedor', password='senha')
+        agora = timezone.now()
+        colunas = [
+            StatusPipelineChoices.CONTA_PARA_CONTATO.value,
+            StatusPipelineChoices.CONTATO_FEITO.value,
+        ]
+        for status_pipeline in colunas:
+            for indice in range(21):
+                registro = RegistroComercial.objects.create(
+                    nome_empresa=f'{status_pipeline} {indice}',
+                    telefone=f'11 97777-{indice:04d}',
+                    vendedor=cls.vendedor,
+                    status_pipeline=status_pipeline,
+                    no_kanban=True,
+                )
+                # Empates de atualizado_em e de data_retorno, e um terço sem retorno
+                RegistroComercial.objects.filter(pk=registro.pk).update(
+                    atualizado_em=agora - timedelta(minutes=indice // 3),
+                    data_retorno=None if indice % 3 == 0 else agora + timedelta(days=indice % 4),
+                )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.vendedor)
+
+    def ids_por_coluna(self, response):
+        return {
+            status_key: [str(registro.id) for registro in cards]
+            for status_key, cards in response.context['kanban_by_status'].items()
+        }
+
+    def test_carregar_mais_continua_a_ordem_do_quadro(self):
+        response = self.client.get(reverse('kanban'))
+        cursores = response.context['cursores_iniciais']
+        desenhados = self.ids_por_coluna(response)
+
+        for status_key in [
+            StatusPipelineChoices.CONTA_PARA_CONTATO.value,
+            StatusPipelineChoices.CONTATO_FEITO.value,
+        ]:
+            with self.subTest(coluna=status_key):
+                ids = list(desenhados[status_key])
+                cursor = cursores[status_key]
+                while cursor:
+                    pagina = self.client.get(
+                        reverse('carregar_mais_registros'), {'local': status_key, 'cursor': cursor}
+                    ).json()
+                    ids += re.findall(r'data-id="([0-9a-f-]+)"', pagina['html'])
+                    cursor = pagina['next_cursor']
+
+                esperado = RegistroComercial.objects.filter(
+                    no_kanban=True, status_pipeline=status_key
+                ).order_by(*ORDEM_QUADRO[status_key]).values_list('id', flat=True)
+                self.assertEqual(ids, [str(registro_id) for registro_id in esperado])
+
+
+
+class CriarRegistroDuplicadoTests(TestCase):
+    """Cadastro bloqueia duplicados de qualquer vendedor, mas só detalha os do próprio."""
+
+    AJAX = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.dono = User.objects.create_user('dono', password='senha')
+        cls.outro = User.objects.create_user('outro', password='senha')
+        cls.gestor = User.objects.create_superuser('gestor', password='senha')
+        cls.existente = RegistroComercial.objects.create(
+            nome_empresa='Mercado Sigiloso',
+            telefone='(11) 95555-1234',
+            cidade='Santos',
+            uf='SP',
+            vendedor=cls.dono,
+        )
+
+    def criar(self, usuario):
+        self.client.force_login(usuario)
+        return self.client.post(reverse('criar_registro'), {
+            'nome_empresa': 'Outro Nome',
+            'telefone': '11 95555 1234',
+            'cidade': 'Santos',
+            'uf': 'SP',
+        }, **self.AJAX)
+
+    def test_outro_vendedor_nao_ve_o_lead(self):
+        response = self.criar(self.outro)
+        self.assertEqual(response.status_code, 409)
+        dados = response.json()
+        self.assertNotIn('registro_existente_id', dados)
+        self.assertNotIn('Mercado Sigiloso', dados['error'])
+        self.assertEqual(RegistroComercial.objects.count(), 1)
+
+    def test_dono_e_gestor_veem_o_lead(self):
+        for usuario in (self.dono, self.gestor):
+            with self.subTest(usuario=usuario.username):
+                response = self.criar(usuario)
+                self.assertEqual(response.status_code, 409)
+                dados = response.json()
+                self.assertEqual(dados['registro_existente_id'], str(self.existente.id))
+                self.assertIn('Mercado Sigiloso', dados['error'])
+        self.assertEqual(RegistroComercial.objects.count(), 1)
+
+
+class ResolverLoteTests(TestCase):
+    """Deduplicação da importação: políticas, duplicados no próprio lote e versao."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.vendedor = User.objects.create_user('vendedor', password='senha')
+
+    def setUp(self):
+        self.existente = RegistroComercial.objects.create(
+            nome_empresa='Loja Antiga',
+            telefone='11 94444-0000',
+            cidade='',
+            uf='SP',
+            codigo_winthor='W100',
+            vendedor=self.vendedor,
+        )
+
+    def linha(self, indice, nome, telefone, cidade='Sorocaba', codigo_winthor=None):
+        registro = RegistroComercial(
+            nome_empresa=nome,
+            telefone=telefone,
+            telefone_normalizado=normalizar_telefone(telefone),
+            cidade=cidade,
+            uf='SP',
+            codigo_winthor=codigo_winthor,
+            vendedor=self.vendedor,
+        )
+        return indice, registro
+
+    def gravar(self, atualizar, campos):
+        RegistroComercial.objects.bulk_update(atualizar, sorted(campos))
+        return RegistroComercial.objects.get(pk=self.existente.pk)
+
+    def test_pular_mantem_o_existente(self):
+        novos, atualizar, campos, duplicados = resolver_lote(
+            [self.linha(2, 'Loja Nova', '(11) 94444-0000'), self.linha(3, 'Outra', '11 93333-0000')],
+            POLITICA_PULAR,
+        )
+        self.assertEqual([registro.nome_empresa for registro in novos], ['Outra'])
+        self.assertEqual((atualizar, campos, duplicados), ([], set(), 1))
+
+    def test_atualizar_sobrescreve_e_incrementa_versao(self):
+        versao = self.existente.versao
+        novos, atualizar, campos, duplicados = resolver_lote(
+            [self.linha(2, 'Loja Nova', '11 94444-0000')], POLITICA_ATUALIZAR
+        )
+        self.assertEqual((novos, duplicados), ([], 1))
+        self.assertTrue({'nome_empresa', 'cidade', 'versao', 'atualizado_em', 'busca_normalizada'} <= campos)
+
+        registro = self.gravar(atualizar, campos)
+        self.assertEqual(registro.nome_empresa, 'Loja Nova')
+        self.assertEqual(registro.cidade, 'Sorocaba')
+        self.assertEqual(registro.versao, versao + 1)
+        self.assertIn('loja nova', registro.busca_normalizada)
+
+    def test_mesclar_preenche_apenas_campos_vazios(self):
+        novos, atualizar, campos, duplicados = resolver_lote(
+            [self.linha(2, 'Loja Nova', '11 92222-0000', codigo_winthor='W100')], POLITICA_MESCLAR
+        )
+        self.assertEqual((novos, duplicados), ([], 1))
+        self.assertNotIn('nome_empresa', campos)
+
+        registro = self.gravar(atualizar, campos)
+        self.assertEqual(registro.nome_empresa, 'Loja Antiga')
+        self.assertEqual(registro.cidade, 'Sorocaba')
+        self.assertEqual(registro.telefone, '11 94444-0000')
+
+    def test_duplicados_no_mesmo_lote(self):
+        novos, atualizar, campos, duplicados = resolver_lote(
+            [
+                self.linha(2, 'Primeira', '11 91111-0000'),
+                self.linha(3, 'Segunda', '(11) 91111-0000'),
+                self.linha(4, 'Terceira', '11 90000-0000', codigo_winthor='W200'),
+                self.linha(5, 'Quarta', '11 98888-7777', codigo_winthor='W200'),
+            ],
+            POLITICA_ATUALIZAR,
+        )
+        # A primeira ocorrência cria; as seguintes alteram o registro ainda não salvo
+        self.assertEqual([registro.nome_empresa for registro in novos], ['Segunda', 'Quarta'])
+        self.assertEqual((atualizar, duplicados), ([], 2))
+
+    def test_sem_alteracao_nao_atualiza(self):
+        novos, atualizar, campos, duplicados = resolver_lote(
+            [self.linha(2, 'Loja Antiga', '11 94444-0000', cidade='')], POLITICA_ATUALIZAR
+        )
+        self.assertEqual((novos, atualizar, campos, duplicados), ([], [], set(), 1))
+
+
+class ImportacaoLoteComFalhaTests(TestCase):
+    """Lote recusado pelo banco: só as linhas recusadas viram erro, as demais são gravadas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.vendedor = User.objects.create_user('vendedor', password='senha')
+
+    def test_isola_as_linhas_recusadas(self):
+        lote = [
+            (indice + 2, {
+                'nome_empresa': 'Recusada' if indice in (3, 6) else f'Empresa {indice}',
+                'telefone': f'11 96666-{indice:04d}',
+                'cidade': 'Jundiaí',
+                'uf': 'SP',
+                'origem': 'google',
+                'canal_contato': 'whatsapp',
+                'codigo_winthor': None,
+            })
+            for indice in range(8)
+        ]
+        gravar_lote = importacao._gravar_lote
+
+        def gravar_recusando(lote, *args):
+            if any(dados['nome_empresa'] == 'Recusada' for _, dados in lote):
+                raise IntegrityError('linha recusada')
+            return gravar_lote(lote, *args)
+
+        resumo = {'linhas': 8, 'importados': 0, 'atualizados': 0, 'duplicados': 0, 'erros': []}
+        with mock.patch.object(importacao, '_gravar_lote', side_effect=gravar_recusando):
+            importacao._processar_lote(lote, self.vendedor, 'novo', POLITICA_PULAR, resumo)
+
+        self.assertEqual(resumo['importados'], 6)
+        self.assertEqual(resumo['erros'], ['Linha 5: linha recusada', 'Linha 8: linha recusada'])
+        self.assertEqual(RegistroComercial.objects.count(), 6)
+        self.assertFalse(RegistroComercial.objects.filter(nome_empresa='Recusada').exists())
+
+
+def planilha_xlsx(linhas):
+    """Planilha de importação em memória (cabeçalho + linhas)."""
+    import openpyxl
+
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(list(importacao.CAMPOS_OBRIGATORIOS))
+    for linha in linhas:
+        sheet.append(linha)
+    conteudo = io.BytesIO()
+    workbook.save(conteudo)
+    return SimpleUploadedFile('leads.xlsx', conteudo.getvalue())
+
+
+@override_settings(IMPORTACAO_EXECUTOR='comando', IMPORTACAO_TAMANHO_LOTE=2)
+class ImportacaoJobTests(TestCase):
+    """Reserva, progresso, falha e recuperação de jobs travados."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.vendedor = User.objects.create_user('vendedor', password='senha')
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        configuracao = override_settings(MEDIA_ROOT=media)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def criar_job(self, linhas=None):
+        if linhas is None:
+            linhas = [
+                (f'Empresa {indice}', f'11 95555-{indice:04d}', 'Itu', 'SP', 'google', 'whatsapp')
+                for indice in range(5)
+            ]
+        return importacao_jobs.criar_job(planilha_xlsx(linhas), self.vendedor)
+
+    def test_reserva_e_atomica_e_pega_o_mais_antigo(self):
+        primeiro = self.criar_job()
+        segundo = self.criar_job()
+        ImportacaoJob.objects.filter(id=segundo.id).update(criado_em=primeiro.criado_em + timedelta(seconds=1))
+
+        self.assertEqual(importacao_jobs.proximo_job_pendente(), primeiro.id)
+        self.assertFalse(importacao_jobs.reservar_job(primeiro.id))
+        self.assertEqual(importacao_jobs.proximo_job_pendente(), segundo.id)
+        self.assertIsNone(importacao_jobs.proximo_job_pendente())
+
+        job = ImportacaoJob.objects.get(id=primeiro.id)
+        self.assertEqual((job.status, job.tentativas), ('processando', 1))
+        self.assertIsNotNone(job.atualizado_em)
+
+    def test_progresso_e_conclusao(self):
+        job = self.criar_job()
+        gravados = []
+        importar_planilha = importacao_jobs.importar_planilha
+
+        def importar_observando(arquivo, progresso, **kwargs):
+            def observar(resumo):
+                progresso(resumo)
+                gravados.append(
+                    ImportacaoJob.objects.values_list('linhas_processadas', 'atualizado_em').get(id=job.id)
+                )
+            return importar_planilha(arquivo, progresso=observar, **kwargs)
+
+        with mock.patch.object(importacao_jobs, 'importar_planilha', side_effect=importar_observando):
+            self.assertTrue(importacao_jobs.processar_job(job.id))
+
+        # Um progresso a cada lote de 2 linhas e outro ao final
+        self.assertEqual([linhas for linhas, _ in gravados], [2, 4, 5])
+        sinais = [atualizado_em for _, atualizado_em in gravados]
+        self.assertEqual(sinais, sorted(sinais))
+
+        job = ImportacaoJob.objects.get(id=job.id)
+        self.assertEqual((job.status, job.importados, job.linhas_processadas), ('concluido', 5, 5))
+        self.assertEqual(job.arquivo.name, '')
+        self.assertEqual(RegistroComercial.objects.filter(vendedor=self.vendedor).count(), 5)
+
+    def test_arquivo_invalido_marca_erro(self):
+        job = importacao_jobs.criar_job(SimpleUploadedFile('leads.xlsx', b'nao e xlsx'), self.vendedor)
+        with self.assertLogs('crm.importacao_jobs', 'ERROR'):
+            self.assertTrue(importacao_jobs.processar_job(job.id))
+        job = ImportacaoJob.objects.get(id=job.id)
+        self.assertEqual(job.status, 'erro')
+        self.assertIn('Erro ao processar arquivo', job.mensagem_erro)
+        self.assertIsNotNone(job.finalizado_em)
+        self.assertFalse(importacao_jobs.processar_job(job.id))
+
+    def travar(self, job, minutos, tentativas=1):
+        antigo = timezone.now() - timedelta(minutes=minutos)
+        ImportacaoJob.objects.filter(id=job.id).update(
+            status='processando', iniciado_em=antigo, atualizado_em=antigo,
+            tentativas=tentativas, linhas_processadas=2,
+        )
+
+    @override_settings(IMPORTACAO_TEMPO_LIMITE_MINUTOS=15, IMPORTACAO_MAX_TENTATIVAS=3)
+    def test_recupera_jobs_travados(self):
+        travado = self.criar_job()
+        esgotado = self.criar_job()
+        ativo = self.criar_job()
+        self.travar(travado, 30)
+        self.travar(esgotado, 30, tentativas=3)
+        self.travar(ativo, 1)
+
+        with self.assertLogs('crm.importacao_jobs', 'WARNING') as logs:
+            self.assertEqual(importacao_jobs.recuperar_jobs_travados(), (1, 1))
+        self.assertEqual(len(logs.records), 2)
+
+        travado = ImportacaoJob.objects.get(id=travado.id)
+        self.assertEqual((travado.status, travado.linhas_processadas), ('pendente', 0))
+        esgotado = ImportacaoJob.objects.get(id=esgotado.id)
+        self.assertEqual((esgotado.status, esgotado.arquivo.name), ('erro', ''))
+        self.assertIn('interrompida', esgotado.mensagem_erro)
+        self.assertEqual(ImportacaoJob.objects.get(id=ativo.id).status, 'processando')
+
+    def test_comando_recupera_e_processa(self):
+        job = self.criar_job()
+        self.travar(job, 60)
+
+        saida = io.StringIO()
+        with self.assertLogs('crm.importacao_jobs', 'WARNING'):
+            call_command('processar_importacoes', stdout=saida)
+
+        self.assertIn('1 devolvida(s) à fila', saida.getvalue())
+        job = ImportacaoJob.objects.get(id=job.id)
+        self.assertEqual((job.status, job.importados, job.tentativas), ('concluido', 5, 2))
+
+
+class AnaliseFunilTests(TestCase):
+    """
+    Tempo no estágio e coortes: o caminho com LAG() e o cálculo em Python
+    chegam ao mesmo resultado, e só entradas com a janela completa contam.
+    """
+
+    CONTA = StatusPipelineChoices.CONTA_PARA_CONTATO.value
+    CONTATO = StatusPipelineChoices.CONTATO_FEITO.value
+    NEGOCIACAO = StatusPipelineChoices.NEGOCIACAO_COTACAO.value
+    ARQUIVADA = StatusPipelineChoices.ARQUIVADA.value
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.vendedor = User.objects.create_user('vendedor', password='senha')
+        # (dias desde a criação, [(dias atrás, status novo), ...])
+        registros = [
+            (80, [(70, cls.CONTATO), (60, cls.NEGOCIACAO), (20, cls.ARQUIVADA)]),
+            (50, [(45, cls.CONTATO)]),
+            (10, [(5, cls.CONTATO)]),  # janelas ainda abertas
+            (100, [(40, cls.CONTATO), (35, cls.NEGOCIACAO)]),  # criado antes do período
+        ]
+        agora = timezone.now()
+        for indice, (criado_ha, transicoes) in enumerate(registros):
+            registro = RegistroComercial.objects.create(
+                nome_empresa=f'Funil {indice}', telefone=f'11 94321-{indice:04d}', vendedor=cls.vendedor,
+            )
+            RegistroComercial.objects.filter(pk=registro.pk).update(criado_em=agora - timedelta(days=criado_ha))
+            status = cls.CONTA
+            for dias_atras, status_novo in transicoes:
+                ContatoHistorico.objects.create(
+                    registro=registro,
+                    usuario=cls.vendedor,
+                    data_contato=agora - timedelta(days=dias_atras),
+                    resultado='Avançou',
+                    status_anterior=status,
+                    status_novo=status_novo,
+                )
+                status = status_novo
+
+    def calcular(self, com_janela):
+        with mock.patch.object(analise_funil, '_suporta_janela', return_value=com_janela):
+            return analise_funil.calcular_analise('trimestre', janela_dias=30)
+
+    def assertResultadoEsperado(self, analise):
+        coortes = {
+            coorte['status']: (coorte['entraram'], coorte['convertidos'], coorte['pendentes'])
+            for coorte in analise['coortes']
+        }
+        self.assertEqual(coortes, {
+            self.CONTA: (2, 2, 1),
+            self.CONTATO: (3, 2, 1),
+            self.NEGOCIACAO: (2, 0, 0),
+            StatusPipelineChoices.PEDIDO_REALIZADO.value: (0, 0, 0),
+        })
+        tempos = {
+            tempo['status']: (tempo['transicoes'], tempo['mediana_dias'])
+            for tempo in analise['tempo_no_estagio']
+        }
+        self.assertEqual(tempos, {self.CONTA: (4, 7.5), self.CONTATO: (2, 7.5), self.NEGOCIACAO: (1, 40.0)})
+
+    def test_com_lag(self):
+        self.assertTrue(analise_funil._suporta_janela())
+        self.assertResultadoEsperado(self.calcular(com_janela=True))
+
+    def test_sem_funcoes_de_janela(self):
+        self.assertResultadoEsperado(self.calcular(com_janela=False))
+
+    def test_os_dois_caminhos_concordam(self):
+        com_lag = self.calcular(com_janela=True)
+        em_python = self.calcular(com_janela=False)
+        for chave in ('coortes', 'tempo_no_estagio'):
+            self.assertEqual(com_lag[chave], em_python[chave])
+
+
+class ContadoresPipelineTests(TestCase):
+    """ContadorPipeline acompanha RegistroComercial em saves, deletes e operações em lote."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.vendedor = User.objects.create_user('vendedor', password='senha')
+        cls.outro = User.objects.create_user('outro', password='senha')
+
+    def setUp(self):
+        self.registros = [
+            RegistroComercial.objects.create(
+                nome_empresa=f'Contador {indice}',
+                telefone=f'11 93210-{indice:04d}',
+                vendedor=self.vendedor,
+                origem='google',
+            )
+            for indice in range(3)
+        ]
+
+    def assertContadoresConsistentes(self):
+        self.assertEqual(contadores.divergencias_contadores(), [])
+
+    def total(self, **filtro):
+        return sum(ContadorPipeline.objects.filter(**filtro).values_list('total', flat=True))
+
+    def test_save_move_o_registro_entre_contadores(self):
+        registro = RegistroComercial.objects.get(pk=self.registros[0].pk)
+        registro.mover_para_kanban()
+        registro.vendedor = self.outro
+        registro.save()
+
+        self.assertContadoresConsistentes()
+        self.assertEqual(self.total(vendedor=self.outro, no_kanban=True), 1)
+        self.assertEqual(self.total(vendedor=self.vendedor, no_kanban=False), 2)
+
+    def test_instancia_parcial_le_a_chave_antiga_do_banco(self):
+        # Campos da chave fora do only(): atribuídos depois do carregamento
+        registro = RegistroComercial.objects.only('id', 'nome_empresa').get(pk=self.registros[0].pk)
+        self.assertIsNone(registro._chave_contador_original)
+        registro.vendedor_id = self.outro.id
+        registro.status_pipeline = StatusPipelineChoices.CONTATO_FEITO.value
+        registro.no_kanban = True
+        registro.origem = 'site'
+        registro.save()
+        self.assertContadoresConsistentes()
+
+        # Só parte da chave carregada: o restante vem da chave gravada
+        registro = RegistroComercial.objects.only('id', 'status_pipeline').get(pk=self.registros[1].pk)
+        registro.status_pipeline = StatusPipelineChoices.ARQUIVADA.value
+        registro.save()
+        self.assertContadoresConsistentes()
+        self.assertEqual(self.total(status_pipeline=StatusPipelineChoices.ARQUIVADA.value), 1)
+
+    def test_save_sem_campos_da_chave_nao_consulta_o_banco(self):
+        registro = RegistroComercial.objects.only('id', 'nome_empresa', 'versao').get(pk=self.registros[0].pk)
+        registro.nome_empresa = 'Renomeada'
+        with mock.patch.object(contadores, 'chave_contador_no_banco') as chave_no_banco:
+            registro.save(update_fields=['nome_empresa'])
+        chave_no_banco.assert_not_called()
+        self.assertContadoresConsistentes()
+
+    def test_delete(self):
+        self.registros[0].delete()
+        RegistroComercial.objects.only('id').get(pk=self.registros[1].pk).delete()
+        self.assertContadoresConsistentes()
+        self.assertEqual(self.total(vendedor=self.vendedor), 1)
+
+        RegistroComercial.objects.all().delete()
+        self.assertContadoresConsistentes()
+        self.assertEqual(self.total(), 0)
+
+    def test_operacoes_em_lote(self):
+        lote = [
+            (indice, {
+                'nome_empresa': f'Lote {indice}',
+                'telefone': f'11 91234-{indice:04d}',
+                'cidade': 'Bauru',
+                'uf': 'SP',
+                'origem': 'instagram',
+                'canal_contato': 'whatsapp',
+                'codigo_winthor': None,
+            })
+            for indice in range(4)
+        ]
+        importacao._gravar_lote(lote, self.outro, 'novo', POLITICA_PULAR)
+        self.assertContadoresConsistentes()
+        self.assertEqual(self.total(vendedor=self.outro, origem='instagram'), 4)
+
+    def test_recalcular_contadores_verificar(self):
+        saida = io.StringIO()
+        call_command('recalcular_contadores', '--verificar', stdout=saida)
+        self.assertIn('Contadores consistentes', saida.getvalue())
+
+        ContadorPipeline.objects.filter(vendedor=self.vendedor).update(total=F('total') + 5)
+        saida = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command('recalcular_contadores', '--verificar', stdout=saida)
+        self.assertIn('contador=8, real=3', saida.getvalue())
+
+        # Sem --verificar reconstrói a partir dos registros
+        call_command('recalcular_contadores', stdout=io.StringIO())
+        self.assertContadoresConsistentes()
+
+
+class IndiceCidadesInvalidacaoTests(TestCase):
+    """O índice de cidades só é invalidado quando um par (cidade, uf) novo é gravado."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.vendedor = User.objects.create_user('vendedor', password='senha')
+        RegistroComercial.objects.create(
+            nome_empresa='Existente', telefone='11 92468-0000', cidade='Campinas', uf='SP', vendedor=cls.vendedor,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def salvar(self, cidade, uf='SP'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return RegistroComercial.objects.create(
+                nome_empresa=f'Nova em {cidade}', telefone='11 92468-1111',
+                cidade=cidade, uf=uf, vendedor=self.vendedor,
+            )
+
+    def assertInvalidou(self, esperado, salvar):
+        versao = cache_utils.versao_namespace(cidades.NAMESPACE_CIDADES)
+        salvar()
+        invalidou = cache_utils.versao_namespace(cidades.NAMESPACE_CIDADES) != versao
+        self.assertEqual(invalidou, esperado)
+
+    def test_sem_indice_carregado_consulta_o_banco(self):
+        with mock.patch.object(cidades, '_indice', None):
+            self.assertInvalidou(False, lambda: self.salvar('Campinas'))
+            self.assertInvalidou(True, lambda: self.salvar('Valinhos'))
+
+    def test_par_alterado_nao_conta_o_proprio_registro(self):
+        registro = self.salvar('Valinhos')
+        registro = RegistroComercial.objects.get(pk=registro.pk)
+        registro.uf = 'MG'
+
+        def salvar_alteracao():
+            with self.captureOnCommitCallbacks(execute=True):
+                registro.save()
+
+        with mock.patch.object(cidades, '_indice', None):
+            self.assertInvalidou(True, salvar_alteracao)
+
+    def test_com_indice_carregado_nao_consulta_o_banco(self):
+        cidades.obter_indice()
+        with self.assertNumQueries(0):
+            cidades.registrar_cidades([('campinas', 'sp')], excluir_ids=[])
+        self.assertInvalidou(True, lambda: self.salvar('Sumaré'))
+
+
+class AcoesLoteTests(TestCase):
+    """Escopo e permissões das ações em lote, deltas de contadores/métricas e histórico."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.comercial = Group.objects.create(name='Comercial')
+        cls.gestor = User.objects.create_superuser('gestor', password='senha')
+        cls.vendedor = User.objects.create_user('vendedor', first_name='Ana', password='senha')
+        cls.outro = User.objects.create_user('outro', first_name='Bruno', password='senha')
+        cls.sem_grupo = User.objects.create_user('financeiro', password='senha')
+        cls.sem_grupo.groups.clear()
+        cls.inativo = User.objects.create_user('inativo', password='senha', is_active=False)
+
+    def setUp(self):
+        cache.clear()
+        self.do_vendedor = [self.criar(self.vendedor, indice) for indice in range(3)]
+        self.do_outro = [self.criar(self.outro, indice) for indice in range(3, 5)]
+
+    def criar(self, vendedor, indice):
+        return RegistroComercial.objects.create(
+            nome_empresa=f'Lote {indice}', telefone=f'11 95678-{indice:04d}',
+            cidade='Piracicaba', uf='SP', vendedor=vendedor, origem='google',
+        )
+
+    def ids(self, registros):
+        return [registro.id for registro in registros]
+
+    def test_vendedor_so_altera_os_proprios_registros(self):
+        resultado = executar_acao_lote(
+            self.vendedor, ACAO_MOVER_PARA_KANBAN, self.ids(self.do_vendedor + self.do_outro)
+        )
+        self.assertEqual((resultado['atualizados'], resultado['ignorados']), (3, 2))
+        self.assertFalse(RegistroComercial.objects.filter(vendedor=self.outro, no_kanban=True).exists())
+
+    def test_acoes_de_gestor_exigem_admin(self):
+        for acao in (ACAO_ARQUIVAR, ACAO_REATRIBUIR):
+            with self.subTest(acao=acao), self.assertRaises(AcaoLoteInvalida) as erro:
+                executar_acao_lote(self.vendedor, acao, self.ids(self.do_vendedor), self.outro.id)
+            self.assertEqual(erro.exception.status, 403)
+
+    def test_reatribuir_exige_vendedor_comercial_ativo(self):
+        for destino in (self.sem_grupo, self.inativo):
+            with self.subTest(destino=destino.username), self.assertRaises(AcaoLoteInvalida):
+                executar_acao_lote(self.gestor, ACAO_REATRIBUIR, self.ids(self.do_vendedor), destino.id)
+        self.assertEqual(RegistroComercial.objects.filter(vendedor=self.vendedor).count(), 3)
+
+    def test_reatribuir_ajusta_contadores_metricas_e_historico(self):
+        # Registros do vendedor consolidados ontem
+        ontem = timezone.localdate() - timedelta(days=1)
+        RegistroComercial.objects.filter(vendedor=self.vendedor).update(
+            atualizado_em=metricas.inicio_do_dia(ontem) + timedelta(hours=12)
+        )
+        metricas.consolidar_intervalo(ontem, ontem)
+        self.assertEqual(MetricaDiaria.objects.get(data=ontem, vendedor=self.vendedor).total, 3)
+
+        resultado = executar_acao_lote(
+            self.gestor, ACAO_REATRIBUIR, self.ids(self.do_vendedor + self.do_outro), self.outro.id
+        )
+
+        # Os do próprio destino são ignorados
+        self.assertEqual((resultado['atualizados'], resultado['ignorados']), (3, 2))
+        self.assertEqual(contadores.divergencias_contadores(), [])
+        self.assertEqual(RegistroComercial.objects.filter(vendedor=self.outro).count(), 5)
+        self.assertEqual(MetricaDiaria.objects.get(data=ontem, vendedor=self.vendedor).total, 0)
+
+        historico = ContatoHistorico.objects.filter(resultado_code='lote_reatribuir')
+        self.assertEqual(sorted(historico.values_list('registro_id', flat=True)), sorted(self.ids(self.do_vendedor)))
+        for evento in historico:
+            self.assertEqual(evento.usuario, self.gestor)
+            self.assertEqual(evento.resultado, 'Reatribuído (ação em lote): Ana → Bruno')
+            self.assertEqual(evento.status_anterior, evento.status_novo)
+
+
+class DescontarConsolidadosTests(TestCase):
+    """descontar_consolidados nunca deixa uma linha de MetricaDiaria negativa."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.vendedor = User.objects.create_user('vendedor', password='senha')
+
+    def test_delta_maior_que_o_total(self):
+        ontem = timezone.localdate() - timedelta(days=1)
+        chave = (
+            metricas.inicio_do_dia(ontem) + timedelta(hours=9),
+            self.vendedor.id, StatusPipelineChoices.CONTA_PARA_CONTATO.value, 'google', 'SP', 'Limeira', False,
+        )
+        MetricaDiaria.objects.create(
+            data=ontem, vendedor=self.vendedor, status_pipeline=chave[2], origem='google',
+            uf='SP', cidade='Limeira', no_kanban=False, total=1,
+        )
+        metricas.descontar_consolidados([chave, chave])
+        self.assertEqual(MetricaDiaria.objects.get(data=ontem).total, 0)
+
+
+class _CanalGravado(eventos_kanban.CanalMemoria):
+    """Canal em memória com um assinante fictício que só guarda os eventos."""
+
+    def __init__(self):
+        super().__init__()
+        self.eventos = []
+
+    def ativo(self):
+        return True
+
+    def publicar(self, evento):
+        self.eventos.append(evento)
+
+
+class EventosKanbanTests(TestCase):
+    """Publicação dos eventos de card (signal de save e ações em lote) e escopo do stream."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.gestor = User.objects.create_superuser('gestor', password='senha')
+        cls.vendedor = User.objects.create_user('vendedor', password='senha')
+        cls.outro = User.objects.create_user('outro', password='senha')
+
+    def setUp(self):
+        cache.clear()
+        self.canal = _CanalGravado()
+        patcher = mock.patch.object(eventos_kanban, '_canal', self.canal)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def criar(self, vendedor, indice, **campos):
+        return RegistroComercial.objects.create(
+            nome_empresa=f'Evento {indice}', telefone=f'11 94567-{indice:04d}',
+            cidade='Limeira', uf='SP', vendedor=vendedor, origem='google', **campos,
+        )
+
+    def test_alteracao_so_no_backlog_nao_publica(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            registro = self.criar(self.vendedor, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            registro.observacoes = 'Ligar depois do almoço'
+            registro.save()
+        self.assertEqual(self.canal.eventos, [])
+
+    def test_entrada_e_saida_do_kanban_publicam(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            registro = self.criar(self.vendedor, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            registro.mover_para_kanban()
+        with self.captureOnCommitCallbacks(execute=True):
+            registro.mover_para_backlog()
+
+        entrada, saida = self.canal.eventos
+        self.assertEqual((entrada['id'], entrada['no_kanban'], entrada['no_kanban_anterior']), (str(registro.pk), True, False))
+        self.assertIn('Evento 1', entrada['html'])
+        self.assertEqual((saida['no_kanban'], saida['no_kanban_anterior'], saida['html']), (False, True, ''))
+        self.assertEqual(saida['versao'], registro.versao)
+
+    def test_canal_sem_assinantes_nao_renderiza(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            registro = self.criar(self.vendedor, 1)
+        with mock.patch.object(_CanalGravado, 'ativo', return_value=False), \
+                mock.patch.object(eventos_kanban, 'evento_card') as evento_card, \
+                self.captureOnCommitCallbacks(execute=True):
+            registro.mover_para_kanban()
+        evento_card.assert_not_called()
+
+    def test_publicar_lote(self):
+        no_backlog = [self.criar(self.vendedor, indice) for indice in range(3)]
+        with self.captureOnCommitCallbacks(execute=True):
+            executar_acao_lote(self.gestor, ACAO_MOVER_PARA_KANBAN, [registro.id for registro in no_backlog])
+
+        self.assertEqual(sorted(evento['id'] for evento in self.canal.eventos), sorted(str(r.id) for r in no_backlog))
+        for evento in self.canal.eventos:
+            self.assertTrue(evento['no_kanban'])
+            self.assertFalse(evento['no_kanban_anterior'])
+            self.assertEqual(evento['vendedores'], [self.vendedor.id])
+            self.assertTrue(evento['html'])
+
+    def test_publicar_lote_ignora_cards_que_ficam_no_backlog(self):
+        no_backlog = [self.criar(self.vendedor, indice) for indice in range(2)]
+        with self.captureOnCommitCallbacks(execute=True):
+            executar_acao_lote(self.gestor, ACAO_ARQUIVAR, [registro.id for registro in no_backlog])
+        self.assertEqual(self.canal.eventos, [])
+
+    def test_visivel_respeita_escopo_do_vendedor(self):
+        evento = {'tipo': 'card', 'vendedores': [self.outro.id]}
+        self.assertFalse(_visivel(evento, self.vendedor, None))
+        # O filtro da URL não amplia o escopo de quem não é gestor
+        self.assertFalse(_visivel(evento, self.vendedor, self.outro.id))
+        self.assertTrue(_visivel(evento, self.outro, None))
+        # Reatribuição: antigo e novo vendedor recebem o evento
+        self.assertTrue(_visivel({'tipo': 'card', 'vendedores': [self.vendedor.id, self.outro.id]}, self.vendedor, None))
+
+    def test_visivel_gestor(self):
+        evento = {'tipo': 'card', 'vendedores': [self.outro.id]}
+        self.assertTrue(_visivel(evento, self.gestor, None))
+        self.assertTrue(_visivel(evento, self.gestor, self.outro.id))
+        self.assertFalse(_visivel(evento, self.gestor, self.vendedor.id))
+        self.assertTrue(_visivel(eventos_kanban.EVENTO_RECARREGAR, self.vendedor, None))
+
+
+class CanalRedisTests(TestCase):
+    """CanalRedis só publica quando há assinantes (PUBSUB NUMSUB) e nunca derruba o save."""
+
+    def setUp(self):
+        self.canal = eventos_kanban.CanalRedis('redis://127.0.0.1:6379/1')
+        self.cliente = mock.Mock()
+        patcher = mock.patch.object(self.canal, '_obter_cliente', return_value=self.cliente)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_ativo_consulta_numsub(self):
+        self.cliente.pubsub_numsub.return_value = [(eventos_kanban.CANAL_REDIS.encode(), 0)]
+        self.assertFalse(self.canal.ativo())
+        # Reaproveitado dentro do intervalo de checagem
+        self.assertFalse(self.canal.ativo())
+        self.assertEqual(self.cliente.pubsub_numsub.call_count, 1)
+
+        self.canal._checado_em = None
+        self.cliente.pubsub_numsub.return_value = [(eventos_kanban.CANAL_REDIS.encode(), 2)]
+        self.assertTrue(self.canal.ativo())
+
+    def test_redis_indisponivel(self):
+        import redis
+
+        self.cliente.pubsub_numsub.side_effect = redis.ConnectionError('recusada')
+        self.cliente.publish.side_effect = redis.TimeoutError('timeout')
+        with self.assertLogs('crm.eventos_kanban', 'WARNING'):
+            self.assertFalse(self.canal.ativo())
+            self.canal.publicar({'tipo': 'card'})
+
+    def test_cliente_com_timeouts(self):
+        canal = eventos_kanban.CanalRedis('redis://127.0.0.1:6379/1')
+        with override_settings(KANBAN_EVENTOS_REDIS_TIMEOUT=0.2):
+            opcoes = canal._obter_cliente().connection_pool.connection_kwargs
+        self.assertEqual((opcoes['socket_timeout'], opcoes['socket_connect_timeout']), (0.2, 0.2))
+
+
+def migracao(nome):
+    """Módulo de uma migração do crm (as funções de dados recebem apps/schema_editor)."""
+    return importlib.import_module(f'crm.migrations.{nome}')
+
+
+class MigracoesDadosTests(TestCase):
+    """Funções RunPython das migrações de dados, aplicadas ao estado atual dos modelos."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.vendedor = User.objects.create_user('vendedor', password='senha')
+        cls.registro = RegistroComercial.objects.create(
+            nome_empresa='Migração', telefone='11 93456-0001', cidade='Limeira', uf='SP',
+            vendedor=cls.vendedor, origem='google',
+        )
+
+    def test_0016_reverso_preserva_observacoes(self):
+        inicio = timezone.now() - timedelta(days=2)
+        com_obs = ContatoHistorico.objects.registrar(
+            registro=self.registro, data_contato=inicio, resultado='Retornar contato',
+            observacoes='Falar com o Carlos', status_novo=self.registro.status_pipeline, usuario=self.vendedor,
+        )
+        sem_obs = ContatoHistorico.objects.registrar(
+            registro=self.registro, data_contato=inicio + timedelta(hours=3), resultado='Sem interesse',
+            status_novo=self.registro.status_pipeline, usuario=self.vendedor,
+        )
+        modulo = migracao('0016_contatohistorico_eventos')
+
+        modulo.juntar_observacoes(apps, None)
+        com_obs.refresh_from_db()
+        sem_obs.refresh_from_db()
+        self.assertEqual(com_obs.resultado, 'Retornar contato\n\nObservações: Falar com o Carlos')
+        self.assertEqual(sem_obs.resultado, 'Sem interesse')
+
+        # Ida e volta: o forward separa de novo o mesmo texto
+        modulo.preencher_eventos(apps, None)
+        com_obs.refresh_from_db()
+        sem_obs.refresh_from_db()
+        self.assertEqual((com_obs.resultado, com_obs.observacoes), ('Retornar contato', 'Falar com o Carlos'))
+        self.assertEqual((sem_obs.resultado, sem_obs.observacoes), ('Sem interesse', ''))
+        self.assertEqual(sem_obs.duracao_desde_anterior, timedelta(hours=3))
+
+    def test_0015_conta_retornos_pelo_texto_antigo(self):
+        textos = [
+            'Responsável não disponível — solicitaram retorno',
+            'Responsável não disponível — solicitaram retorno\n\nObservações: ligar às 14h',
+            # Texto de versões anteriores do label: mesmo critério do icontains antigo
+            'RESPONSÁVEL NÃO DISPONÍVEL, pediu retorno amanhã',
+            'Interessado',
+        ]
+        inicio = timezone.now() - timedelta(days=5)
+        for indice, texto in enumerate(textos):
+            ContatoHistorico.objects.registrar(
+                registro=self.registro, data_contato=inicio + timedelta(days=indice), resultado=texto,
+                status_novo=self.registro.status_pipeline, usuario=self.vendedor,
+            )
+
+        migracao('0015_resultado_code_total_retornos').preencher_resultado_code(apps, None)
+
+        self.registro.refresh_from_db()
+        self.assertEqual(self.registro.total_retornos, 3)
+        codigos = ContatoHistorico.objects.order_by('data_contato').values_list('resultado_code', flat=True)
+        self.assertEqual(list(codigos), [RESULTADO_RETORNO] * 3 + ['interessado'])
+
+
+class BuscaRegistrosTests(TestCase):
+    """buscar_registros / buscar_registros_api: normalização, índice FTS5, LIKE e escopo."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.gestor = User.objects.create_superuser('gestor', password='senha')
+        cls.vendedor = User.objects.create_user('vendedor', password='senha')
+        cls.outro = User.objects.create_user('outro', password='senha')
+        cls.padaria = RegistroComercial.objects.create(
+            nome_empresa='Padaria Estrela', telefone='(19) 98765-4321', cidade='São João da Boa Vista',
+            uf='SP', vendedor=cls.vendedor, origem='google',
+        )
+        cls.mercado = RegistroComercial.objects.create(
+            nome_empresa='Mercado Estrela', telefone='(19) 91234-0000', cidade='Limeira',
+            uf='SP', vendedor=cls.outro, origem='site',
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def buscar(self, consulta, usuario=None, **kwargs):
+        return list(busca.buscar_registros(usuario or self.gestor, consulta, **kwargs))
+
+    def no_indice(self, termo):
+        """Registros que o FTS5 encontra para o termo (sem passar pelo LIKE)."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT r.id FROM {RegistroComercial._meta.db_table} r WHERE r.rowid IN '
+                f'(SELECT rowid FROM {busca.TABELA_FTS} WHERE {busca.TABELA_FTS} MATCH %s)',
+                [f'"{termo}"'],
+            )
+            return {RegistroComercial._meta.pk.to_python(linha[0]) for linha in cursor.fetchall()}
+
+    def test_indice_acompanha_save_e_bulk_update(self):
+        self.assertTrue(busca._indice_fts_disponivel())
+        self.assertEqual(self.no_indice('padaria'), {self.padaria.id})
+
+        self.padaria.nome_empresa = 'Confeitaria Estrela'
+        self.padaria.save()
+        self.assertEqual(self.no_indice('padaria'), set())
+        self.assertEqual(self.no_indice('confeitaria'), {self.padaria.id})
+
+        self.mercado.nome_empresa = 'Supermercado Aurora'
+        self.mercado.atualizar_busca()
+        RegistroComercial.objects.bulk_update([self.mercado], ['nome_empresa', 'busca_normalizada'])
+        self.assertEqual(self.no_indice('aurora'), {self.mercado.id})
+        self.assertEqual(self.buscar('aurora'), [self.mercado])
+
+        self.mercado.delete()
+        self.assertEqual(self.no_indice('aurora'), set())
+
+    def test_sem_acentos_e_maiusculas(self):
+        self.assertEqual(self.buscar('sao joao'), [self.padaria])
+        self.assertEqual(self.buscar('SÃO JOÃO padaria'), [self.padaria])
+
+    def test_telefone(self):
+        self.assertEqual(self.buscar('98765-4321'), [self.padaria])
+        self.assertEqual(self.buscar('(19) 91234'), [self.mercado])
+
+    def test_termos_curtos_usam_like(self):
+        # "bo" tem menos de 3 caracteres: não passa pelo trigram
+        self.assertEqual(self.buscar('joao bo'), [self.padaria])
+        self.assertEqual(self.buscar('li'), [self.mercado])
+        self.assertEqual(self.buscar('x'), [])
+
+    def test_sem_indice_fts_usa_like(self):
+        with mock.patch.object(busca, '_indice_fts_disponivel', return_value=False):
+            self.assertEqual(self.buscar('sao joao'), [self.padaria])
+            self.assertEqual(self.buscar('estrela'), [self.mercado, self.padaria])
+
+    def test_prefixo_do_nome_primeiro(self):
+        self.assertEqual(self.buscar('padaria estrela'), [self.padaria])
+        self.assertEqual(self.buscar('mercado'), [self.mercado])
+
+    def test_vendedor_so_encontra_os_proprios(self):
+        self.assertEqual(self.buscar('estrela', usuario=self.vendedor), [self.padaria])
+        # O filtro de vendedor é ignorado para quem não é gestor
+        self.assertEqual(self.buscar('mercado', usuario=self.vendedor, vendedor_id=self.outro.id), [])
+        self.assertEqual(self.buscar('estrela', vendedor_id=self.outro.id), [self.mercado])
+
+    def test_api_respeita_escopo(self):
+        self.client.force_login(self.vendedor)
+        resposta = self.client.get(reverse('buscar_registros'), {'q': 'estrela', 'vendedor': self.outro.id})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual([item['id'] for item in resposta.json()['resultados']], [str(self.padaria.id)])
+
+        self.client.force_login(self.gestor)
+        resposta = self.client.get(reverse('buscar_registros'), {'q': 'estrela'})
+        self.assertEqual(
+            {item['id'] for item in resposta.json()['resultados']}, {str(self.padaria.id), str(self.mercado.id)}
+        )
+
+    def test_sqlite_sem_trigram_nao_cria_indice(self):
+        editor = mock.Mock(connection=connection)
+        with mock.patch.object(connection.Database, 'sqlite_version_info', (3, 31, 1)):
+            self.assertFalse(busca.trigrama_disponivel(connection))
+            self.assertFalse(busca.criar_indice(editor))
+            migracao('0017_registrocomercial_busca_normalizada').criar_indice_busca(apps, editor)
+            self.assertFalse(busca.garantir_indice())
+        editor.execute.assert_not_called()
+
+
+class AutoArquivamentoRetornosTests(TestCase):
+    """registrar_contato arquiva o registro no LIMITE_RETORNOS-ésimo retorno pedido."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.vendedor = User.objects.create_user('vendedor', password='senha')
+
+    def setUp(self):
+        cache.clear()
+        self.registro = RegistroComercial.objects.create(
+            nome_empresa='Retornos', telefone='11 92345-0001', cidade='Limeira', uf='SP',
+            vendedor=self.vendedor, origem='google', no_kanban=True,
+        )
+        self.client.force_login(self.vendedor)
+
+    def registrar_retorno(self):
+        self.registro.refresh_from_db()
+        return self.client.post(reverse('registrar_contato', args=[self.registro.id]), {
+            'resultado': RESULTADO_RETORNO,
+            'canal_contato': 'whatsapp',
+            'data_retorno': (timezone.localdate() + timedelta(days=1)).isoformat(),
+            'periodo_retorno': 'Manhã',
+            'versao': self.registro.versao,
+        })
+
+    def test_arquiva_no_limite(self):
+        for retorno in range(1, LIMITE_RETORNOS):
+            self.assertRedirects(self.registrar_retorno(), reverse('kanban'), fetch_redirect_response=False)
+            self.registro.refresh_from_db()
+            self.assertEqual(self.registro.total_retornos, retorno)
+            self.assertEqual(self.registro.status_pipeline, StatusPipelineChoices.CONTA_PARA_CONTATO)
+            self.assertTrue(self.registro.no_kanban)
+
+        # O segundo save (arquivamento) usa a versão gravada pelo primeiro: sem ConflitoVersao
+        with self.assertLogs('crm.views', 'INFO'):
+            resposta = self.registrar_retorno()
+        self.assertRedirects(resposta, reverse('kanban'), fetch_redirect_response=False)
+        self.registro.refresh_from_db()
+        self.assertEqual(self.registro.total_retornos, LIMITE_RETORNOS)
+        self.assertEqual(self.registro.status_pipeline, StatusPipelineChoices.ARQUIVADA)
+        self.assertFalse(self.registro.no_kanban)
+
+        historico = self.registro.historico_contatos.order_by('data_contato')
+        self.assertEqual(
+            list(historico.values_list('resultado_code', flat=True)),
+            [RESULTADO_RETORNO] * LIMITE_RETORNOS + ['arquivado_automatico'],
+        )
+        arquivamento = historico.last()
+        self.assertEqual(arquivamento.status_novo, StatusPipelineChoices.ARQUIVADA)
+        self.assertEqual(arquivamento.usuario, self.vendedor)
+        self.assertEqual(contadores.divergencias_contadores(), [])
+
+    def test_versao_desatualizada_nao_conta_retorno(self):
+        self.registro.refresh_from_db()
+        versao = self.registro.versao
+        RegistroComercial.objects.get(pk=self.registro.pk).mover_para_backlog()
+
+        resposta = self.client.post(reverse('registrar_contato', args=[self.registro.id]), {
+            'resultado': RESULTADO_RETORNO,
+            'canal_contato': 'whatsapp',
+            'data_retorno': (timezone.localdate() + timedelta(days=1)).isoformat(),
+            'periodo_retorno': 'Manhã',
+            'versao': versao,
+        })
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn('alterado por outro usuário', resposta.context['error'])
+        self.registro.refresh_from_db()
+        self.assertEqual(self.registro.total_retornos, 0)
+        self.assertFalse(self.registro.historico_contatos.exists())
+
+
+class DesempenhoVendedorEtagTests(TestCase):
+    """GET de desempenho_vendedor_api é condicional (ETag pela versão das estatísticas)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.gestor = User.objects.create_superuser('gestor', password='senha')
+        cls.vendedor = User.objects.create_user('vendedor', password='senha')
+
+    def setUp(self):
+        cache.clear()
+        self.registro = RegistroComercial.objects.create(
+            nome_empresa='Desempenho', telefone='11 91234-5678', cidade='Limeira', uf='SP',
+            vendedor=self.vendedor, origem='google',
+        )
+
+    def consultar(self, usuario=None, etag=None):
+        if usuario is not None:
+            self.client.force_login(usuario)
+        cabecalhos = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(
+            reverse('desempenho_vendedor_api', args=[self.vendedor.id]), {'periodo': 'semana'}, **cabecalhos
+        )
+
+    def test_if_none_match_responde_304(self):
+        primeira = self.consultar(self.vendedor)
+        self.assertEqual(primeira.status_code, 200)
+        self.assertTrue(primeira['ETag'])
+
+        # Só sessão + usuário: nem os registros nem as estatísticas em cache são lidos
+        with self.assertNumQueries(2):
+            segunda = self.consultar(etag=primeira['ETag'])
+        self.assertEqual(segunda.status_code, 304)
+        self.assertEqual(segunda['ETag'], primeira['ETag'])
+
+    def test_salvar_registro_muda_etag(self):
+        for usuario in (self.vendedor, self.gestor):
+            with self.subTest(usuario=usuario.username):
+                etag = self.consultar(usuario)['ETag']
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.registro.proximo_passo = f'Ligar ({usuario.username})'
+                    self.registro.save()
+
+                resposta = self.consultar(etag=etag)
+                self.assertEqual(resposta.status_code, 200)
+                self.assertNotEqual(resposta['ETag'], etag)
+                self.assertEqual(self.consultar(etag=resposta['ETag']).status_code, 304)
+
+
+class FragmentosCardsTests(TestCase):
+    """Cache do HTML dos cards por (template, registro, versao)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.vendedor = User.objects.create_user('vendedor', first_name='Ana', password='senha')
+        for indice in range(4):
+            RegistroComercial.objects.create(
+                nome_empresa=f'Card {indice}', telefone=f'11 93456-{indice:04d}', cidade='Limeira', uf='SP',
+                vendedor=cls.vendedor, origem='google', no_kanban=indice > 0,
+                status_pipeline=StatusPipelineChoices.CONTATO_FEITO if indice > 1 else StatusPipelineChoices.CONTA_PARA_CONTATO,
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def renderizar(self, registros=None):
+        registros = list(RegistroComercial.objects.para_cards()) if registros is None else registros
+        return fragmentos_cards.anexar_html_cards((fragmentos_cards.TEMPLATE_CARD_KANBAN, registros))
+
+    def test_segunda_renderizacao_do_quadro_vem_do_cache(self):
+        self.client.force_login(self.vendedor)
+        renderizados = []
+
+        def anexar(*grupos):
+            renderizados.append(fragmentos_cards.anexar_html_cards(*grupos))
+            return renderizados[-1]
+
+        with mock.patch('crm.views.anexar_html_cards', side_effect=anexar):
+            self.client.get(reverse('kanban'))
+            segunda = self.client.get(reverse('kanban'))
+        self.assertEqual(renderizados, [4, 0])
+        self.assertContains(segunda, 'Card 3')
+
+    def test_save_renderiza_so_o_card_alterado(self):
+        self.assertEqual(self.renderizar(), 4)
+        registro = RegistroComercial.objects.get(nome_empresa='Card 2')
+        registro.nome_empresa = 'Card 2 renomeado'
+        registro.save()
+
+        registros = list(RegistroComercial.objects.para_cards())
+        self.assertEqual(self.renderizar(registros), 1)
+        alterado = next(r for r in registros if r.pk == registro.pk)
+        self.assertIn('Card 2 renomeado', alterado.html_card)
+
+    def test_update_em_lote_com_versao_invalida_o_cache(self):
+        self.assertEqual(self.renderizar(), 4)
+        RegistroComercial.objects.filter(no_kanban=True).update(versao=F('versao') + 1)
+        self.assertEqual(self.renderizar(), 3)
+
+    def test_evento_do_kanban_usa_o_mesmo_cache(self):
+        registro = RegistroComercial.objects.para_cards().get(nome_empresa='Card 3')
+        evento = eventos_kanban.evento_card(registro)
+
+        # O quadro reaproveita o card renderizado para o evento (e vice-versa)
+        registros = list(RegistroComercial.objects.para_cards().filter(pk=registro.pk))
+        self.assertEqual(self.renderizar(registros), 0)
+        self.assertEqual(registros[0].html_card, evento['html'])
+        with mock.patch.object(fragmentos_cards.cache, 'set_many') as set_many:
+            self.assertEqual(eventos_kanban.evento_card(registro)['html'], evento['html'])
+        set_many.assert_not_called()
+
+
+class MatrizTransicaoTests(SimpleTestCase):
+    """A matriz compilada resolve cada (estágio, resultado) como crm.pipeline.rules / resolve_next_stage."""
+
+    def escalar(self, estagio, resultado, checklist):
+        try:
+            return resolve_next_stage(estagio, resultado, checklist)
+        except ValueError:
+            return None
+
+    def test_equivalente_as_regras_para_todos_os_pares(self):
+        estagios = list(PIPELINE_RULES) + ['ARQUIVADO', 'ESTAGIO_INEXISTENTE']
+        resultados = list(matriz.MATRIZ.resultados) + ['resultado_inexistente']
+        linhas = []
+        for estagio in estagios:
+            obrigatorios = PIPELINE_RULES.get(estagio, {}).get('checklist', [])
+            checklists = [{}, {item: True for item in obrigatorios}, dict.fromkeys(obrigatorios[:-1], True)]
+            for resultado in resultados:
+                for checklist in checklists:
+                    linhas.append((estagio, resultado, checklist))
+                    # Mesmo checklist como lista de itens marcados (caminho por máscara)
+                    linhas.append((estagio, resultado, list(checklist)))
+
+        proximos, erros = matriz.resolve_next_stages(linhas)
+        indices, erros_indices = matriz.MATRIZ.resolver_indices(*matriz.MATRIZ.codificar(linhas))
+
+        for (estagio, resultado, checklist), proximo, erro, indice in zip(linhas, proximos, erros, indices):
+            with self.subTest(estagio=estagio, resultado=resultado, checklist=checklist):
+                marcados = checklist if isinstance(checklist, dict) else dict.fromkeys(checklist, True)
+                esperado = self.escalar(estagio, resultado, marcados)
+                self.assertEqual(proximo, esperado)
+                self.assertEqual(matriz.MATRIZ.estagios[indice] if indice >= 0 else None, esperado)
+                self.assertEqual(erro == matriz.ERRO_NENHUM, esperado is not None)
+                regras = PIPELINE_RULES.get(estagio, {}).get('results', {})
+                if esperado is not None:
+                    self.assertEqual(esperado, regras[resultado])
+                elif estagio not in PIPELINE_RULES:
+                    self.assertEqual(erro, matriz.ERRO_ESTAGIO_INVALIDO)
+                elif resultado not in regras:
+                    self.assertEqual(erro, matriz.ERRO_RESULTADO_INVALIDO)
+                else:
+                    self.assertEqual(erro, matriz.ERRO_CHECKLIST_INCOMPLETO)
+        self.assertEqual(erros_indices, erros)
+
+
+class ConfigFunilCacheTests(TestCase):
+    """Configurações do funil em cache, invalidadas (após o commit) a cada save/delete."""
+
+    COLUNA = StatusPipelineChoices.CONTA_PARA_CONTATO.value
+
+    def setUp(self):
+        cache.clear()
+
+    def test_consulta_sem_configuracao_fica_em_cache(self):
+        with self.assertNumQueries(1):
+            passos = obter_proximos_passos_config('coluna_sem_passos', 'novo')
+        self.assertEqual(passos, [])
+        with self.assertNumQueries(0):
+            self.assertEqual(obter_proximos_passos_config('coluna_sem_passos', 'novo'), [])
+
+        with self.assertNumQueries(1):
+            fallback = obter_resultados_config(self.COLUNA, 'novo')
+        with self.assertNumQueries(0):
+            self.assertEqual(obter_resultados_config(self.COLUNA, 'novo'), fallback)
+
+    def test_save_e_delete_de_resultado_invalidam(self):
+        fallback = obter_resultados_config(self.COLUNA, 'novo')
+        with self.captureOnCommitCallbacks(execute=True):
+            config = FunilResultadoConfig.objects.create(
+                coluna_pipeline=self.COLUNA, status_cliente='novo', key='nao_atendeu', label='Caixa postal',
+            )
+        self.assertEqual([r['label'] for r in obter_resultados_config(self.COLUNA, 'novo')], ['Caixa postal'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            config.label = 'Não atendeu (caixa postal)'
+            config.save()
+        self.assertEqual(
+            [r['label'] for r in obter_resultados_config(self.COLUNA, 'novo')], ['Não atendeu (caixa postal)']
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            config.delete()
+        self.assertEqual(obter_resultados_config(self.COLUNA, 'novo'), fallback)
+
+    def test_save_de_proximo_passo_invalida(self):
+        self.assertEqual(obter_proximos_passos_config('coluna_sem_passos', 'novo'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            passo = FunilProximoPassoConfig.objects.create(
+                coluna_pipeline='coluna_sem_passos', status_cliente='novo', label='Enviar catálogo',
+            )
+        self.assertEqual(obter_proximos_passos_config('coluna_sem_passos', 'novo'), ['Enviar catálogo'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            passo.delete()
+        self.assertEqual(obter_proximos_passos_config('coluna_sem_passos', 'novo'), [])
+
+
+class GruposUsuarioCacheTests(TestCase):
+    """grupos_usuario em cache, invalidado por alterações em user.groups e em Group."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.comercial = Group.objects.create(name='Comercial')
+        cls.admin = Group.objects.create(name='Admin')
+        cls.usuario = User.objects.create_user('vendedor', password='senha')
+        cls.colega = User.objects.create_user('colega', password='senha')
+
+    def setUp(self):
+        cache.clear()
+
+    def grupos(self, usuario=None):
+        # Instância nova a cada leitura: grupos_usuario memoiza no próprio objeto
+        return grupos_usuario(User.objects.get(pk=(usuario or self.usuario).pk))
+
+    def test_segunda_leitura_vem_do_cache(self):
+        self.assertEqual(self.grupos(), {'Comercial'})
+        usuario = User.objects.get(pk=self.usuario.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(grupos_usuario(usuario), {'Comercial'})
+
+    def test_m2m_pelo_usuario(self):
+        self.assertFalse(is_admin(User.objects.get(pk=self.usuario.pk)))
+        self.usuario.groups.add(self.admin)
+        self.assertTrue(is_admin(User.objects.get(pk=self.usuario.pk)))
+
+        self.usuario.groups.remove(self.admin)
+        self.assertEqual(self.grupos(), {'Comercial'})
+
+        self.usuario.groups.clear()
+        self.assertFalse(is_comercial(User.objects.get(pk=self.usuario.pk)))
+
+    def test_m2m_pelo_grupo(self):
+        self.assertEqual(self.grupos(self.colega), {'Comercial'})
+        self.admin.user_set.add(self.usuario, self.colega)
+        self.assertEqual(self.grupos(), {'Comercial', 'Admin'})
+        self.assertEqual(self.grupos(self.colega), {'Comercial', 'Admin'})
+
+        self.comercial.user_set.clear()
+        self.assertEqual(self.grupos(), {'Admin'})
+        self.assertEqual(self.grupos(self.colega), {'Admin'})
+
+    def test_grupo_renomeado_ou_excluido(self):
+        self.usuario.groups.add(self.admin)
+        self.assertEqual(self.grupos(), {'Comercial', 'Admin'})
+
+        self.admin.name = 'Gestores'
+        self.admin.save()
+        self.assertEqual(self.grupos(), {'Comercial', 'Gestores'})
+
+        self.admin.delete()
+        self.assertEqual(self.grupos(), {'Comercial'})
+        self.assertEqual(self.grupos(self.colega), {'Comercial'})
+
+
+class TabelaFunilTests(TestCase):
+    """regra_funil: tabela compilada reaproveitada até a versão do namespace 'funil' mudar."""
+
+    COLUNA = StatusPipelineChoices.CONTA_PARA_CONTATO.value
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.vendedor = User.objects.create_user('vendedor', password='senha')
+
+    def setUp(self):
+        cache.clear()
+
+    def labels(self, db_status=None):
+        return [result['label'] for result in tabela_funil.regra_funil(db_status or self.COLUNA, 'novo').results]
+
+    def test_recompila_quando_a_versao_muda(self):
+        padrao = self.labels()
+        with mock.patch.object(tabela_funil, 'compilar_tabela', wraps=tabela_funil.compilar_tabela) as compilar:
+            with self.assertNumQueries(0):
+                self.assertEqual(self.labels(), padrao)
+            compilar.assert_not_called()
+
+            with self.captureOnCommitCallbacks(execute=True):
+                FunilResultadoConfig.objects.create(
+                    coluna_pipeline=self.COLUNA, status_cliente='novo', key='nao_atendeu', label='Caixa postal',
+                )
+            self.assertEqual(self.labels(), ['Caixa postal'])
+            self.assertEqual(compilar.call_count, 1)
+
+            invalidar_cache_funil()
+            self.labels()
+            self.assertEqual(compilar.call_count, 2)
+
+    def test_conflito_de_versao_reexibe_o_formulario_do_estagio_atual(self):
+        registro = RegistroComercial.objects.create(
+            nome_empresa='Conflito', telefone='11 91111-2222', cidade='Limeira', uf='SP',
+            vendedor=self.vendedor, origem='google', no_kanban=True,
+        )
+        chamadas = []
+
+        def regra_com_edicao_concorrente(*args):
+            if not chamadas:
+                # Outro usuário avança o registro depois de a view carregá-lo
+                RegistroComercial.objects.filter(pk=registro.pk).update(
+                    status_pipeline=StatusPipelineChoices.CONTATO_FEITO, versao=F('versao') + 1,
+                )
+            chamadas.append(args)
+            return tabela_funil.regra_funil(*args)
+
+        self.client.force_login(self.vendedor)
+        with mock.patch('crm.views.regra_funil', side_effect=regra_com_edicao_concorrente):
+            resposta = self.client.post(reverse('registrar_contato', args=[registro.id]), {
+                'resultado': RESULTADO_RETORNO,
+                'canal_contato': 'whatsapp',
+                'data_retorno': (timezone.localdate() + timedelta(days=1)).isoformat(),
+                'periodo_retorno': 'Manhã',
+                'versao': registro.versao,
+            })
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn('alterado por outro usuário', resposta.context['error'])
+        atual = tabela_funil.regra_funil(StatusPipelineChoices.CONTATO_FEITO.value, registro.status_cliente)
+        self.assertEqual(resposta.context['results_json'], atual.results_json)
+        self.assertEqual(resposta.context['checklist_json'], atual.checklist_json)
+        self.assertNotEqual(atual.results_json, tabela_funil.regra_funil(self.COLUNA, registro.status_cliente).results_json)
+
+
+class InstrumentacaoTests(TestCase):
+    """Middleware de instrumentação: Server-Timing, buffer circular e resumo p50/p95."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.create(name='Comercial')
+        cls.vendedor = User.objects.create_user('vendedor', password='senha')
+
+    def setUp(self):
+        cache.clear()
+        # Buffer e Template.render instrumentado são globais do processo
+        for patcher in (
+            mock.patch.object(instrumentacao, '_amostras', deque(maxlen=instrumentacao.TAMANHO_BUFFER_PADRAO)),
+            mock.patch.object(instrumentacao, '_template_instrumentado', False),
+            mock.patch.object(Template, 'render', Template.render),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client.force_login(self.vendedor)
+
+    def get_kanban(self):
+        with self.assertLogs('crm.instrumentacao', 'INFO') as logs:
+            resposta = self.client.get(reverse('kanban'))
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn('view=kanban metodo=GET status=200', logs.output[0])
+        return resposta
+
+    def test_desativada_sai_da_cadeia(self):
+        resposta = self.client.get(reverse('kanban'))
+        self.assertNotIn('Server-Timing', resposta)
+        self.assertEqual(instrumentacao.total_amostras(), 0)
+
+    @override_settings(CRM_INSTRUMENTACAO=True)
+    def test_server_timing_com_consultas(self):
+        resposta = self.get_kanban()
+        consultas = int(re.search(r'sql;dur=[\d.]+;desc="(\d+) consultas"', resposta['Server-Timing']).group(1))
+        self.assertGreater(consultas, 0)
+        self.assertRegex(resposta['Server-Timing'], r'tpl;dur=[\d.]+;desc="templates", total;dur=[\d.]+')
+
+        medicao = instrumentacao._amostras[-1]
+        self.assertEqual((medicao.view, medicao.sql), ('kanban', consultas))
+        self.assertGreater(medicao.template_ms, 0)
+
+    @override_settings(CRM_INSTRUMENTACAO=True, CRM_INSTRUMENTACAO_AMOSTRAS=3)
+    def test_buffer_limitado(self):
+        for _ in range(5):
+            self.get_kanban()
+        self.assertEqual(instrumentacao.total_amostras(), 3)
+        self.assertEqual(instrumentacao._amostras.maxlen, 3)
+
+    def test_resumo_por_view(self):
+        instrumentacao._amostras.extend(
+            instrumentacao.Medicao(view='kanban', total_ms=float(ms), sql=3, sql_ms=1.0, template_ms=2.0)
+            for ms in range(21)
+        )
+        instrumentacao._amostras.append(instrumentacao.Medicao(view='login', total_ms=50.0, sql=1))
+
+        login, kanban = instrumentacao.resumo_por_view()
+        self.assertEqual((login['view'], login['requisicoes'], login['p50_ms'], login['p95_ms']), ('login', 1, 50.0, 50.0))
+        self.assertEqual((kanban['view'], kanban['requisicoes']), ('kanban', 21))
+        self.assertEqual((kanban['p50_ms'], kanban['p95_ms']), (10.0, 19.0))
+        self.assertEqual((kanban['sql_medio'], kanban['sql_p95'], kanban['sql_ms_p95']), (3.0, 3.0, 1.0))
@@ -2,6 +2,7 @@ from django.urls import path
 from django.contrib.auth import views as auth_views
 from . import views
 from . import views_config
+from . import views_eventos
 
 urlpatterns = [
     path('login/', auth_views.LoginView.as_view(template_name='registration/login.html'), name='login'),
@@ -10,15 +11,23 @@ urlpatterns = [
     path('criar-registro/', views.criar_registro, name='criar_registro'),
     path('mover-kanban/<uuid:registro_id>/', views.mover_para_kanban, name='mover_para_kanban'),
     path('mover-backlog/<uuid:registro_id>/', views.mover_para_backlog, name='mover_para_backlog'),
+    path('api/acao-em-lote/', views.acao_em_lote_api, name='acao_em_lote'),
+    path('api/kanban/eventos/', views_eventos.eventos_kanban_stream, name='eventos_kanban'),
     path('atualizar-status/<uuid:registro_id>/', views.atualizar_status, name='atualizar_status'),
     path('registrar-contato/<uuid:registro_id>/', views.registrar_contato, name='registrar_contato'),
     path('registrar-contato-htmx/<uuid:registro_id>/', views.registrar_contato_htmx, name='registrar_contato_htmx'),
     path('metricas/', views.metricas_view, name='metricas'),
+    path('metricas/funil/', views.analise_funil_view, name='analise_funil'),
+    path('api/metricas/funil/', views.analise_funil_api, name='analise_funil_api'),
+    path('admin/desempenho-requisicoes/', views.desempenho_requisicoes_view, name='desempenho_requisicoes'),
     path('meu-desempenho/', views.meu_desempenho, name='meu_desempenho'),
     path('importar-csv/', views.importar_csv_view, name='importar_csv'),
+    path('api/importacao/<uuid:job_id>/progresso/', views.progresso_importacao_api, name='progresso_importacao'),
     path('gestao-usuarios/', views.gestao_usuarios, name='gestao_usuarios'),
     path('api/desempenho-vendedor/<int:vendedor_id>/', views.desempenho_vendedor_api, name='desempenho_vendedor_api'),
     path('api/carregar-mais-registros/', views.carregar_mais_registros_api, name='carregar_mais_registros'),
+    path('api/busca/', views.buscar_registros_api, name='buscar_registros'),
+    path('api/cidades/', views.autocomplete_cidades_api, name='autocomplete_cidades'),
     
     # Configuração do funil (admin only)
     path('admin/configuracao-funil/', views_config.configuracao_funil, name='configuracao_funil'),
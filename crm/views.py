@@ -1,28 +1,54 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.http import require_POST
 from django.views.decorators.cache import cache_page
-from django.db.models import Count, Q
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
 from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.urls import reverse
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.core.cache import cache
+from django.conf import settings
 from .models import (
     RegistroComercial,
     ContatoHistorico,
     StatusPipelineChoices,
     OrigemChoices,
     CanalContatoChoices,
+    ImportacaoJob,
+    ConflitoVersao,
 )
-from .decorators import comercial_required, admin_required, api_login_required, api_comercial_required
+from .decorators import comercial_required, admin_required, api_login_required, api_comercial_required, is_admin
+from .acoes_lote import AcaoLoteInvalida, executar_acao_lote
+from .busca import buscar_registros
+from .cidades import cidade_canonica, sugerir_cidades
+from .analise_funil import JANELA_PADRAO, JANELAS_CONVERSAO, PERIODO_PADRAO, PERIODOS_ANALISE, analise_funil
+from .contadores import contagens_kanban
+from .deduplicacao import POLITICA_PULAR, POLITICAS_DUPLICADOS, POLITICAS_VALIDAS, localizar_duplicado
+from .importacao_jobs import criar_job, progresso_job
+from .instrumentacao import resumo_por_view, total_amostras
+from .fragmentos_cards import TEMPLATE_CARD_BACKLOG, TEMPLATE_CARD_KANBAN, TEMPLATE_CARD_LISTA, anexar_html_cards
+from .estatisticas import contagens_metricas, etag_estatisticas, resumo_pipeline, top_cidades
+from .metricas import inicio_do_dia
+from .tabela_funil import regra_funil
+from .kanban_utils import carregar_quadro_kanban, pagina_por_cursor, cursor_apos, anotar_chave_cursor, CursorInvalido
 import csv
+import logging
+import uuid
 import json
+from collections import Counter
 
 # Pipeline module (event-driven, automatic transitions)
-from crm.pipeline import resolve_next_stage, checklist_completo
-from crm.pipeline.rules import PIPELINE_RULES, RESULT_LABELS, CHECKLIST_LABELS, RESULTADO_POR_STATUS_CLIENTE
+from crm.pipeline import resolve_next_stage
+from crm.pipeline.rules import RESULT_LABELS
+
+
+logger = logging.getLogger(__name__)
 
 
 # Mapeamento de status: banco → chaves de PIPELINE_RULES (tradutor canônico)
@@ -178,6 +204,11 @@ STAGE_CONFIG = {
 }
 
 
+# Auto-arquivamento: contatos "responsável indisponível" até arquivar o lead
+RESULTADO_RETORNO = 'responsavel_indisponivel'
+LIMITE_RETORNOS = 2
+
+
 def allowed_transitions(status_key: str):
     return STAGE_CONFIG.get(status_key, {}).get('allowed_to', [])
 
@@ -191,48 +222,39 @@ def kanban_view(request):
     vendedor_filter = request.GET.get('vendedor')
     if user.is_superuser:
         if vendedor_filter and vendedor_filter != 'todos':
-            all_registros = RegistroComercial.objects.filter(vendedor_id=vendedor_filter)
+            all_registros = RegistroComercial.objects.para_cards().filter(vendedor_id=vendedor_filter)
+            vendedor_contagem = vendedor_filter
         else:
-            all_registros = RegistroComercial.objects.all()
+            all_registros = RegistroComercial.objects.para_cards()
+            vendedor_contagem = None
     else:
-        all_registros = RegistroComercial.objects.filter(vendedor=user)
+        all_registros = RegistroComercial.objects.para_cards().filter(vendedor=user)
         vendedor_filter = None  # Vendedores não têm acesso ao filtro
-    
-    # Backlog: apenas primeiros 10 registros (paginado depois)
-    backlog = all_registros.filter(no_kanban=False).order_by('-criado_em')[:10]
-    backlog_count = all_registros.filter(no_kanban=False).count()
-    
-    # Kanban: registros ativos (exclui Arquivado e Conta Ativa) - primeiros 8 por status
-    kanban_all = all_registros.filter(no_kanban=True).exclude(
-        status_pipeline__in=[
-            StatusPipelineChoices.ARQUIVADA.value,
-            StatusPipelineChoices.CONTA_ATIVA.value,
-        ]
-    ).order_by('status_pipeline', '-atualizado_em')
-    
-    # Paginação por status: 8 itens por status inicial
-    kanban_by_status = {}
-    kanban_counts = {}
-    for status_key, _ in KANBAN_STATUSES:
-        registros_status = all_registros.filter(
-            no_kanban=True,
-            status_pipeline=status_key
-        )
-        
-        # Ordenação especial para "Conta para Contato"
-        if status_key == StatusPipelineChoices.CONTA_PARA_CONTATO.value:
-            # Registros com data_retorno vêm primeiro, ordenados por data (ASC)
-            # Registros sem data_retorno vêm depois
-            from django.db.models import F
-            registros_status = registros_status.order_by(
-                F('data_retorno').asc(nulls_last=True),
-                '-atualizado_em'
-            )
-        else:
-            registros_status = registros_status.order_by('-atualizado_em')
-        
-        kanban_counts[status_key] = registros_status.count()
-        kanban_by_status[status_key] = registros_status[:8]
+        vendedor_contagem = user.id
+    
+    # Backlog: apenas primeiros 10 registros (paginado depois por cursor)
+    backlog = list(all_registros.filter(no_kanban=False).order_by('-criado_em', '-id')[:10])
+    cursores_iniciais = {'backlog': cursor_apos('backlog', backlog[-1])} if backlog else {}
+    
+    # Kanban: contagens (ContadorPipeline) + primeiros 8 cards por status
+    # (exclui Arquivado e Conta Ativa, que não estão em KANBAN_STATUSES)
+    kanban_status_keys = [status_key for status_key, _ in KANBAN_STATUSES]
+    kanban_by_status, kanban_counts, backlog_count = carregar_quadro_kanban(
+        all_registros,
+        kanban_status_keys,
+        cards_por_coluna=8,
+        contagens=contagens_kanban(kanban_status_keys, vendedor_id=vendedor_contagem),
+    )
+    # Cursor de cada coluna a partir do último card desenhado ("Carregar Mais" continua dali)
+    cursores_iniciais.update(
+        (status_key, cursor_apos(status_key, cards[-1]))
+        for status_key, cards in kanban_by_status.items() if cards
+    )
+    # HTML dos cards: uma leitura no cache para o quadro todo, só os alterados são renderizados
+    anexar_html_cards(
+        (TEMPLATE_CARD_BACKLOG, backlog),
+        (TEMPLATE_CARD_KANBAN, [registro for cards in kanban_by_status.values() for registro in cards]),
+    )
     
     flash_success = request.session.pop('flash_success', None)
     flash_error = request.session.pop('flash_error', None)
@@ -253,14 +275,9 @@ def kanban_view(request):
         'flash_error': flash_error,
         'vendedores': vendedores,
         'vendedor_filter': vendedor_filter,
+        'cursores_iniciais': cursores_iniciais,
     }
     
-    # DEBUG: Log do context para verificação
-    import sys
-    print(f"[KANBAN_CONTEXT] kanban_by_status keys: {kanban_by_status.keys()}", file=sys.stderr)
-    for key, regs in kanban_by_status.items():
-        print(f"[KANBAN_CONTEXT] {key}: {regs.count()} registros", file=sys.stderr)
-    
     return render(request, 'crm/kanban.html', context)
 
 
@@ -270,25 +287,26 @@ def criar_registro(request):
     """Cria um novo registro comercial via formulário."""
     if request.method == 'POST':
         try:
-            print("\n==== CRIAR REGISTRO - INICIANDO ====")
             # Extrai dados do POST
             nome = request.POST.get('nome_empresa', '').strip()
             telefone = request.POST.get('telefone', '').strip()
-            cidade = request.POST.get('cidade', '').strip()
             uf = request.POST.get('uf', '').strip().upper()
+            # Mesma grafia das cidades já cadastradas (ex.: "sao paulo" -> "São Paulo")
+            cidade = cidade_canonica(request.POST.get('cidade', '').strip(), uf)
             origem = request.POST.get('origem', OrigemChoices.OUTROS)
             canal_contato = request.POST.get('canal_contato', CanalContatoChoices.WHATSAPP)
             status_cliente = request.POST.get('status_cliente', 'novo').strip()
             codigo_winthor = request.POST.get('codigo_winthor', '').strip()
             
-            print(f"Dados recebidos: nome={nome}, telefone={telefone}, cidade={cidade}, uf={uf}")
-            print(f"origem={origem}, canal={canal_contato}, status={status_cliente}, winthor={codigo_winthor}")
-            print(f"User: {request.user}, is_authenticated: {request.user.is_authenticated}")
+            logger.debug(
+                "[CRIAR_REGISTRO] usuario=%s nome=%s cidade=%s uf=%s origem=%s canal=%s status=%s winthor=%s",
+                request.user.id, nome, cidade, uf, origem, canal_contato, status_cliente, codigo_winthor,
+            )
             
             # Validar dados obrigatórios
             if not nome or not telefone or not cidade or not uf:
                 error_msg = 'Nome, telefone, cidade e UF são obrigatórios'
-                print(f"ERRO: Validação falhou - {error_msg}")
+                logger.info("[CRIAR_REGISTRO] Validação falhou: %s", error_msg)
                 if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                     return JsonResponse({'error': error_msg}, status=400)
                 # Retornar para kanban com mensagem de erro (será exibida pelo JavaScript)
@@ -297,20 +315,37 @@ def criar_registro(request):
             # Validar status_cliente
             valid_status = ['novo', 'ativo', 'inativo']
             if status_cliente not in valid_status:
-                print(f"Status do cliente inválido: {status_cliente}, usando 'novo'")
+                logger.debug("[CRIAR_REGISTRO] Status do cliente inválido: %s, usando 'novo'", status_cliente)
                 status_cliente = 'novo'
             
             # Validar origem
             if origem not in dict(OrigemChoices.choices):
-                print(f"Origem inválida: {origem}, usando OUTROS")
+                logger.debug("[CRIAR_REGISTRO] Origem inválida: %s, usando OUTROS", origem)
                 origem = OrigemChoices.OUTROS
             
             # Validar canal de contato
             if canal_contato not in dict(CanalContatoChoices.choices):
-                print(f"Canal inválido: {canal_contato}, usando WHATSAPP")
+                logger.debug("[CRIAR_REGISTRO] Canal inválido: %s, usando WHATSAPP", canal_contato)
                 canal_contato = CanalContatoChoices.WHATSAPP
             
-            print("Tentando criar registro...")
+            # Evitar duplicados (telefone normalizado ou código Winthor)
+            duplicado = localizar_duplicado(telefone, codigo_winthor or None)
+            if duplicado:
+                # Lead de outro vendedor: bloqueia sem revelar nome/estágio/id
+                if duplicado.vendedor_id == request.user.id or is_admin(request.user):
+                    error_msg = (
+                        f'Já existe um registro com este telefone/código Winthor: '
+                        f'{duplicado.nome_empresa} ({duplicado.get_status_pipeline_display()})'
+                    )
+                    detalhes = {'registro_existente_id': str(duplicado.id)}
+                else:
+                    error_msg = 'Já existe um registro de outro vendedor com este telefone/código Winthor.'
+                    detalhes = {}
+                if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                    return JsonResponse({'error': error_msg, **detalhes}, status=409)
+                messages.warning(request, error_msg)
+                return redirect('kanban')
+            
             # Cria o registro
             registro = RegistroComercial.objects.create(
                 nome_empresa=nome,
@@ -331,14 +366,7 @@ def criar_registro(request):
             return redirect('kanban')
         
         except Exception as e:
-            # LOGGING DO ERRO PARA DEBUG
-            import traceback
-            print(f"\n\n==== ERRO AO CRIAR REGISTRO ====")
-            print(f"ERRO: {e}")
-            print(f"TIPO: {type(e)}")
-            print("TRACEBACK:")
-            traceback.print_exc()
-            print("=" * 50)
+            logger.exception("[CRIAR_REGISTRO] Erro ao criar registro")
             
             error_msg = f'Erro ao criar registro: {str(e)}'
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -348,6 +376,14 @@ def criar_registro(request):
     return JsonResponse({'error': 'Método não permitido'}, status=405)
 
 
+def resposta_conflito(request, erro):
+    """Resposta para ConflitoVersao: 409 em AJAX, flash de erro no Kanban."""
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({'error': str(erro), 'conflito': True}, status=409)
+    request.session['flash_error'] = str(erro)
+    return redirect('kanban')
+
+
 @login_required
 @require_POST
 def mover_para_kanban(request, registro_id):
@@ -358,11 +394,15 @@ def mover_para_kanban(request, registro_id):
     if not request.user.is_superuser and registro.vendedor != request.user:
         return JsonResponse({'error': 'Sem permissão'}, status=403)
     
-    registro.no_kanban = True
-    registro.save()
+    registro.esperar_versao(request.POST.get('versao'))
+    try:
+        with transaction.atomic():
+            registro.mover_para_kanban()
+    except ConflitoVersao as e:
+        return resposta_conflito(request, e)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return JsonResponse({'success': True})
+        return JsonResponse({'success': True, 'versao': registro.versao})
     return redirect('kanban')
 
 
@@ -376,13 +416,58 @@ def mover_para_backlog(request, registro_id):
     if not request.user.is_superuser and registro.vendedor != request.user:
         return JsonResponse({'error': 'Sem permissão'}, status=403)
     
-    registro.mover_para_backlog()
+    registro.esperar_versao(request.POST.get('versao'))
+    try:
+        with transaction.atomic():
+            registro.mover_para_backlog()
+    except ConflitoVersao as e:
+        return resposta_conflito(request, e)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return JsonResponse({'success': True})
+        return JsonResponse({'success': True, 'versao': registro.versao})
     return redirect('kanban')
 
 
+@api_comercial_required
+@require_POST
+def acao_em_lote_api(request):
+    """
+    Aplica uma ação a vários registros de uma vez.
+
+    Aceita JSON {"acao": ..., "ids": [...], "vendedor_id": ...} ou formulário
+    (acao, ids repetido, vendedor_id). Ações em crm/acoes_lote.py.
+    """
+    if request.content_type == 'application/json':
+        try:
+            dados = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': 'JSON inválido'}, status=400)
+        if not isinstance(dados, dict):
+            return JsonResponse({'error': 'JSON inválido'}, status=400)
+        acao = dados.get('acao')
+        ids_brutos = dados.get('ids') or []
+        vendedor_id = dados.get('vendedor_id')
+    else:
+        acao = request.POST.get('acao')
+        ids_brutos = request.POST.getlist('ids')
+        vendedor_id = request.POST.get('vendedor_id')
+
+    if not isinstance(ids_brutos, list):
+        return JsonResponse({'error': 'ids deve ser uma lista'}, status=400)
+    try:
+        ids = [uuid.UUID(str(registro_id)) for registro_id in ids_brutos]
+        vendedor_id = int(vendedor_id) if vendedor_id not in (None, '') else None
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Identificador inválido'}, status=400)
+
+    try:
+        resultado = executar_acao_lote(request.user, acao, ids, novo_vendedor_id=vendedor_id)
+    except AcaoLoteInvalida as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+
+    return JsonResponse({'success': True, **resultado})
+
+
 @login_required
 @require_POST
 def atualizar_status(request, registro_id):
@@ -393,6 +478,11 @@ def atualizar_status(request, registro_id):
     if not request.user.is_superuser and registro.vendedor != request.user:
         return JsonResponse({'error': 'Sem permissão'}, status=403)
     
+    try:
+        registro.verificar_versao(request.POST.get('versao'))
+    except ConflitoVersao as e:
+        return resposta_conflito(request, e)
+    
     novo_status = request.POST.get('novo_status')
 
     if novo_status not in dict(StatusPipelineChoices.choices):
@@ -417,40 +507,23 @@ def registrar_contato(request, registro_id):
     if not request.user.is_superuser and registro.vendedor != request.user:
         return redirect('kanban')
     
-    # Buscar regras do pipeline para o estágio atual
+    # Regras do estágio atual já compiladas (resultados, checklist, próximos
+    # passos e JSON do template) - ver crm/tabela_funil.py
     raw_status = registro.status_pipeline
-    current_stage = STATUS_PIPELINE_MAP.get(raw_status)
-    pipeline_rules = PIPELINE_RULES.get(current_stage, {})
-    
-    # ✅ FORMATO FINAL: Array de {key, label, next_status_label} (Opção A canônica)
-    # Usar configurações do banco com fallback para hardcoded
-    from .funil_config_utils import obter_resultados_config, obter_proximos_passos_config
-    
-    if current_stage == 'CONTA_PARA_CONTATO':
-        # Carregar da config (com fallback)
-        results = obter_resultados_config(raw_status, registro.status_cliente)
-    else:
-        # Para outros estágios, usar opções do pipeline normal
-        valid_resultado_keys = list(pipeline_rules.get('results', {}).keys())
-        
-        results = []
-        for k in valid_resultado_keys:
-            next_stage = pipeline_rules.get('results', {}).get(k, current_stage)
-            
-            # Converter estágio do pipeline para valor do banco antes de pegar label
-            db_next_stage = PIPELINE_TO_DB_MAP.get(next_stage, next_stage)
-            next_stage_label = dict(StatusPipelineChoices.choices).get(db_next_stage, db_next_stage)
-            
-            results.append({
-                "key": k,
-                "label": RESULT_LABELS.get(k, k),
-                "next_status_label": next_stage_label
-            })
-    
-    checklist = [
-        [item, CHECKLIST_LABELS.get(item, item)]
-        for item in pipeline_rules.get('checklist', [])
-    ]
+    regra = regra_funil(raw_status, registro.status_cliente)
+    current_stage = regra.stage
+    
+    def renderizar_formulario(error=None):
+        context = {
+            'registro': registro,
+            'canal_choices': CanalContatoChoices.choices,
+            'results_json': regra.results_json,
+            'checklist_json': regra.checklist_json,
+            'next_steps': regra.next_steps,
+        }
+        if error:
+            context['error'] = error
+        return render(request, 'crm/registrar_contato.html', context)
 
     if request.method == 'POST':
         resultado_code = request.POST.get('resultado', '').strip()
@@ -463,48 +536,17 @@ def registrar_contato(request, registro_id):
 
         # Validar canal
         if canal_contato not in dict(CanalContatoChoices.choices):
-            return render(request, 'crm/registrar_contato.html', {
-                'registro': registro,
-                'error': 'Canal de contato inválido.',
-                'canal_choices': CanalContatoChoices.choices,
-                'results_json': json.dumps(results),
-                'checklist_json': json.dumps(checklist),
-            })
+            return renderizar_formulario('Canal de contato inválido.')
         
         # Validar resultado obrigatório
         if not resultado_code:
-            return render(request, 'crm/registrar_contato.html', {
-                'registro': registro,
-                'error': 'Selecione um resultado.',
-                'canal_choices': CanalContatoChoices.choices,
-                'results_json': json.dumps(results),
-                'checklist_json': json.dumps(checklist),
-            })
+            return renderizar_formulario('Selecione um resultado.')
 
         # Validar resultado no ENUM do estágio (com suporte a status_cliente)
-        if current_stage == 'CONTA_PARA_CONTATO':
-            # Para "Conta para Contato", validar apenas contra as opções do status_cliente
-            valid_resultado_keys = RESULTADO_POR_STATUS_CLIENTE.get(registro.status_cliente, 
-                                                                   RESULTADO_POR_STATUS_CLIENTE.get('novo', []))
-            if resultado_code not in valid_resultado_keys:
-                return render(request, 'crm/registrar_contato.html', {
-                    'registro': registro,
-                    'error': f'Resultado inválido para cliente {registro.status_cliente}.',
-                    'canal_choices': CanalContatoChoices.choices,
-                    'results_json': json.dumps(results),
-                    'checklist_json': json.dumps(checklist),
-                })
-        else:
-            # Para outros estágios, usar validação normal
-            valid_results = pipeline_rules.get('results', {})
-            if resultado_code not in valid_results:
-                return render(request, 'crm/registrar_contato.html', {
-                    'registro': registro,
-                    'error': 'Resultado inválido para este estágio.',
-                    'canal_choices': CanalContatoChoices.choices,
-                    'results_json': json.dumps(results),
-                    'checklist_json': json.dumps(checklist),
-                })
+        if resultado_code not in regra.resultados_validos:
+            if current_stage == 'CONTA_PARA_CONTATO':
+                return renderizar_formulario(f'Resultado inválido para cliente {registro.status_cliente}.')
+            return renderizar_formulario('Resultado inválido para este estágio.')
 
         # Converter checklist para dict {item: True}
         checklist_dict = {item: True for item in checklist_itens}
@@ -513,13 +555,7 @@ def registrar_contato(request, registro_id):
         try:
             next_stage = resolve_next_stage(current_stage, resultado_code, checklist_dict)
         except ValueError as e:
-            return render(request, 'crm/registrar_contato.html', {
-                'registro': registro,
-                'error': str(e),
-                'canal_choices': CanalContatoChoices.choices,
-                'results_json': json.dumps(results),
-                'checklist_json': json.dumps(checklist),
-            })
+            return renderizar_formulario(str(e))
 
         status_anterior = registro.status_pipeline
 
@@ -531,31 +567,18 @@ def registrar_contato(request, registro_id):
         
         # Se resultado for "responsavel_indisponivel" OU proximo_passo contiver "Retornar contato"
         if resultado_code == 'responsavel_indisponivel' or 'Retornar contato' in proximo_passo:
-            print(f"DEBUG: Processando retorno - data_retorno_str={data_retorno_str}, periodo={periodo_retorno}")
+            logger.debug(
+                "[REGISTRAR_CONTATO] Retorno: registro=%s data=%s periodo=%s",
+                registro.id, data_retorno_str, periodo_retorno,
+            )
             
             # Data é obrigatória
             if not data_retorno_str:
-                print("DEBUG: Data vazia - erro")
-                return render(request, 'crm/registrar_contato.html', {
-                    'registro': registro,
-                    'error': 'Data de retorno é obrigatória quando responsável está indisponível.',
-                    'canal_choices': CanalContatoChoices.choices,
-                    'results_json': json.dumps(results),
-                    'checklist_json': json.dumps(checklist),
-                    'next_steps': next_steps,
-                })
+                return renderizar_formulario('Data de retorno é obrigatória quando responsável está indisponível.')
             
             # Período é obrigatório
             if not periodo_retorno:
-                print("DEBUG: Período vazio - erro")
-                return render(request, 'crm/registrar_contato.html', {
-                    'registro': registro,
-                    'error': 'Período de retorno é obrigatório (Manhã ou Tarde).',
-                    'canal_choices': CanalContatoChoices.choices,
-                    'results_json': json.dumps(results),
-                    'checklist_json': json.dumps(checklist),
-                    'next_steps': next_steps,
-                })
+                return renderizar_formulario('Período de retorno é obrigatório (Manhã ou Tarde).')
             
             from datetime import datetime
             try:
@@ -563,25 +586,14 @@ def registrar_contato(request, registro_id):
                 data_retorno = datetime.strptime(data_retorno_str, '%Y-%m-%d')
                 # Tornar timezone-aware
                 data_retorno = timezone.make_aware(data_retorno)
-                print(f"DEBUG: Data parseada com sucesso: {data_retorno}")
-            except ValueError as e:
-                print(f"DEBUG: Erro ao parsear data: {e}")
-                return render(request, 'crm/registrar_contato.html', {
-                    'registro': registro,
-                    'error': f'Data de retorno inválida: {data_retorno_str}',
-                    'canal_choices': CanalContatoChoices.choices,
-                    'results_json': json.dumps(results),
-                    'checklist_json': json.dumps(checklist),
-                    'next_steps': next_steps,
-                })
+            except ValueError:
+                return renderizar_formulario(f'Data de retorno inválida: {data_retorno_str}')
             
             # Definir proximo_passo com período
             proximo_passo = f"Retornar contato (data combinada) - {periodo_retorno}"
-            print(f"DEBUG: proximo_passo definido como: {proximo_passo}")
         else:
             # Não é retorno agendado - limpar data_retorno
             data_retorno = None
-            print(f"DEBUG: Não é retorno, limpando data_retorno")
 
         # Atualizar registro
         registro.ultimo_contato = timezone.now()
@@ -591,74 +603,71 @@ def registrar_contato(request, registro_id):
         registro.status_pipeline = db_next_stage
         registro.data_retorno = data_retorno
         
-        print(f"SAVE: resultado={resultado_code} | data={data_retorno} | passo={proximo_passo}")
+        logger.debug(
+            "[REGISTRAR_CONTATO] registro=%s resultado=%s data_retorno=%s proximo_passo=%s",
+            registro.id, resultado_code, data_retorno, proximo_passo,
+        )
 
         # Arquivar se necessário
         if db_next_stage == StatusPipelineChoices.ARQUIVADA.value:
             registro.no_kanban = False
 
-        registro.save()
+        # Contador de retornos incrementado no mesmo UPDATE (sem ler o histórico)
+        if resultado_code == RESULTADO_RETORNO:
+            registro.total_retornos = F('total_retornos') + 1
 
-        # Registrar histórico
-        # Formato: "Resultado: X" + observações se fornecidas
-        resultado_texto = RESULT_LABELS.get(resultado_code, resultado_code)
-        if observacoes:
-            resultado_com_obs = f"{resultado_texto}\n\nObservações: {observacoes}"
-        else:
-            resultado_com_obs = resultado_texto
-        
-        ContatoHistorico.objects.create(
-            registro=registro,
-            data_contato=registro.ultimo_contato,
-            resultado=resultado_com_obs,
-            status_anterior=status_anterior,
-            status_novo=registro.status_pipeline,
-            usuario=request.user,
-            canal_contato=canal_contato,
-            checklist_itens=checklist_itens,
-        )
-
-        # ✅ Auto-arquivar após 2 "responsavel_indisponivel"
-        if resultado_code == 'responsavel_indisponivel':
-            # Contar ocorrências de "responsavel_indisponivel" (procura pelo padrão no resultado salvo)
-            retornos = ContatoHistorico.objects.filter(
-                registro=registro,
-                resultado__icontains='Responsável não disponível'
-            ).count()
-            
-            print(f"Retornos: {retornos}")
-            if retornos >= 2:
-                print(f"🔴 ARQUIVANDO")
-                registro.status_pipeline = StatusPipelineChoices.ARQUIVADA.value
-                registro.no_kanban = False
+        registro.esperar_versao(request.POST.get('versao'))
+        try:
+            with transaction.atomic():
                 registro.save()
-                ContatoHistorico.objects.create(
+                if resultado_code == RESULTADO_RETORNO:
+                    registro.refresh_from_db(fields=['total_retornos'])
+
+                # Registrar histórico (label do resultado + observações em colunas separadas)
+                ContatoHistorico.objects.registrar(
                     registro=registro,
-                    data_contato=timezone.now(),
-                    resultado='arquivado_automatico',
+                    data_contato=registro.ultimo_contato,
+                    resultado=RESULT_LABELS.get(resultado_code, resultado_code),
+                    resultado_code=resultado_code,
+                    observacoes=observacoes,
                     status_anterior=status_anterior,
-                    status_novo=StatusPipelineChoices.ARQUIVADA.value,
+                    status_novo=registro.status_pipeline,
                     usuario=request.user,
                     canal_contato=canal_contato,
-                    checklist_itens=[],
+                    checklist_itens=checklist_itens,
                 )
 
+                # ✅ Auto-arquivar após LIMITE_RETORNOS "responsavel_indisponivel"
+                if resultado_code == RESULTADO_RETORNO:
+                    if registro.total_retornos >= LIMITE_RETORNOS:
+                        logger.info(
+                            "[REGISTRAR_CONTATO] registro=%s arquivado após %s retornos",
+                            registro.id, registro.total_retornos,
+                        )
+                        registro.status_pipeline = StatusPipelineChoices.ARQUIVADA.value
+                        registro.no_kanban = False
+                        registro.save()
+                        ContatoHistorico.objects.registrar(
+                            registro=registro,
+                            data_contato=timezone.now(),
+                            resultado='arquivado_automatico',
+                            resultado_code='arquivado_automatico',
+                            status_anterior=status_anterior,
+                            status_novo=StatusPipelineChoices.ARQUIVADA.value,
+                            usuario=request.user,
+                            canal_contato=canal_contato,
+                            checklist_itens=[],
+                        )
+        except ConflitoVersao as e:
+            # Formulário com o estado atual: o outro usuário pode ter mudado o estágio
+            registro.refresh_from_db()
+            regra = regra_funil(registro.status_pipeline, registro.status_cliente)
+            return renderizar_formulario(str(e))
+
         return redirect('kanban')
 
     # GET request - renderizar formulário
-    # Buscar next_steps do estágio atual (STAGE_CONFIG)
-    stage_config = STAGE_CONFIG.get(raw_status, {})
-    next_steps = stage_config.get('next_steps', [])
-    
-    context = {
-        'registro': registro,
-        'canal_choices': CanalContatoChoices.choices,
-        'results_json': json.dumps(results),
-        'checklist_json': json.dumps(checklist),
-        'next_steps': next_steps,
-    }
-
-    return render(request, 'crm/registrar_contato.html', context)
+    return renderizar_formulario()
 
 
 @login_required
@@ -768,18 +777,27 @@ def registrar_contato_htmx(request, registro_id):
         if novo_status == StatusPipelineChoices.ARQUIVADA.value:
             registro.no_kanban = False
 
-        registro.save()
-
-        ContatoHistorico.objects.create(
-            registro=registro,
-            data_contato=registro.ultimo_contato,
-            resultado=resultado,
-            status_anterior=status_anterior,
-            status_novo=registro.status_pipeline,
-            usuario=request.user,
-            canal_contato=canal_contato,
-            checklist_itens=checklist_itens,
-        )
+        registro.esperar_versao(request.POST.get('versao'))
+        try:
+            with transaction.atomic():
+                registro.save()
+
+                ContatoHistorico.objects.registrar(
+                    registro=registro,
+                    data_contato=registro.ultimo_contato,
+                    resultado=resultado,
+                    resultado_code=resultado if resultado in RESULT_LABELS else '',
+                    status_anterior=status_anterior,
+                    status_novo=registro.status_pipeline,
+                    usuario=request.user,
+                    canal_contato=canal_contato,
+                    checklist_itens=checklist_itens,
+                )
+        except ConflitoVersao as e:
+            return HttpResponse(
+                f'<div class="bg-red-100 border border-red-400 text-red-700 px-4 py-3 rounded mb-4">{e}</div>',
+                status=409
+            )
 
         card_html = render_to_string('crm/_card.html', {'registro': registro})
         response = HttpResponse(card_html)
@@ -800,7 +818,7 @@ def registrar_contato_htmx(request, registro_id):
 @login_required(login_url='login')
 def metricas_view(request):
     """View de métricas - apenas ADMIN."""
-    if not (request.user.is_superuser or request.user.groups.filter(name='Admin').exists()):
+    if not is_admin(request.user):
         return redirect('login')
     user = request.user
     
@@ -826,48 +844,48 @@ def metricas_view(request):
         data_inicio = today
 
     # Filtrar por vendedor ou todos (se gestor)
-    if user.is_superuser or user.groups.filter(name='Admin').exists():
-        base_registros = RegistroComercial.objects.all()
-        contatos = ContatoHistorico.objects.all()
-
+    if is_admin(user):
+        vendedor_id = None
         if vendedor_filter and vendedor_filter != 'todos':
-            base_registros = base_registros.filter(vendedor_id=vendedor_filter)
-            contatos = contatos.filter(usuario_id=vendedor_filter)
+            vendedor_id = vendedor_filter
 
         vendedores = User.objects.filter(groups__name='Comercial').distinct().order_by('first_name', 'username')
     else:
-        base_registros = RegistroComercial.objects.filter(vendedor=user)
-        contatos = ContatoHistorico.objects.filter(usuario=user)
+        vendedor_id = user.id
         vendedores = []
     
-    # Filtrar por período (considerando atualizado_em dos registros - atividade)
-    base_registros = base_registros.filter(atualizado_em__date__gte=data_inicio)
-    
-    # Métricas apenas de trabalho ativo (no_kanban=True OU status especial: Conta Ativa ou Arquivada)
-    registros = base_registros.filter(
-        Q(no_kanban=True) | 
-        Q(status_pipeline=StatusPipelineChoices.CONTA_ATIVA.value) |
-        Q(status_pipeline=StatusPipelineChoices.ARQUIVADA.value)
-    )
-    
-    # FILTROS AVANÇADOS
-    if origem_filter and origem_filter != '':
-        registros = registros.filter(origem=origem_filter)
-    
-    if status_filter and status_filter != '':
-        registros = registros.filter(status_pipeline=status_filter)
-    
-    # Backlog (aguardando entrada no Kanban)
-    backlog_count = base_registros.filter(no_kanban=False).exclude(
-        status_pipeline__in=[StatusPipelineChoices.CONTA_ATIVA.value, StatusPipelineChoices.ARQUIVADA.value]
-    ).count()
+    # Contagens do período (atualizado_em a partir de data_inicio):
+    # dias fechados vêm de MetricaDiaria, o restante ao vivo (crm/metricas.py), com cache
+    contagens = contagens_metricas(data_inicio, vendedor_id=vendedor_id)
+    
+    status_especiais = (StatusPipelineChoices.CONTA_ATIVA.value, StatusPipelineChoices.ARQUIVADA.value)
+    backlog_count = 0
+    por_status = Counter()
+    por_origem = Counter()
+    por_cidade = Counter()
+    for (status_pipeline, origem, uf, cidade, no_kanban), total in contagens.items():
+        # Backlog (aguardando entrada no Kanban)
+        if not no_kanban and status_pipeline not in status_especiais:
+            backlog_count += total
+            continue
+        
+        # Métricas apenas de trabalho ativo (no_kanban=True OU status especial: Conta Ativa ou Arquivada)
+        # FILTROS AVANÇADOS
+        if origem_filter and origem != origem_filter:
+            continue
+        if status_filter and status_pipeline != status_filter:
+            continue
+        
+        por_status[status_pipeline] += total
+        por_origem[origem] += total
+        por_cidade[(cidade, uf)] += total
     
     # Métricas por status (pipeline)
     metricas_status = {}
     for status_enum, status_label in PIPELINE_SEQUENCE:
-        metricas_status[status_label] = registros.filter(status_pipeline=status_enum.value).count()
+        metricas_status[status_label] = por_status[status_enum.value]
     
-    total_leads = registros.count()
+    total_leads = sum(por_status.values())
     conta_para_contato = metricas_status.get(StatusPipelineChoices.CONTA_PARA_CONTATO.label, 0)
     contatos_realizados = metricas_status.get(StatusPipelineChoices.CONTATO_FEITO.label, 0)
     negociacoes = metricas_status.get(StatusPipelineChoices.NEGOCIACAO_COTACAO.label, 0)
@@ -875,7 +893,10 @@ def metricas_view(request):
     contas_ativas = metricas_status.get(StatusPipelineChoices.CONTA_ATIVA.label, 0)
 
     # Cidades e Estados onde estamos trabalhando - COM PAGINAÇÃO
-    cidades_estados_all = registros.values('cidade', 'uf').annotate(count=Count('id')).order_by('-count')
+    cidades_estados_all = [
+        {'cidade': cidade, 'uf': uf, 'count': count}
+        for (cidade, uf), count in sorted(por_cidade.items(), key=lambda item: (-item[1], item[0]))
+    ]
     
     paginator = Paginator(cidades_estados_all, 20)  # 20 cidades por página
     page = request.GET.get('cidades_page')
@@ -890,7 +911,7 @@ def metricas_view(request):
     # Origem dos contatos
     origem_stats = []
     for origem_key, origem_label in OrigemChoices.choices:
-        count = registros.filter(origem=origem_key).count()
+        count = por_origem[origem_key]
         if count > 0:
             origem_stats.append((origem_key, origem_label, count))
     origem_stats.sort(key=lambda x: x[2], reverse=True)
@@ -915,12 +936,71 @@ def metricas_view(request):
         'status_choices': StatusPipelineChoices.choices,  # Novo
         'origem_choices': OrigemChoices.choices,  # Novo
         'periodo': periodo,
-        'is_admin_user': user.is_superuser or user.groups.filter(name='Admin').exists(),
+        'is_admin_user': is_admin(user),
     }
     
     return render(request, 'crm/metricas.html', context)
 
 
+def _parametros_analise(request):
+    """Período, vendedor e janela de conversão da análise do funil (GET)."""
+    periodo = request.GET.get('periodo', PERIODO_PADRAO)
+    if periodo not in PERIODOS_ANALISE:
+        periodo = PERIODO_PADRAO
+
+    vendedor_id = request.GET.get('vendedor')
+    vendedor_id = int(vendedor_id) if vendedor_id and vendedor_id.isdigit() else None
+
+    try:
+        janela = int(request.GET.get('janela', JANELA_PADRAO))
+    except ValueError:
+        janela = JANELA_PADRAO
+    if janela not in JANELAS_CONVERSAO:
+        janela = JANELA_PADRAO
+    return periodo, vendedor_id, janela
+
+
+@admin_required
+def analise_funil_view(request):
+    """Tempo em cada estágio e conversão por coorte - apenas ADMIN."""
+    periodo, vendedor_id, janela = _parametros_analise(request)
+    analise = analise_funil(periodo, vendedor_id, janela)
+
+    context = {
+        'analise': analise,
+        'periodo': periodo,
+        'periodos': PERIODOS_ANALISE,
+        'janela': janela,
+        'janelas': JANELAS_CONVERSAO,
+        'vendedor_filter': vendedor_id,
+        'vendedores': User.objects.filter(groups__name='Comercial').distinct().order_by('first_name', 'username'),
+        'is_admin_user': True,
+    }
+    return render(request, 'crm/analise_funil.html', context)
+
+
+@admin_required
+def desempenho_requisicoes_view(request):
+    """p50/p95 de tempo e consultas por view (instrumentação em memória) - apenas ADMIN."""
+    context = {
+        'instrumentacao_ativa': getattr(settings, 'CRM_INSTRUMENTACAO', False),
+        'resumo': resumo_por_view(),
+        'total_amostras': total_amostras(),
+        'tamanho_buffer': getattr(settings, 'CRM_INSTRUMENTACAO_AMOSTRAS', 0),
+        'is_admin_user': True,
+    }
+    return render(request, 'crm/desempenho_requisicoes.html', context)
+
+
+@api_login_required
+def analise_funil_api(request):
+    """JSON da análise do funil (mesmos parâmetros da página)."""
+    if not is_admin(request.user):
+        return JsonResponse({'error': 'Sem permissão'}, status=403)
+    periodo, vendedor_id, janela = _parametros_analise(request)
+    return JsonResponse(analise_funil(periodo, vendedor_id, janela))
+
+
 @admin_required
 @admin_required
 def gestao_usuarios(request):
@@ -956,17 +1036,15 @@ def meu_desempenho(request):
     """Dashboard de desempenho personalizado do vendedor."""
     user = request.user
     
-    # Buscar registros do vendedor
-    registros = RegistroComercial.objects.filter(vendedor=user)
-    base_registros = registros
-    
-    # Métricas principais
-    total_leads = registros.count()
-    contatos_realizados = registros.filter(status_pipeline=StatusPipelineChoices.CONTATO_FEITO.value).count()
-    negociacoes = registros.filter(status_pipeline=StatusPipelineChoices.NEGOCIACAO_COTACAO.value).count()
-    pedidos = registros.filter(status_pipeline=StatusPipelineChoices.PEDIDO_REALIZADO.value).count()
-    contas_ativas = registros.filter(status_pipeline=StatusPipelineChoices.CONTA_ATIVA.value).count()
-    conta_para_contato = registros.filter(status_pipeline=StatusPipelineChoices.CONTA_PARA_CONTATO.value).count()
+    # Métricas principais (lidas de ContadorPipeline: uma consulta, com cache)
+    resumo = resumo_pipeline(user.id)
+    por_status = resumo['por_status']
+    total_leads = resumo['total']
+    contatos_realizados = por_status.get(StatusPipelineChoices.CONTATO_FEITO.value, 0)
+    negociacoes = por_status.get(StatusPipelineChoices.NEGOCIACAO_COTACAO.value, 0)
+    pedidos = por_status.get(StatusPipelineChoices.PEDIDO_REALIZADO.value, 0)
+    contas_ativas = por_status.get(StatusPipelineChoices.CONTA_ATIVA.value, 0)
+    conta_para_contato = por_status.get(StatusPipelineChoices.CONTA_PARA_CONTATO.value, 0)
     
     taxa_contato = round((contatos_realizados / total_leads * 100) if total_leads > 0 else 0)
     taxa_negociacao = round((negociacoes / contatos_realizados * 100) if contatos_realizados > 0 else 0)
@@ -982,24 +1060,17 @@ def meu_desempenho(request):
     # Origem dos leads
     origem_stats = []
     for origem_key, origem_label in OrigemChoices.choices:
-        count = registros.filter(origem=origem_key).count()
+        count = resumo['por_origem'].get(origem_key, 0)
         if count > 0:
             origem_stats.append((origem_label, count))
     
     origem_stats.sort(key=lambda x: x[1], reverse=True)
     
-    # Backlog (aguardando entrada no Kanban)
-    backlog_count = base_registros.filter(no_kanban=False).exclude(
-        status_pipeline__in=[
-            StatusPipelineChoices.CONTA_ATIVA.value,
-            StatusPipelineChoices.ARQUIVADA.value,
-        ]
-    ).count()
+    # Backlog (aguardando entrada no Kanban, exceto Conta Ativa e Arquivada)
+    backlog_count = resumo['backlog']
 
     # Cidades e Estados trabalhados (top 10)
-    cidades_estados = list(
-        base_registros.values('cidade', 'uf').annotate(count=Count('id')).order_by('-count')[:10]
-    )
+    cidades_estados = top_cidades(user.id, limite=10)
 
     hoje = timezone.now()
     
@@ -1041,12 +1112,17 @@ def importar_csv_view(request):
         if status_cliente_global not in valid_status:
             status_cliente_global = 'novo'
         
+        politica_duplicados = request.POST.get('politica_duplicados', POLITICA_PULAR)
+        if politica_duplicados not in POLITICAS_VALIDAS:
+            politica_duplicados = POLITICA_PULAR
+        
         # SEGURANÇA: Validar tamanho do arquivo (máximo 5MB)
         if excel_file.size > 5 * 1024 * 1024:
             context = {
                 'error': 'Arquivo muito grande. Máximo 5MB.',
                 'origem_choices': OrigemChoices.choices,
                 'canal_choices': CanalContatoChoices.choices,
+                'politicas_duplicados': POLITICAS_DUPLICADOS,
             }
             return render(request, 'crm/importar_csv.html', context)
         
@@ -1056,6 +1132,7 @@ def importar_csv_view(request):
                 'error': 'Arquivo deve ter extensão .xlsx ou .xls',
                 'origem_choices': OrigemChoices.choices,
                 'canal_choices': CanalContatoChoices.choices,
+                'politicas_duplicados': POLITICAS_DUPLICADOS,
             }
             return render(request, 'crm/importar_csv.html', context)
         
@@ -1070,103 +1147,85 @@ def importar_csv_view(request):
                 'error': 'Tipo de arquivo inválido. Envie um arquivo Excel válido (.xlsx ou .xls).',
                 'origem_choices': OrigemChoices.choices,
                 'canal_choices': CanalContatoChoices.choices,
+                'politicas_duplicados': POLITICAS_DUPLICADOS,
             }
             return render(request, 'crm/importar_csv.html', context)
         
         try:
-            import openpyxl
-            
-            # Ler arquivo Excel
-            workbook = openpyxl.load_workbook(excel_file)
-            sheet = workbook.active
-            
-            # Pegar cabeçalhos (primeira linha)
-            headers = [cell.value for cell in sheet[1]]
-            
-            importados = 0
-            erros = []
-            
-            # Processar linhas (pular cabeçalho)
-            for row_idx, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
-                try:
-                    # Criar dict com dados da linha
-                    row_data = dict(zip(headers, row))
-                    
-                    # Validar campos obrigatórios
-                    if not all([row_data.get('nome_empresa'), row_data.get('telefone'), 
-                               row_data.get('cidade'), row_data.get('uf'), 
-                               row_data.get('origem'), row_data.get('canal_contato')]):
-                        erros.append(f"Linha {row_idx}: dados faltando")
-                        continue
-                    
-                    canal_contato = row_data.get('canal_contato', CanalContatoChoices.WHATSAPP)
-                    if canal_contato not in dict(CanalContatoChoices.choices):
-                        erros.append(f"Linha {row_idx}: canal inválido '{canal_contato}'")
-                        continue
-
-                    # Criar registro com status_cliente global
-                    RegistroComercial.objects.create(
-                        nome_empresa=row_data['nome_empresa'],
-                        telefone=str(row_data['telefone']),
-                        cidade=row_data['cidade'],
-                        uf=str(row_data['uf']),
-                        origem=row_data['origem'],
-                        canal_contato=canal_contato,
-                        status_cliente=status_cliente_global,
-                        codigo_winthor=row_data.get('codigo_winthor', ''),
-                        vendedor=request.user,
-                        status_pipeline=StatusPipelineChoices.CONTA_PARA_CONTATO.value
-                    )
-                    importados += 1
-                    
-                except Exception as e:
-                    erros.append(f"Linha {row_idx}: {str(e)}")
-            
-            context = {
-                'importados': importados,
-                'erros': erros,
-                'status_aplicado': status_cliente_global,
-                'origem_choices': OrigemChoices.choices,
-                'canal_choices': CanalContatoChoices.choices,
-            }
-            
-            return render(request, 'crm/importar_csv.html', context)
-            
+            # Processamento em segundo plano (crm/importacao_jobs.py);
+            # a página acompanha o progresso via API de polling
+            job = criar_job(
+                excel_file,
+                vendedor=request.user,
+                status_cliente=status_cliente_global,
+                politica_duplicados=politica_duplicados,
+            )
         except Exception as e:
             context = {
                 'error': f'Erro ao processar arquivo: {str(e)}',
                 'origem_choices': OrigemChoices.choices,
                 'canal_choices': CanalContatoChoices.choices,
+                'politicas_duplicados': POLITICAS_DUPLICADOS,
             }
             return render(request, 'crm/importar_csv.html', context)
+        
+        return redirect(f"{reverse('importar_csv')}?job={job.id}")
+    
+    job = None
+    job_id = request.GET.get('job')
+    if job_id:
+        try:
+            job = ImportacaoJob.objects.filter(id=uuid.UUID(job_id), vendedor=request.user).first()
+        except ValueError:
+            job = None
     
     context = {
+        'job': job,
         'origem_choices': OrigemChoices.choices,
         'canal_choices': CanalContatoChoices.choices,
+        'politicas_duplicados': POLITICAS_DUPLICADOS,
     }
     return render(request, 'crm/importar_csv.html', context)
 
 
+@api_login_required
+def progresso_importacao_api(request, job_id):
+    """API de polling do progresso de uma importação (linhas, erros, ETA)."""
+    jobs = ImportacaoJob.objects.filter(id=job_id)
+    if not request.user.is_superuser:
+        jobs = jobs.filter(vendedor=request.user)
+    
+    job = jobs.first()
+    if job is None:
+        return JsonResponse({'error': 'Importação não encontrada'}, status=404)
+    
+    return JsonResponse(progresso_job(job))
+
+
+def _cabecalhos_etag(response, etag):
+    """ETag + Cache-Control das respostas GET (200 e 304) da API de desempenho."""
+    response['ETag'] = etag
+    # Dados por usuário: só no cache do navegador, sempre revalidado
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 @api_login_required
 def desempenho_vendedor_api(request, vendedor_id):
-    """API endpoint para buscar desempenho de um vendedor específico ou de todos."""
-    from django.contrib.auth.models import User
-    from django.utils import timezone
+    """
+    API endpoint para buscar desempenho de um vendedor específico ou de todos.
+
+    GET (?periodo=dia|semana|mes) responde com ETag derivado da versão das
+    estatísticas do vendedor e devolve 304 para If-None-Match sem consultar
+    os registros. POST com {"periodo": ...} no corpo é mantido por compatibilidade.
+    """
     from datetime import timedelta
     import json
-    import logging
-    
-    logger = logging.getLogger(__name__)
-    logger.info(f"[DESEMPENHO_API] Requisição recebida - Method: {request.method}")
-    logger.info(f"[DESEMPENHO_API] User ID: {request.user.id} (tipo: {type(request.user.id).__name__})")
-    logger.info(f"[DESEMPENHO_API] Vendedor ID: {vendedor_id} (tipo: {type(vendedor_id).__name__})")
-    logger.info(f"[DESEMPENHO_API] Is superuser: {request.user.is_superuser}")
-    logger.info(f"[DESEMPENHO_API] Comparação: {request.user.id} == {vendedor_id} = {request.user.id == vendedor_id}")
     
     # Verificar método HTTP
-    if request.method != 'POST':
+    if request.method not in ('GET', 'POST'):
         logger.warning(f"[DESEMPENHO_API] Método inválido: {request.method}")
-        return JsonResponse({'error': f'Método {request.method} não permitido. Use POST.'}, status=405)
+        return JsonResponse({'error': f'Método {request.method} não permitido. Use GET ou POST.'}, status=405)
     
     # SEGURANÇA: Verificar se o usuário tem permissão de acessar estes dados
     if not request.user.is_superuser and request.user.id != vendedor_id:
@@ -1181,16 +1240,18 @@ def desempenho_vendedor_api(request, vendedor_id):
         # Se não é admin, retornar apenas dados do próprio usuário
         if request.user.is_superuser:
             # Admin vê dados de todos
-            registros_query = RegistroComercial.objects.all()
+            filtro_vendedor = None
             vendedor_nome = "Todos os Vendedores"
         else:
             # Vendedor vê apenas seus próprios dados
-            registros_query = RegistroComercial.objects.filter(vendedor=request.user)
+            filtro_vendedor = request.user.id
             vendedor_nome = request.user.get_full_name() or request.user.username
         
         # Obter período do filtro
         periodo = 'dia'  # padrão
-        if request.body:
+        if request.method == 'GET':
+            periodo = request.GET.get('periodo', 'dia')
+        elif request.body:
             try:
                 data = json.loads(request.body)
                 periodo = data.get('periodo', 'dia')
@@ -1198,44 +1259,44 @@ def desempenho_vendedor_api(request, vendedor_id):
                 pass
         
         # Calcular data de início baseado no período
-        hoje = timezone.now().date()  # Apenas a data, sem hora
+        hoje = timezone.localdate()  # Data local (mesma base de criado_em__date)
         
-        if periodo == 'dia':
-            # Filtra por registros de HOJE (mesma data, independente hora)
-            registros = registros_query.filter(
-                criado_em__date=hoje
-            ).distinct()
-        elif periodo == 'semana':
+        if periodo == 'semana':
             # Início da semana (segunda-feira) até agora
-            inicio_semana = hoje - timedelta(days=hoje.weekday())
-            registros = registros_query.filter(
-                criado_em__date__gte=inicio_semana
-            ).distinct()
+            data_inicio = hoje - timedelta(days=hoje.weekday())
         elif periodo == 'mes':
             # Início do mês até agora
-            inicio_mes = hoje.replace(day=1)
-            registros = registros_query.filter(
-                criado_em__date__gte=inicio_mes
-            ).distinct()
+            data_inicio = hoje.replace(day=1)
         else:
-            # Default: dia
-            registros = registros_query.filter(
-                criado_em__date=hoje
-            ).distinct()
+            # Default: dia (registros de HOJE)
+            periodo = 'dia'
+            data_inicio = hoje
+        
+        # ETag: muda quando registros do vendedor mudam (versão das estatísticas)
+        # ou quando o período vira (novo dia/semana/mês)
+        etag = etag_estatisticas(filtro_vendedor, periodo, data_inicio)
+        if request.method == 'GET':
+            nao_modificado = get_conditional_response(request, etag=etag)
+            if nao_modificado is not None:
+                return _cabecalhos_etag(nao_modificado, etag)
         
-        total_leads = registros.count()
-        conta_para_contato = registros.filter(status_pipeline=StatusPipelineChoices.CONTA_PARA_CONTATO.value).count()
-        contatos_realizados = registros.filter(status_pipeline=StatusPipelineChoices.CONTATO_FEITO.value).count()
-        negociacoes = registros.filter(status_pipeline=StatusPipelineChoices.NEGOCIACAO_COTACAO.value).count()
-        pedidos = registros.filter(status_pipeline=StatusPipelineChoices.PEDIDO_REALIZADO.value).count()
-        contas_ativas = registros.filter(status_pipeline=StatusPipelineChoices.CONTA_ATIVA.value).count()
+        # Intervalo a partir do início do dia (usa índice, ao contrário de criado_em__date)
+        # e todas as contagens em um único aggregate, com cache
+        por_status = resumo_pipeline(filtro_vendedor, criado_desde=inicio_do_dia(data_inicio))['por_status']
+        
+        conta_para_contato = por_status[StatusPipelineChoices.CONTA_PARA_CONTATO.value]
+        contatos_realizados = por_status[StatusPipelineChoices.CONTATO_FEITO.value]
+        negociacoes = por_status[StatusPipelineChoices.NEGOCIACAO_COTACAO.value]
+        pedidos = por_status[StatusPipelineChoices.PEDIDO_REALIZADO.value]
+        contas_ativas = por_status[StatusPipelineChoices.CONTA_ATIVA.value]
+        total_leads = sum(por_status.values())
         
         taxa_contato = round((contatos_realizados / total_leads * 100) if total_leads > 0 else 0)
         taxa_negociacao = round((negociacoes / contatos_realizados * 100) if contatos_realizados > 0 else 0)
         taxa_pedido = round((pedidos / negociacoes * 100) if negociacoes > 0 else 0)
         taxa_recorrencia = round((contas_ativas / pedidos * 100) if pedidos > 0 else 0)
         
-        return JsonResponse({
+        response = JsonResponse({
             'vendedor_nome': vendedor_nome,
             'total_leads': total_leads,
             'conta_para_contato': conta_para_contato,
@@ -1248,9 +1309,9 @@ def desempenho_vendedor_api(request, vendedor_id):
             'taxa_pedido': taxa_pedido,
             'taxa_recorrencia': taxa_recorrencia,
         })
-    except User.DoesNotExist:
-        logger.error(f"[DESEMPENHO_API] Vendedor não encontrado: {vendedor_id}")
-        return JsonResponse({'error': 'Vendedor não encontrado'}, status=404)
+        if request.method == 'GET':
+            _cabecalhos_etag(response, etag)
+        return response
     except Exception as e:
         logger.error(f"[DESEMPENHO_API] Erro inesperado: {str(e)}", exc_info=True)
         return JsonResponse({'error': f'Erro ao processar requisição: {str(e)}'}, status=500)
@@ -1258,33 +1319,66 @@ def desempenho_vendedor_api(request, vendedor_id):
 
 @api_comercial_required
 def carregar_mais_registros_api(request):
-    """API para carregar mais registros paginados."""
+    """
+    API para carregar mais registros paginados.
+
+    Dois modos:
+    - Cursor (recomendado): ?local=...&cursor=<next_cursor anterior>. Paginação
+      keyset, sem OFFSET e sem COUNT (use &incluir_total=1 para receber o total).
+    - Página (legado): ?local=...&page=N. Mantido para compatibilidade.
+    """
     user = request.user
-    pagina = int(request.GET.get('page', 1))
     local = request.GET.get('local', 'backlog')  # backlog ou status_key (ex: a_trabalhar)
     registros_por_pagina = 8
-    offset = (pagina - 1) * registros_por_pagina
     
     # Filtrar registros por vendedor (a menos que seja gestor)
     if user.is_superuser:
-        all_registros = RegistroComercial.objects.all()
+        all_registros = RegistroComercial.objects.para_cards()
     else:
-        all_registros = RegistroComercial.objects.filter(vendedor=user)
+        all_registros = RegistroComercial.objects.para_cards().filter(vendedor=user)
     
     if local == 'backlog':
         # Backlog: registros não ativos
-        registros = all_registros.filter(no_kanban=False).order_by('-criado_em')[offset:offset+registros_por_pagina]
-        total = all_registros.filter(no_kanban=False).count()
+        registros_local = all_registros.filter(no_kanban=False)
     else:
         # Status específico do Kanban
-        registros = all_registros.filter(
+        registros_local = all_registros.filter(
             no_kanban=True, 
             status_pipeline=local
-        ).exclude(status_pipeline=StatusPipelineChoices.ARQUIVADA.value).order_by('-ultimo_contato')[offset:offset+registros_por_pagina]
-        total = all_registros.filter(
-            no_kanban=True, 
-            status_pipeline=local
-        ).exclude(status_pipeline=StatusPipelineChoices.ARQUIVADA.value).count()
+        ).exclude(status_pipeline=StatusPipelineChoices.ARQUIVADA.value)
+    
+    if 'cursor' in request.GET:
+        try:
+            registros, next_cursor = pagina_por_cursor(
+                registros_local,
+                local,
+                cursor=request.GET.get('cursor'),
+                limite=registros_por_pagina,
+            )
+        except CursorInvalido as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        
+        anexar_html_cards((TEMPLATE_CARD_LISTA, registros))
+        cards_html = render_to_string('crm/partials/registro_cards.html', {
+            'registros': registros,
+            'local': local,
+        })
+        
+        resposta = {
+            'html': cards_html,
+            'next_cursor': next_cursor,
+            'tem_mais': next_cursor is not None,
+        }
+        if request.GET.get('incluir_total') == '1':
+            resposta['total'] = registros_local.count()
+        return JsonResponse(resposta)
+    
+    pagina = int(request.GET.get('page', 1))
+    offset = (pagina - 1) * registros_por_pagina
+    
+    registros = list(anotar_chave_cursor(registros_local, local)[offset:offset+registros_por_pagina])
+    anexar_html_cards((TEMPLATE_CARD_LISTA, registros))
+    total = registros_local.count()
     
     # Renderizar cards HTML
     cards_html = render_to_string('crm/partials/registro_cards.html', {
@@ -1300,6 +1394,51 @@ def carregar_mais_registros_api(request):
     })
 
 
+@api_comercial_required
+def buscar_registros_api(request):
+    """
+    API de busca de leads (caixa de busca do Kanban).
+
+    GET ?q=<texto>&vendedor=<id>: nome, cidade, código Winthor ou telefone,
+    sem diferenciar acentos/maiúsculas. Mesmo escopo do Kanban.
+    """
+    vendedor_id = request.GET.get('vendedor')
+    vendedor_id = int(vendedor_id) if vendedor_id and vendedor_id.isdigit() else None
+
+    resultados = [
+        {
+            'id': str(registro.id),
+            'nome_empresa': registro.nome_empresa,
+            'cidade': registro.cidade,
+            'uf': registro.uf,
+            'telefone': registro.telefone,
+            'codigo_winthor': registro.codigo_winthor,
+            'status_pipeline': registro.status_pipeline,
+            'status_label': registro.get_status_pipeline_display(),
+            'no_kanban': registro.no_kanban,
+            'vendedor': registro.vendedor.get_full_name() or registro.vendedor.username,
+            'url': reverse('registrar_contato', args=[registro.id]),
+        }
+        for registro in buscar_registros(request.user, request.GET.get('q', ''), vendedor_id=vendedor_id)
+    ]
+    return JsonResponse({'resultados': resultados})
+
+
+@api_comercial_required
+def autocomplete_cidades_api(request):
+    """
+    API de autocomplete de cidade (cadastro de registro).
+
+    GET ?q=<prefixo>&uf=<UF opcional>: cidades já cadastradas cujo nome começa
+    com o prefixo (sem diferenciar acentos/maiúsculas), mais usadas primeiro.
+    Respondida pelo índice em memória (crm/cidades.py), sem consulta ao banco.
+    """
+    sugestoes = sugerir_cidades(request.GET.get('q', ''), uf=request.GET.get('uf'))
+    return JsonResponse({
+        'sugestoes': [{'cidade': cidade.cidade, 'uf': cidade.uf} for cidade in sugestoes],
+    })
+
+
 @admin_required
 def arquivados_view(request):
     """View para listar leads arquivados - ADMIN ONLY."""
@@ -1307,9 +1446,9 @@ def arquivados_view(request):
     
     # Filtrar arquivados por vendedor (a menos que seja gestor)
     if user.is_superuser:
-        arquivados = RegistroComercial.objects.filter(status_pipeline=StatusPipelineChoices.ARQUIVADA)
+        arquivados = RegistroComercial.objects.para_cards().filter(status_pipeline=StatusPipelineChoices.ARQUIVADA)
     else:
-        arquivados = RegistroComercial.objects.filter(vendedor=user, status_pipeline=StatusPipelineChoices.ARQUIVADA)
+        arquivados = RegistroComercial.objects.para_cards().filter(vendedor=user, status_pipeline=StatusPipelineChoices.ARQUIVADA)
     
     arquivados = arquivados.order_by('-atualizado_em')
     
@@ -1325,12 +1464,14 @@ def arquivados_view(request):
         arquivados_page = paginator.page(paginator.num_pages)
     
     flash_success = request.session.pop('flash_success', None)
+    flash_error = request.session.pop('flash_error', None)
     
     context = {
         'arquivados': arquivados_page,
         'paginator': paginator,
         'page_obj': arquivados_page,
         'flash_success': flash_success,
+        'flash_error': flash_error,
     }
     
     return render(request, 'crm/arquivados.html', context)
@@ -1342,9 +1483,9 @@ def contas_ativas_view(request):
     user = request.user
 
     if user.is_superuser:
-        contas = RegistroComercial.objects.filter(status_pipeline=StatusPipelineChoices.CONTA_ATIVA.value)
+        contas = RegistroComercial.objects.para_cards().filter(status_pipeline=StatusPipelineChoices.CONTA_ATIVA.value)
     else:
-        contas = RegistroComercial.objects.filter(vendedor=user, status_pipeline=StatusPipelineChoices.CONTA_ATIVA.value)
+        contas = RegistroComercial.objects.para_cards().filter(vendedor=user, status_pipeline=StatusPipelineChoices.CONTA_ATIVA.value)
 
     contas = contas.order_by('-atualizado_em')
     
@@ -1379,9 +1520,14 @@ def restaurar_lead(request, registro_id):
         return JsonResponse({'error': 'Sem permissão'}, status=403)
     
     # Restaurar para Conta para Contato
-    registro.status_pipeline = StatusPipelineChoices.CONTA_PARA_CONTATO.value
-    registro.no_kanban = True
-    registro.save()
+    try:
+        with transaction.atomic():
+            registro.status_pipeline = StatusPipelineChoices.CONTA_PARA_CONTATO.value
+            registro.no_kanban = True
+            registro.save()
+    except ConflitoVersao as e:
+        request.session['flash_error'] = str(e)
+        return redirect('arquivados')
     
     request.session['flash_success'] = f'Lead "{registro.nome_empresa}" restaurado com sucesso!'
     return redirect('arquivados')
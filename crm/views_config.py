@@ -7,7 +7,6 @@ from django.contrib.auth.decorators import login_required, user_passes_test
 from django.http import JsonResponse
 from django.db import models
 from .models_config import FunilResultadoConfig, FunilProximoPassoConfig
-from .funil_config_utils import invalidar_cache_funil
 
 
 def admin_required(view_func):
@@ -109,8 +108,6 @@ def criar_resultado(request):
                 ativo=True
             )
             
-            invalidar_cache_funil()
-            
             return JsonResponse({
                 'success': True,
                 'id': resultado.id,
@@ -150,8 +147,6 @@ def editar_resultado(request, resultado_id):
             resultado.next_status_label = next_status
             resultado.save()
             
-            invalidar_cache_funil()
-            
             return JsonResponse({
                 'success': True,
                 'message': 'Resultado atualizado com sucesso'
@@ -173,8 +168,6 @@ def excluir_resultado(request, resultado_id):
             resultado = FunilResultadoConfig.objects.get(id=resultado_id)
             resultado.delete()
             
-            invalidar_cache_funil()
-            
             return JsonResponse({
                 'success': True,
                 'message': 'Resultado excluído com sucesso'
@@ -213,8 +206,6 @@ def criar_passo(request):
                 ativo=True
             )
             
-            invalidar_cache_funil()
-            
             return JsonResponse({
                 'success': True,
                 'id': passo.id,
@@ -239,8 +230,6 @@ def editar_passo(request, passo_id):
                 passo.label = label
                 passo.save()
             
-            invalidar_cache_funil()
-            
             return JsonResponse({
                 'success': True,
                 'message': 'Próximo passo atualizado com sucesso'
@@ -262,8 +251,6 @@ def excluir_passo(request, passo_id):
             passo = FunilProximoPassoConfig.objects.get(id=passo_id)
             passo.delete()
             
-            invalidar_cache_funil()
-            
             return JsonResponse({
                 'success': True,
                 'message': 'Próximo passo excluído com sucesso'
@@ -285,7 +272,6 @@ def toggle_resultado_ativo(request, resultado_id):
             config = FunilResultadoConfig.objects.get(id=resultado_id)
             config.ativo = not config.ativo
             config.save()
-            invalidar_cache_funil()
             return JsonResponse({'success': True, 'ativo': config.ativo})
         except FunilResultadoConfig.DoesNotExist:
             return JsonResponse({'error': 'Não encontrado'}, status=404)
@@ -301,7 +287,6 @@ def toggle_passo_ativo(request, passo_id):
             config = FunilProximoPassoConfig.objects.get(id=passo_id)
             config.ativo = not config.ativo
             config.save()
-            invalidar_cache_funil()
             return JsonResponse({'success': True, 'ativo': config.ativo})
         except FunilProximoPassoConfig.DoesNotExist:
             return JsonResponse({'error': 'Não encontrado'}, status=404)
@@ -0,0 +1,68 @@
+"""
+Stream de eventos do Kanban (Server-Sent Events).
+
+View assíncrona: só faz streaming quando servida via ASGI (config/asgi.py),
+ex.: gunicorn -k uvicorn.workers.UvicornWorker config.asgi:application.
+Via WSGI cada conexão prenderia um worker, então a view responde 204 e o
+EventSource do navegador deixa de reconectar (o Kanban segue funcionando
+com recarga da página).
+"""
+
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+
+from .decorators import is_comercial
+from .eventos_kanban import obter_canal
+
+
+# Comentário SSE periódico: mantém a conexão aberta em proxies e detecta desconexão
+INTERVALO_HEARTBEAT = 15  # segundos
+
+# Espera do navegador antes de reconectar
+RETRY_MS = 5000
+
+
+def _visivel(evento, usuario, vendedor_filtro):
+    """Mesmo escopo do kanban_view: gestor vê todos (ou o vendedor filtrado), vendedor só os seus."""
+    if evento.get('tipo') != 'card':
+        return True
+    if usuario.is_superuser:
+        return vendedor_filtro is None or vendedor_filtro in evento['vendedores']
+    return usuario.id in evento['vendedores']
+
+
+def _formatar(evento):
+    return f"event: {evento['tipo']}\ndata: {json.dumps(evento)}\n\n"
+
+
+async def eventos_kanban_stream(request):
+    """GET /crm/api/kanban/eventos/?vendedor=<id> (text/event-stream)."""
+    usuario = await request.auser()
+    if not usuario.is_authenticated:
+        return JsonResponse({'error': 'Autenticação necessária. Por favor, faça login.'}, status=401)
+    if not await sync_to_async(is_comercial)(usuario):
+        return JsonResponse({'error': 'Sem permissão para acessar este recurso.'}, status=403)
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+
+    vendedor_filtro = request.GET.get('vendedor')
+    vendedor_filtro = int(vendedor_filtro) if vendedor_filtro and vendedor_filtro.isdigit() else None
+
+    async def fluxo():
+        yield f'retry: {RETRY_MS}\n\n'
+        async with obter_canal().assinar() as assinatura:
+            while True:
+                evento = await assinatura.proximo(INTERVALO_HEARTBEAT)
+                if evento is None:
+                    yield ': ping\n\n'
+                elif _visivel(evento, usuario, vendedor_filtro):
+                    yield _formatar(evento)
+
+    response = StreamingHttpResponse(fluxo(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Nginx/Traefik não devem bufferizar o stream
+    response['X-Accel-Buffering'] = 'no'
+    return response